@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import json
+import time
+from pathlib import Path
+
+from config import AI_MAX_CONCURRENCY, AI_TIMEOUT_SEC, ENV_OPENAI_API_KEY, env
+from domain.metrics import record_metric
+
+CHAT_MODEL = "gpt-4o-mini"
+TRANSCRIBE_MODEL = "whisper-1"
+
+# One AsyncOpenAI client (and its HTTP connection pool) per event loop and key.
+_CLIENT = None
+_CLIENT_SIG: tuple | None = None
+_SEM: asyncio.Semaphore | None = None
+_SEM_LOOP = None
+
+
+def ai_available() -> bool:
+    if not env(ENV_OPENAI_API_KEY, ""):
+        return False
+    try:
+        import openai  # noqa: F401
+    except Exception:
+        return False
+    return True
+
+
+def _client():
+    global _CLIENT, _CLIENT_SIG
+    from openai import AsyncOpenAI
+
+    api_key = env(ENV_OPENAI_API_KEY, "")
+    sig = (api_key, id(asyncio.get_running_loop()))
+    if _CLIENT is None or _CLIENT_SIG != sig:
+        _CLIENT = AsyncOpenAI(api_key=api_key, timeout=AI_TIMEOUT_SEC, max_retries=1)
+        _CLIENT_SIG = sig
+    return _CLIENT
+
+
+def _semaphore() -> asyncio.Semaphore:
+    global _SEM, _SEM_LOOP
+    loop = asyncio.get_running_loop()
+    if _SEM is None or _SEM_LOOP is not loop:
+        _SEM = asyncio.Semaphore(max(1, AI_MAX_CONCURRENCY))
+        _SEM_LOOP = loop
+    return _SEM
+
+
+async def _call(op: str, make_request):
+    """Runs one OpenAI request under the shared semaphore and records wait/latency metrics."""
+    t_wait = time.perf_counter()
+    async with _semaphore():
+        wait_ms = int((time.perf_counter() - t_wait) * 1000)
+        t0 = time.perf_counter()
+        try:
+            out = await asyncio.wait_for(make_request(_client()), timeout=AI_TIMEOUT_SEC)
+        except Exception as exc:
+            record_metric("ai_call", ok=False, latency_ms=int((time.perf_counter() - t0) * 1000), op=op, wait_ms=wait_ms, error=type(exc).__name__)
+            raise
+    record_metric("ai_call", ok=True, latency_ms=int((time.perf_counter() - t0) * 1000), op=op, wait_ms=wait_ms)
+    return out
+
+
+async def chat_json(system_prompt: str, user_content: str, op: str = "chat") -> dict | None:
+    """Chat completion in JSON mode; None on any failure so callers can fall back."""
+    if not ai_available():
+        return None
+    try:
+        response = await _call(
+            op,
+            lambda client: client.chat.completions.create(
+                model=CHAT_MODEL,
+                messages=[
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": user_content},
+                ],
+                response_format={"type": "json_object"},
+            ),
+        )
+        return json.loads(response.choices[0].message.content)
+    except Exception:
+        return None
+
+
+async def transcribe(path: Path | str, language: str = "pl") -> str:
+    data = Path(path).read_bytes()
+    out = await _call(
+        "transcribe",
+        lambda client: client.audio.transcriptions.create(
+            model=TRANSCRIBE_MODEL,
+            file=(Path(path).name, data),
+            language=language,
+        ),
+    )
+    txt = getattr(out, "text", None)
+    if txt is None and isinstance(out, dict):
+        txt = out.get("text")
+    return (txt or "").strip()
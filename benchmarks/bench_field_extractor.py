@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+"""Micro-benchmark: legacy multi-pass regex extraction vs domain.text_scan.
+
+Run from the repo root:
+
+    python benchmarks/bench_field_extractor.py [--repeat 20]
+
+The legacy path below is a frozen copy of the pre-text_scan extractor plus the
+separate NIP / IBAN / currency passes handle_file used to make, so both sides
+do the same amount of work per document.
+"""
+import argparse
+import random
+import re
+import statistics
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from domain import text_scan  # noqa: E402
+from domain.utils import normalize_text, parse_amount  # noqa: E402
+from ocr_service import _extract_fields_regex  # noqa: E402
+
+
+def _legacy_normalize_date(s: str) -> str:
+    s = (s or "").strip()
+    for f in ("%Y-%m-%d", "%Y/%m/%d", "%Y.%m.%d", "%d.%m.%Y", "%d-%m-%Y", "%d/%m/%Y"):
+        try:
+            return datetime.strptime(s, f).strftime("%Y-%m-%d")
+        except Exception:
+            pass
+    return ""
+
+
+def _legacy_extract(t: str) -> dict:
+    m_date = re.search(r"(?:data|dnia|wystawienia|sprzedaży).*?(\d{4}[-./]\d{2}[-./]\d{2}|\d{2}[-./]\d{2}[-./]\d{4})", t, re.IGNORECASE | re.DOTALL)
+    if not m_date:
+        m_date = re.search(r"\b(\d{4}[-./]\d{2}[-./]\d{2})\b", t)
+    inv_date = _legacy_normalize_date(m_date.group(1)) if m_date else ""
+
+    m_no = re.search(r"(?:Faktura|FV|Nr)\s*(?:VAT|nr)?\s*[:.]?\s*([A-Z0-9/.-]{4,})", t, re.IGNORECASE)
+    inv_no = re.sub(r"[.,]$", "", m_no.group(1).strip()) if m_no else ""
+
+    candidates = []
+    for pat in (
+        r"(?:do\s+zapłaty|razem|suma|total|kwota\s+do\s+zapłaty)\s*:?\s*([0-9\s.,]+(?:PLN|zł|zlt)?)",
+        r"([0-9\s.,]+)\s*(?:PLN|zł|zlt)",
+    ):
+        for match in re.finditer(pat, t, re.IGNORECASE):
+            val = parse_amount(match.group(1))
+            if 0 < val < 1000000:
+                candidates.append(val)
+    gross = max(candidates) if candidates else 0.0
+
+    m_seller = re.search(r"(?:Sprzedawca|Wystawca|Dostawca)[:\s]*\n?(.+)", t, re.IGNORECASE)
+    seller = normalize_text(m_seller.group(1)[:80]) if m_seller else ""
+
+    # The three extra passes handle_file made through premium_ocr / payments.
+    up = t.upper()
+    if "EUR" in up or "€" in up:
+        currency = "EUR"
+    elif "USD" in up or "$" in up:
+        currency = "USD"
+    elif "GBP" in up or "£" in up:
+        currency = "GBP"
+    else:
+        currency = "PLN"
+    m_nip = re.search(r"(?:NIP|VAT\s*ID)[:\s]*([0-9-]{10,13})", t, re.IGNORECASE)
+    nip = "".join(filter(str.isdigit, m_nip.group(1))) if m_nip else ""
+    clean = t.replace(" ", "").replace("-", "")
+    m_iban = re.search(r"PL[0-9]{26}", clean, re.IGNORECASE) or re.search(r"[0-9]{26}", clean)
+
+    return {
+        "date": inv_date,
+        "no": inv_no,
+        "company": seller,
+        "gross": f"{gross:.2f}" if gross else "",
+        "currency": currency,
+        "nip": nip,
+        "iban": m_iban.group(0) if m_iban else "",
+    }
+
+
+def _new_extract(t: str) -> dict:
+    text_scan.scan.cache_clear()  # measure the scan itself, not the memo
+    out = _extract_fields_regex(t)
+    found = text_scan.scan(t)
+    out.update(currency=found["currency"], nip=found["nip"], iban=found["iban"])
+    return out
+
+
+_WORDS = "towar usluga sztuk netto stawka vat wartosc pozycja opis kod ilosc jm cena rabat".split()
+
+
+def _page(rng: random.Random, lines: int, with_header: bool) -> str:
+    out = []
+    if with_header:
+        out += [
+            "FAKTURA VAT Nr FV/%d/2026" % rng.randint(1, 999),
+            "Data wystawienia: %02d.%02d.2026" % (rng.randint(1, 28), rng.randint(1, 12)),
+            "Sprzedawca:",
+            "Hurtownia Danex Sp. z o.o.",
+            "NIP: 123-456-78-90",
+        ]
+    for i in range(lines):
+        words = " ".join(rng.choice(_WORDS) for _ in range(rng.randint(3, 9)))
+        out.append(f"{i + 1} {words} {rng.randint(1, 99)} {rng.randint(1, 9999)},{rng.randint(0, 99):02d} zł")
+    return "\n".join(out)
+
+
+def build_corpus(docs: int = 20, seed: int = 7) -> dict[str, list[str]]:
+    rng = random.Random(seed)
+    corpus = {
+        "1 page / 40 lines": [_page(rng, 40, True) for _ in range(docs)],
+        "3 pages / 400 lines": [
+            "\n\n".join([_page(rng, 150, True), _page(rng, 150, False), _page(rng, 100, False) + "\nDo zapłaty: 12 345,67 PLN"])
+            for _ in range(docs)
+        ],
+        # Date keyword early, no date anywhere: worst case for the old DOTALL `.*?` search.
+        "3 pages, no dates": [
+            "\n\n".join("data " + _page(rng, 150, False).replace(".", " ") for _ in range(3)) for _ in range(docs)
+        ],
+    }
+    return corpus
+
+
+def _time(fn, texts, repeat: int) -> list[float]:
+    runs = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        for t in texts:
+            fn(t)
+        runs.append((time.perf_counter() - t0) * 1000 / len(texts))
+    return runs
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--repeat", type=int, default=20)
+    ap.add_argument("--docs", type=int, default=20)
+    args = ap.parse_args()
+
+    print(f"{'corpus':<22} {'chars':>8} {'legacy ms':>10} {'scan ms':>9} {'speedup':>8}")
+    for name, texts in build_corpus(args.docs).items():
+        legacy = statistics.median(_time(_legacy_extract, texts, args.repeat))
+        new = statistics.median(_time(_new_extract, texts, args.repeat))
+        chars = int(statistics.mean(len(t) for t in texts))
+        print(f"{name:<22} {chars:>8} {legacy:>10.3f} {new:>9.3f} {legacy / new if new else 0:>7.1f}x")
+
+        mismatched = [t for t in texts if _legacy_extract(t)["gross"] != _new_extract(t)["gross"]]
+        if mismatched:
+            # Legacy `[0-9\s.,]+` runs glue a line's quantity column onto its price.
+            sample = mismatched[0]
+            print(
+                f"  gross differs on {len(mismatched)}/{len(texts)} docs, "
+                f"e.g. legacy {_legacy_extract(sample)['gross']} vs scan {_new_extract(sample)['gross']}"
+            )
+
+
+if __name__ == "__main__":
+    main()
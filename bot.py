@@ -7,6 +7,9 @@ from telegram.ext import ApplicationBuilder, ContextTypes
 from datetime import datetime
 
 from config import ENV_TG, LOGS_DIR, backup_env_file, must, validate_startup_env
+from domain import company_index
+from domain.metrics import flush_counts
+from domain.rag_bridge import shutdown_rag_worker
 from domain.retention import apply_retention
 from handlers.callbacks import register as register_callbacks
 from handlers.commands import register as register_commands
@@ -14,6 +17,8 @@ from handlers.errors import on_error
 from handlers.files import register as register_files
 from handlers.messages import register as register_messages
 from handlers.reminders import register_reminders
+from ocr_service import shutdown_ocr_pool, warm_ocr_lang
+from storage_router import aclose as close_storage
 
 
 def setup_logging() -> None:
@@ -43,6 +48,14 @@ def setup_logging() -> None:
 setup_logging()
 log = structlog.get_logger("danex.faktury")
 
+async def _on_shutdown(app) -> None:
+    shutdown_ocr_pool()
+    await shutdown_rag_worker()
+    await close_storage()
+    company_index.flush()
+    flush_counts()
+
+
 async def heartbeat_task(context: ContextTypes.DEFAULT_TYPE) -> None:
     """Senior IT: Regular sign of life."""
     log.info("bot_heartbeat", status="alive", timestamp=datetime.now().isoformat())
@@ -73,7 +86,10 @@ def main():
         else:
             log.error(f"STARTUP CHECK: {name} ... FAIL ({det})")
 
-    app = ApplicationBuilder().token(must(ENV_TG)).build()
+    # The tesseract language probe is slow; have it ready before the first upload.
+    warm_ocr_lang()
+
+    app = ApplicationBuilder().token(must(ENV_TG)).post_shutdown(_on_shutdown).build()
 
     # Senior IT: Pulse heartbeat every hour
     if app.job_queue:
@@ -50,6 +50,27 @@ ENV_MAMA_VOICE_ENABLED = "MAMA_VOICE_ENABLED"
 ENV_MAMA_FAVORITE_SHOPS = "MAMA_FAVORITE_SHOPS"
 ENV_MAMA_STUCK_ALERT_MIN = "MAMA_STUCK_ALERT_MIN"
 ENV_MAMA_CANCEL_ALERT_STREAK = "MAMA_CANCEL_ALERT_STREAK"
+ENV_STORAGE_CACHE_TTL_SEC = "STORAGE_CACHE_TTL_SEC"
+ENV_API_LIST_PAGE_SIZE = "API_LIST_PAGE_SIZE"
+ENV_API_FETCH_WORKERS = "API_FETCH_WORKERS"
+ENV_API_INVOICE_CACHE_TTL_SEC = "API_INVOICE_CACHE_TTL_SEC"
+ENV_OCR_WORKERS = "OCR_WORKERS"
+ENV_OCR_QUEUE_LIMIT = "OCR_QUEUE_LIMIT"
+ENV_OCR_CACHE_MAX_MB = "OCR_CACHE_MAX_MB"
+ENV_AI_MAX_CONCURRENCY = "AI_MAX_CONCURRENCY"
+ENV_AI_TIMEOUT_SEC = "AI_TIMEOUT_SEC"
+ENV_RAG_TIMEOUT_SEC = "RAG_TIMEOUT_SEC"
+ENV_RAG_START_TIMEOUT_SEC = "RAG_START_TIMEOUT_SEC"
+ENV_SOFT_DUP_DATE_TOLERANCE_DAYS = "SOFT_DUP_DATE_TOLERANCE_DAYS"
+ENV_SOFT_DUP_AMOUNT_TOLERANCE = "SOFT_DUP_AMOUNT_TOLERANCE"
+ENV_PHASH_MAX_DISTANCE = "PHASH_MAX_DISTANCE"
+ENV_BREAKER_FAILURES = "BREAKER_FAILURES"
+ENV_BREAKER_RESET_SEC = "BREAKER_RESET_SEC"
+ENV_STORAGE_BACKEND = "STORAGE_BACKEND"
+ENV_SQLITE_SYNC_SEC = "SQLITE_SYNC_SEC"
+ENV_SHEETS_DELTA_SYNC = "SHEETS_DELTA_SYNC"
+ENV_SHEETS_FULL_SYNC_SEC = "SHEETS_FULL_SYNC_SEC"
+ENV_OWN_NIPS = "OWN_NIPS"
 
 SAFE_MODE = env(ENV_SAFE_MODE, "1") == "1"
 RUN_GSHEETS_INTEGRATION = env(ENV_RUN_GSHEETS_INTEGRATION, "0") == "1"
@@ -65,6 +86,28 @@ HEALTH_ALERT_COOLDOWN_MIN = int(env(ENV_HEALTH_ALERT_COOLDOWN_MIN, "30") or "30"
 MAMA_VOICE_ENABLED = env(ENV_MAMA_VOICE_ENABLED, "0") == "1"
 MAMA_STUCK_ALERT_MIN = int(env(ENV_MAMA_STUCK_ALERT_MIN, "15") or "15")
 MAMA_CANCEL_ALERT_STREAK = int(env(ENV_MAMA_CANCEL_ALERT_STREAK, "3") or "3")
+STORAGE_CACHE_TTL_SEC = int(env(ENV_STORAGE_CACHE_TTL_SEC, "60") or "60")
+API_LIST_PAGE_SIZE = int(env(ENV_API_LIST_PAGE_SIZE, "100") or "100")
+API_FETCH_WORKERS = int(env(ENV_API_FETCH_WORKERS, "8") or "8")
+API_INVOICE_CACHE_TTL_SEC = int(env(ENV_API_INVOICE_CACHE_TTL_SEC, "30") or "30")
+OCR_WORKERS = max(1, int(env(ENV_OCR_WORKERS, "2") or "2"))
+OCR_QUEUE_LIMIT = max(0, int(env(ENV_OCR_QUEUE_LIMIT, "8") or "8"))
+OCR_CACHE_MAX_MB = int(env(ENV_OCR_CACHE_MAX_MB, "50") or "50")
+AI_MAX_CONCURRENCY = int(env(ENV_AI_MAX_CONCURRENCY, "4") or "4")
+AI_TIMEOUT_SEC = float(env(ENV_AI_TIMEOUT_SEC, "30") or "30")
+RAG_TIMEOUT_SEC = float(env(ENV_RAG_TIMEOUT_SEC, "60") or "60")
+RAG_START_TIMEOUT_SEC = float(env(ENV_RAG_START_TIMEOUT_SEC, "120") or "120")
+SOFT_DUP_DATE_TOLERANCE_DAYS = max(0, int(env(ENV_SOFT_DUP_DATE_TOLERANCE_DAYS, "0") or "0"))
+SOFT_DUP_AMOUNT_TOLERANCE = float(env(ENV_SOFT_DUP_AMOUNT_TOLERANCE, "0") or "0")
+PHASH_MAX_DISTANCE = int(env(ENV_PHASH_MAX_DISTANCE, "6") or "6")
+BREAKER_FAILURES = max(1, int(env(ENV_BREAKER_FAILURES, "5") or "5"))
+BREAKER_RESET_SEC = float(env(ENV_BREAKER_RESET_SEC, "30") or "30")
+# "sheets" reads and writes the sheet directly; "sqlite" serves the bot from a local mirror synced in the background.
+STORAGE_BACKEND = (env(ENV_STORAGE_BACKEND, "sheets") or "sheets").strip().lower()
+SQLITE_SYNC_SEC = max(10, int(env(ENV_SQLITE_SYNC_SEC, "60") or "60"))
+SHEETS_DELTA_SYNC = env(ENV_SHEETS_DELTA_SYNC, "1") == "1"
+# Edits to unwatched cells of older rows are only seen by a full read; keep that gap to minutes.
+SHEETS_FULL_SYNC_SEC = int(env(ENV_SHEETS_FULL_SYNC_SEC, "300") or "300")
 
 # --- Paths ---
 BASE_DIR = Path(__file__).parent
@@ -120,6 +163,8 @@ MAMA_FAVORITE_SHOPS = parse_csv_list(
     env(ENV_MAMA_FAVORITE_SHOPS, ""),
     default=["Biedronka", "Apteka", "Lidl", "Rossmann", "Carrefour"],
 )
+# Our own NIP(s): on a purchase invoice they belong to the buyer, never to the supplier.
+OWN_NIPS = frozenset("".join(filter(str.isdigit, p)) for p in parse_csv_list(env(ENV_OWN_NIPS, "")))
 
 
 def parse_user_id_set(raw: str):
@@ -7,7 +7,7 @@ from pathlib import Path
 
 from config import COL_DATE, COL_GROSS, COL_STATUS, STATUS_SENT
 from domain.invoices import missing_fields
-from ocr_service import parse_amount
+from domain.utils import parse_amount
 from sheets_service import get_all_values, update_cell
 
 
@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+"""Column projections of sheet rows.
+
+Readers that need a few columns get ``(row_nos, {col: values})``: the sheet row
+number of every kept data row and, per requested 1-based column, the values aligned
+with it. ``month`` ("YYYY-MM") keeps only rows whose date starts with it.
+"""
+from config import COL_DATE
+
+Columns = tuple[list[int], dict[int, list[str]]]
+
+
+def _at(r: list, col: int) -> str:
+    v = r[col - 1] if len(r) >= col else ""
+    return "" if v is None else str(v)
+
+
+def project(rows: list[list], cols, month: str | None = None, first_row: int = 2) -> Columns:
+    """Projects data rows (header already removed) that start at sheet row ``first_row``."""
+    cols = list(cols)
+    row_nos: list[int] = []
+    out: dict[int, list[str]] = {c: [] for c in cols}
+    for row_no, r in enumerate(rows, first_row):
+        if month and not _at(r, COL_DATE).startswith(month):
+            continue
+        row_nos.append(row_no)
+        for c in cols:
+            out[c].append(_at(r, c))
+    return row_nos, out
+
+
+def from_arrays(arrays: dict[int, list], cols, month: str | None = None) -> Columns:
+    """Same result from per-column arrays that all start at sheet row 2 (e.g. a batchGet)."""
+    n = max((len(v) for v in arrays.values()), default=0)
+    width = max(arrays, default=0)
+    rows = [[""] * width for _ in range(n)]
+    for col, values in arrays.items():
+        for i, v in enumerate(values):
+            rows[i][col - 1] = "" if v is None else str(v)
+    return project(rows, cols, month)
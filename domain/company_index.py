@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+"""Trigram index of canonical supplier names.
+
+Names are normalised once (accent-folded, punctuation and legal forms such as
+"Sp. z o.o." dropped) and indexed by padded trigrams, so a lookup scores only the
+names sharing a trigram with the query. Aliases map a normalised misspelling
+(usually an OCR reading the operator corrected) straight to its canonical name.
+State lives in ``DATA_DIR/company_index.json``; per-invoice counts are written at
+most every ``SAVE_EVERY_SEC`` and on ``flush()`` at shutdown.
+"""
+import heapq
+import json
+import re
+import threading
+import time
+from collections import Counter
+
+from config import DATA_DIR
+from domain.search_index import fold
+
+INDEX_FILE = DATA_DIR / "company_index.json"
+
+# Dice similarity on trigrams; "Biedronk" vs "Biedronka" scores ~0.84.
+MATCH_CUTOFF = 0.6
+# Counts only order the keyboards; losing a few seconds of them on a crash is fine.
+SAVE_EVERY_SEC = 30.0
+
+_LEGAL_FORM_RE = re.compile(
+    r"\b(?:sp(?:olka)?\s+z\s+o\s+o|spolka\s+(?:akcyjna|jawna|komandytowa|cywilna)|sp\s+[jkp]|s\s+[ac]|z\s+o\s+o)\b"
+)
+
+_LOCK = threading.Lock()
+_LOADED = False
+_COUNTS: Counter = Counter()
+_ALIASES: dict[str, str] = {}
+_NORM: dict[str, str] = {}
+_BY_NORM: dict[str, str] = {}
+_GRAMS: dict[str, set[str]] = {}
+_GRAM_COUNT: dict[str, int] = {}
+_DIRTY = False
+_SAVED_AT = 0.0
+
+
+def normalize(name: str) -> str:
+    s = re.sub(r"[^\w]+", " ", fold(name)).replace("_", " ")
+    s = _LEGAL_FORM_RE.sub(" ", s)
+    return " ".join(s.split())
+
+
+def _trigrams(norm: str) -> set[str]:
+    s = f"  {norm} "
+    return {s[i:i + 3] for i in range(len(s) - 2)}
+
+
+def _register(name: str) -> None:
+    if name in _NORM:
+        return
+    norm = normalize(name)
+    if not norm:
+        return
+    _NORM[name] = norm
+    # The first spelling seen for a normalised form stays canonical.
+    _BY_NORM.setdefault(norm, name)
+    grams = _trigrams(norm)
+    _GRAM_COUNT[name] = len(grams)
+    for g in grams:
+        _GRAMS.setdefault(g, set()).add(name)
+
+
+def _load() -> None:
+    global _LOADED
+    if _LOADED:
+        return
+    _LOADED = True
+    if not INDEX_FILE.exists():
+        return
+    try:
+        data = json.loads(INDEX_FILE.read_text(encoding="utf-8"))
+    except Exception:
+        return
+    for name, cnt in (data.get("names") or {}).items():
+        _COUNTS[name] = int(cnt)
+        _register(name)
+    _ALIASES.update(data.get("aliases") or {})
+
+
+def _save() -> None:
+    global _DIRTY, _SAVED_AT
+    data = {"names": dict(_COUNTS), "aliases": _ALIASES}
+    tmp = INDEX_FILE.with_suffix(".tmp")
+    tmp.write_text(json.dumps(data, ensure_ascii=False, indent=2), encoding="utf-8")
+    tmp.replace(INDEX_FILE)
+    _DIRTY = False
+    _SAVED_AT = time.monotonic()
+
+
+def flush() -> None:
+    """Writes counts still held back by ``observe``."""
+    with _LOCK:
+        if _DIRTY:
+            _save()
+
+
+def is_empty() -> bool:
+    with _LOCK:
+        _load()
+        return not _COUNTS
+
+
+def add_names(names, count: int = 0) -> None:
+    """Makes names known (e.g. favourites) without inflating their popularity."""
+    with _LOCK:
+        _load()
+        new = [n.strip() for n in names if (n or "").strip() and n.strip() not in _COUNTS]
+        for name in new:
+            _COUNTS[name] += count
+            _register(name)
+        if new:
+            _save()
+
+
+def seed_from_rows(rows: list[list], col: int) -> None:
+    seed_names(r[col - 1] for r in rows[1:] if len(r) >= col)
+
+
+def seed_names(names) -> None:
+    """Counts every name of a company column (e.g. from ``storage_router.aget_columns``)."""
+    counts = Counter((n or "").strip() for n in names)
+    with _LOCK:
+        _load()
+        for name, cnt in counts.items():
+            if len(name) >= 2:
+                _COUNTS[name] += cnt
+                _register(name)
+        _save()
+
+
+def observe(name: str) -> None:
+    """Counts one more invoice for ``name`` (keeps keyboard suggestions ordered by use)."""
+    global _DIRTY
+    name = (name or "").strip()
+    if len(name) < 2:
+        return
+    with _LOCK:
+        _load()
+        _COUNTS[name] += 1
+        _register(name)
+        _DIRTY = True
+        if time.monotonic() - _SAVED_AT >= SAVE_EVERY_SEC:
+            _save()
+
+
+def learn_alias(alias: str, canonical: str) -> None:
+    """Remembers that ``alias`` (e.g. an OCR reading) means ``canonical``."""
+    norm = normalize(alias)
+    canonical = (canonical or "").strip()
+    if not norm or not canonical or norm == normalize(canonical):
+        return
+    with _LOCK:
+        _load()
+        _register(canonical)
+        _COUNTS.setdefault(canonical, 0)
+        _ALIASES[norm] = canonical
+        _save()
+
+
+def resolve(name: str) -> str | None:
+    """Exact lookup only: a learned alias or the same normalised name."""
+    norm = normalize(name)
+    if not norm:
+        return None
+    with _LOCK:
+        _load()
+        return _ALIASES.get(norm) or _BY_NORM.get(norm)
+
+
+def top_matches(name: str, k: int = 5, cutoff: float = MATCH_CUTOFF) -> list[tuple[str, float]]:
+    norm = normalize(name)
+    if not norm:
+        return []
+    grams = _trigrams(norm)
+    with _LOCK:
+        _load()
+        shared: Counter = Counter()
+        for g in grams:
+            for cand in _GRAMS.get(g, ()):
+                shared[cand] += 1
+        scored = []
+        for cand, common in shared.items():
+            score = 2 * common / (len(grams) + _GRAM_COUNT[cand])
+            if score >= cutoff:
+                scored.append((score, _COUNTS[cand], cand))
+    return [(cand, round(score, 3)) for score, _, cand in heapq.nlargest(k, scored)]
+
+
+def match_in(name: str, names, cutoff: float = MATCH_CUTOFF) -> str | None:
+    """Closest of ``names`` to ``name``; the candidates are scored here and never added to the index."""
+    norm = normalize(name)
+    if not norm:
+        return None
+    by_norm: dict[str, str] = {}
+    for cand in names:
+        cand = (cand or "").strip()
+        if normalize(cand):
+            by_norm.setdefault(normalize(cand), cand)
+    with _LOCK:
+        _load()
+        alias = _ALIASES.get(norm)
+    exact = by_norm.get(normalize(alias)) if alias else None
+    if exact or norm in by_norm:
+        return exact or by_norm[norm]
+    grams = _trigrams(norm)
+    best, best_score = None, cutoff
+    for cand_norm, cand in by_norm.items():
+        cand_grams = _trigrams(cand_norm)
+        score = 2 * len(grams & cand_grams) / (len(grams) + len(cand_grams))
+        if score >= best_score and (best is None or score > best_score):
+            best, best_score = cand, score
+    return best
+
+
+def best_match(name: str) -> str | None:
+    hit = resolve(name)
+    if hit:
+        return hit
+    found = top_matches(name, k=1)
+    return found[0][0] if found else None
+
+
+def top(limit: int) -> list[str]:
+    """Most used company names, for the mama keyboards."""
+    with _LOCK:
+        _load()
+        return [name for name, cnt in _COUNTS.most_common() if cnt > 0][:max(0, limit)]
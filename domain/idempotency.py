@@ -1,24 +1,42 @@
 ﻿# -*- coding: utf-8 -*-
 import json
-from datetime import datetime
+from datetime import date, datetime, timedelta
 
-from config import DATA_DIR
+from config import DATA_DIR, PHASH_MAX_DISTANCE, SOFT_DUP_AMOUNT_TOLERANCE, SOFT_DUP_DATE_TOLERANCE_DAYS
+from domain.utils import parse_amount
 
 _INDEX_FILE = DATA_DIR / "file_hash_index.json"
 _CONTENT_INDEX_FILE = DATA_DIR / "content_hash_index.json"
+_UPLOAD_INDEX_FILE = DATA_DIR / "upload_id_index.json"
+_SOFT_INDEX_FILE = DATA_DIR / "soft_dup_index.json"
+_PHASH_INDEX_FILE = DATA_DIR / "phash_index.json"
+
+# Leading characters of the normalised company name compared by the soft-duplicate check.
+_COMPANY_PREFIX_LEN = 10
+
+# path -> (mtime_ns, data); re-read only when the file changed (e.g. after retention pruned it).
+_CACHE: dict = {}
 
 
 def _load_index(path) -> dict:
-    if not path.exists():
+    try:
+        mtime = path.stat().st_mtime_ns
+    except OSError:
         return {}
+    hit = _CACHE.get(path)
+    if hit and hit[0] == mtime:
+        return hit[1]
     try:
-        return json.loads(path.read_text(encoding="utf-8"))
+        data = json.loads(path.read_text(encoding="utf-8"))
     except Exception:
         return {}
+    _CACHE[path] = (mtime, data)
+    return data
 
 
 def _save_index(path, data: dict) -> None:
     path.write_text(json.dumps(data, ensure_ascii=False, indent=2), encoding="utf-8")
+    _CACHE[path] = (path.stat().st_mtime_ns, data)
 
 
 def _stamp(row_no: int, file_link: str = "", user_id: int | None = None) -> dict:
@@ -56,3 +74,196 @@ def register_content_hash(content_hash: str, row_no: int, file_link: str = "", u
     data = _load_index(_CONTENT_INDEX_FILE)
     data[content_hash] = _stamp(row_no=row_no, file_link=file_link, user_id=user_id)
     _save_index(_CONTENT_INDEX_FILE, data)
+
+
+def find_duplicate_upload(file_unique_id: str):
+    """Telegram file_unique_id lookup - catches exact re-forwards before download."""
+    if not file_unique_id:
+        return None
+    return _load_index(_UPLOAD_INDEX_FILE).get(file_unique_id)
+
+
+def register_upload_id(file_unique_id: str, row_no: int, file_link: str = "", user_id: int | None = None):
+    if not file_unique_id:
+        return
+    data = _load_index(_UPLOAD_INDEX_FILE)
+    data[file_unique_id] = _stamp(row_no=row_no, file_link=file_link, user_id=user_id)
+    _save_index(_UPLOAD_INDEX_FILE, data)
+
+
+# --- Soft duplicates: same invoice, different file (a re-scan or a second photo) ---
+# Layout: {"YYYY-MM-DD": {"<gross in grosze>": {"<company prefix>": stamp}}}.
+
+def _soft_parts(inv_date: str, gross, company: str):
+    try:
+        d = date.fromisoformat((inv_date or "").strip()[:10])
+    except ValueError:
+        return None
+    cents = round(parse_amount(gross) * 100)
+    if cents <= 0:
+        return None
+    from domain.company_index import normalize
+
+    return d, cents, normalize(company)[:_COMPANY_PREFIX_LEN]
+
+
+def find_soft_duplicate(inv_date: str, gross, company: str):
+    """Stamp (with the real row number) of an invoice with the same date, gross and company prefix.
+
+    Date and amount may differ by SOFT_DUP_DATE_TOLERANCE_DAYS / SOFT_DUP_AMOUNT_TOLERANCE; each
+    lookup touches only the buckets of the dates in that window.
+    """
+    parts = _soft_parts(inv_date, gross, company)
+    if not parts:
+        return None
+    d, cents, prefix = parts
+    tol = round(SOFT_DUP_AMOUNT_TOLERANCE * 100)
+    data = _load_index(_SOFT_INDEX_FILE)
+    for offset in range(-SOFT_DUP_DATE_TOLERANCE_DAYS, SOFT_DUP_DATE_TOLERANCE_DAYS + 1):
+        by_gross = data.get((d + timedelta(days=offset)).isoformat())
+        if not by_gross:
+            continue
+        if tol:
+            buckets = [v for k, v in by_gross.items() if abs(int(k) - cents) <= tol]
+        else:
+            buckets = [by_gross.get(str(cents)) or {}]
+        for bucket in buckets:
+            for ex_prefix, stamp in bucket.items():
+                if ex_prefix.startswith(prefix) or prefix.startswith(ex_prefix):
+                    return stamp
+    return None
+
+
+def register_soft_duplicate(inv_date: str, gross, company: str, row_no: int, file_link: str = "", user_id: int | None = None):
+    parts = _soft_parts(inv_date, gross, company)
+    if not parts:
+        return
+    d, cents, prefix = parts
+    data = _load_index(_SOFT_INDEX_FILE)
+    data.setdefault(d.isoformat(), {}).setdefault(str(cents), {})[prefix] = _stamp(row_no=row_no, file_link=file_link, user_id=user_id)
+    _save_index(_SOFT_INDEX_FILE, data)
+
+
+def soft_row_matches(row: list | None, inv_date: str, gross, company: str, col_date: int, col_gross: int, col_comp: int) -> bool:
+    """True when the sheet row still holds an invoice the soft check would flag; sorted or edited rows do not."""
+    if not row or len(row) < max(col_date, col_gross, col_comp):
+        return False
+    have = _soft_parts(row[col_date - 1], row[col_gross - 1], row[col_comp - 1])
+    want = _soft_parts(inv_date, gross, company)
+    if not have or not want:
+        return False
+    return (
+        abs((have[0] - want[0]).days) <= SOFT_DUP_DATE_TOLERANCE_DAYS
+        and abs(have[1] - want[1]) <= round(SOFT_DUP_AMOUNT_TOLERANCE * 100)
+        and (have[2].startswith(want[2]) or want[2].startswith(have[2]))
+    )
+
+
+def forget_soft_duplicate(stamp: dict) -> None:
+    """Drops a stale entry (its row now holds another invoice), so later lookups skip it."""
+    data = _load_index(_SOFT_INDEX_FILE)
+    for day, by_gross in list(data.items()):
+        for cents, bucket in list(by_gross.items()):
+            for prefix, st in list(bucket.items()):
+                if st == stamp:
+                    del bucket[prefix]
+            if not bucket:
+                del by_gross[cents]
+        if not by_gross:
+            del data[day]
+    _save_index(_SOFT_INDEX_FILE, data)
+
+
+def soft_index_seeded() -> bool:
+    return _SOFT_INDEX_FILE.exists()
+
+
+def seed_soft_index(load_rows, col_date: int, col_gross: int, col_comp: int) -> None:
+    """Builds the soft-duplicate index from sheet rows once; ``load_rows`` is only called when it is missing."""
+    if _SOFT_INDEX_FILE.exists():
+        return
+    data: dict = {}
+    rows = load_rows()
+    for row_no, r in enumerate(rows[1:], 2):
+        if len(r) < max(col_date, col_gross, col_comp):
+            continue
+        parts = _soft_parts(r[col_date - 1], r[col_gross - 1], r[col_comp - 1])
+        if parts:
+            d, cents, prefix = parts
+            data.setdefault(d.isoformat(), {}).setdefault(str(cents), {})[prefix] = _stamp(row_no=row_no)
+    _save_index(_SOFT_INDEX_FILE, data)
+
+
+# --- Perceptual hashes: a second photo of the same paper invoice ---
+
+class _BKTree:
+    """BK-tree over 64-bit hashes with Hamming distance; a radius query prunes by the triangle inequality."""
+
+    def __init__(self):
+        self.root = None  # [hash, children: {distance: node}]
+
+    def add(self, h: int) -> None:
+        if self.root is None:
+            self.root = [h, {}]
+            return
+        node = self.root
+        while True:
+            d = (h ^ node[0]).bit_count()
+            if d == 0:
+                return
+            child = node[1].get(d)
+            if child is None:
+                node[1][d] = [h, {}]
+                return
+            node = child
+
+    def nearest(self, h: int, radius: int) -> tuple[int, int] | None:
+        best = None
+        stack = [self.root] if self.root else []
+        while stack:
+            node = stack.pop()
+            d = (h ^ node[0]).bit_count()
+            if d <= radius and (best is None or d < best[1]):
+                best = (node[0], d)
+            for cd, child in node[1].items():
+                if d - radius <= cd <= d + radius:
+                    stack.append(child)
+        return best
+
+
+# (index dict identity, tree) - rebuilt whenever _load_index hands out a re-read dict.
+_PHASH_TREE: tuple[int, _BKTree] | None = None
+
+
+def _phash_tree(data: dict) -> _BKTree:
+    global _PHASH_TREE
+    if _PHASH_TREE is None or _PHASH_TREE[0] != id(data):
+        tree = _BKTree()
+        for key in data:
+            tree.add(int(key, 16))
+        _PHASH_TREE = (id(data), tree)
+    return _PHASH_TREE[1]
+
+
+def find_near_duplicate_image(phash: int | None, max_distance: int | None = None):
+    """Stamp of the closest registered photo within ``max_distance`` bits (default PHASH_MAX_DISTANCE), plus "distance"."""
+    if phash is None:
+        return None
+    radius = PHASH_MAX_DISTANCE if max_distance is None else max_distance
+    if radius < 0:
+        return None
+    data = _load_index(_PHASH_INDEX_FILE)
+    hit = _phash_tree(data).nearest(phash, radius)
+    if hit is None:
+        return None
+    return {**data[f"{hit[0]:016x}"], "distance": hit[1]}
+
+
+def register_image_hash(phash: int | None, row_no: int, file_link: str = "", user_id: int | None = None):
+    if phash is None:
+        return
+    data = _load_index(_PHASH_INDEX_FILE)
+    tree = _phash_tree(data)
+    data[f"{phash:016x}"] = _stamp(row_no=row_no, file_link=file_link, user_id=user_id)
+    _save_index(_PHASH_INDEX_FILE, data)
+    tree.add(phash)
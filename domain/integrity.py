@@ -1,7 +1,7 @@
 # -*- coding: utf-8 -*-
 from datetime import datetime
 from config import COL_DATE, COL_GROSS, COL_NET, COL_VAT, COL_TYPE, COL_NO, TYPE_VAT
-from ocr_service import parse_amount
+from domain.utils import parse_amount
 
 def check_business_integrity(rows: list[list]) -> list[str]:
     """
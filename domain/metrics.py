@@ -1,11 +1,20 @@
 ﻿# -*- coding: utf-8 -*-
 import json
+import threading
+import time
 from datetime import datetime, timedelta
 
 from config import DATA_DIR
 
 _EVENTS_FILE = DATA_DIR / "metrics_events.jsonl"
 
+# Hot-path counters (snapshot cache hits): (name, tags) -> count, written as one line per
+# name/tag set every _COUNTS_FLUSH_SEC instead of a line per event.
+_COUNTS_FLUSH_SEC = 60.0
+_counts: dict = {}
+_counts_lock = threading.Lock()
+_counts_flushed_at = [time.monotonic()]
+
 
 def _now() -> str:
     return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
@@ -21,6 +30,25 @@ def record_metric(name: str, ok: bool = True, latency_ms: int | None = None, **t
     _append(rec)
 
 
+def count_metric(name: str, **tags) -> None:
+    """Counts an event in memory; the totals reach the events file on the next flush."""
+    key = (name, tuple(sorted(tags.items())))
+    with _counts_lock:
+        _counts[key] = _counts.get(key, 0) + 1
+        due = time.monotonic() - _counts_flushed_at[0] >= _COUNTS_FLUSH_SEC
+    if due:
+        flush_counts()
+
+
+def flush_counts() -> None:
+    with _counts_lock:
+        pending = dict(_counts)
+        _counts.clear()
+        _counts_flushed_at[0] = time.monotonic()
+    for (name, tags), n in pending.items():
+        record_metric(name, ok=True, count=n, **dict(tags))
+
+
 def _read_last_hours(hours: int = 24) -> list[dict]:
     if not _EVENTS_FILE.exists():
         return []
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import json
+import os
+import time
+
+from config import DATA_DIR, OCR_CACHE_MAX_MB
+from domain.metrics import record_metric
+
+_CACHE_DIR = DATA_DIR / "ocr_cache"
+
+# cache dir -> bytes on disk; counted by one directory scan, then kept up to date by put(),
+# so the scan (and eviction) only runs again once the limit is crossed.
+_SIZE: dict = {}
+
+
+def file_sha256(path) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def make_key(file_hash: str, settings: dict) -> str:
+    """File hash + OCR settings, so changing lang/DPI/page limit never serves stale text."""
+    raw = file_hash + "|" + json.dumps(settings, sort_keys=True)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _path(key: str):
+    return _CACHE_DIR / f"{key}.json"
+
+
+def get(key: str, part: str):
+    """Returns entry[part] ("text" / "fields") or None; a hit refreshes the entry's LRU position."""
+    if not key or OCR_CACHE_MAX_MB <= 0:
+        return None
+    p = _path(key)
+    val = None
+    try:
+        val = json.loads(p.read_text(encoding="utf-8")).get(part)
+        if val is not None:
+            os.utime(p, None)
+    except Exception:
+        val = None
+    record_metric("ocr_cache", ok=True, hit=val is not None, part=part)
+    return val
+
+
+def put(key: str, **parts) -> None:
+    if not key or OCR_CACHE_MAX_MB <= 0:
+        return
+    _CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    p = _path(key)
+    try:
+        prev = p.read_bytes()
+        entry, old = json.loads(prev.decode("utf-8")), len(prev)
+    except Exception:
+        entry, old = {}, 0
+    entry.update(parts)
+    entry["ts"] = time.strftime("%Y-%m-%d %H:%M:%S")
+    raw = json.dumps(entry, ensure_ascii=False).encode("utf-8")
+    tmp = p.with_suffix(f".{os.getpid()}.tmp")
+    tmp.write_bytes(raw)
+    os.replace(tmp, p)
+    size = _SIZE.get(_CACHE_DIR)
+    if size is None or size + len(raw) - old > OCR_CACHE_MAX_MB * 1024 * 1024:
+        _evict()
+    else:
+        _SIZE[_CACHE_DIR] = size + len(raw) - old
+
+
+def _evict() -> int:
+    limit = OCR_CACHE_MAX_MB * 1024 * 1024
+    files = []
+    total = 0
+    for p in _CACHE_DIR.glob("*.json"):
+        try:
+            st = p.stat()
+        except OSError:
+            continue
+        files.append((st.st_mtime, st.st_size, p))
+        total += st.st_size
+    removed = 0
+    for _, size, p in sorted(files):
+        if total <= limit:
+            break
+        p.unlink(missing_ok=True)
+        total -= size
+        removed += 1
+    _SIZE[_CACHE_DIR] = total
+    return removed
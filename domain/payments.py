@@ -1,25 +1,12 @@
 # -*- coding: utf-8 -*-
-import re
+from domain.text_scan import scan
 
 def extract_iban(text: str) -> str:
     """
     Extracts Polish IBAN or standard account number from OCR text.
     """
-    # Remove spaces to make regex easier
-    clean_text = text.replace(" ", "").replace("-", "")
-    
-    # Look for PL... (28 digits) or just 26 digits
-    # PL check
-    m_pl = re.search(r"PL[0-9]{26}", clean_text, re.IGNORECASE)
-    if m_pl:
-        return m_pl.group(0).upper()
-        
-    # Standard 26 digit check (often OCR misses PL)
-    m_std = re.search(r"[0-9]{26}", clean_text)
-    if m_std:
-        return "PL" + m_std.group(0)
-        
-    return ""
+    # PL + 26 digits preferred; a bare 26-digit run (OCR often misses PL) gets the prefix added.
+    return scan(text or "")["iban"]
 
 def generate_payment_qr_url(iban: str, amount: float, title: str, receiver: str) -> str:
     """
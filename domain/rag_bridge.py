@@ -1,67 +1,223 @@
 # -*- coding: utf-8 -*-
 import asyncio
+import json
 import logging
+import time
 from pathlib import Path
 
+from config import LOGS_DIR, RAG_START_TIMEOUT_SEC, RAG_TIMEOUT_SEC
+from domain import search_index
+from domain.audit import log_event
+from domain.metrics import record_metric
+
 # Paths to the sibling RAG project
 RAG_PROJECT_DIR = Path(r"C:\Users\syfsy\projekty\python-rag-langchain")
 RAG_PYTHON_EXE = RAG_PROJECT_DIR / ".venv" / "Scripts" / "python.exe"
 RAG_SCRIPT = RAG_PROJECT_DIR / "rag_demo.py"
+RAG_WORKER = Path(__file__).with_name("rag_worker.py")
+
+# A worker that died or failed to start is not respawned more often than this.
+_RESTART_BACKOFF_SEC = 30
+
+
+class _RagWorker:
+    """One warm ``rag_worker.py`` process; requests are multiplexed over its stdin/stdout by id."""
+
+    def __init__(self):
+        self.proc = None
+        self.loop = None
+        self.pending: dict[int, asyncio.Future] = {}
+        self.next_id = 0
+        self.started_at = 0.0
+        self.failed_at = 0.0
+        self.restarts = 0
+        self.ready: asyncio.Event | None = None
+        self._reader = None
+        self._start_lock: asyncio.Lock | None = None
+
+    def alive(self) -> bool:
+        return self.proc is not None and self.proc.returncode is None
+
+    def kill(self) -> None:
+        if self.alive():
+            try:
+                self.proc.kill()
+            except Exception:
+                pass
+        self.proc = None
+
+    def _bind(self) -> None:
+        # asyncio pipes belong to the loop that created them.
+        loop = asyncio.get_running_loop()
+        if self.loop is not loop:
+            self.kill()
+            self.loop = loop
+            self.pending = {}
+            self.ready = None
+            self._start_lock = asyncio.Lock()
+
+    async def ensure(self) -> bool:
+        self._bind()
+        if self.alive() and self.ready.is_set():
+            return True
+        async with self._start_lock:
+            if not self.alive():
+                if self.failed_at and time.monotonic() - self.failed_at < _RESTART_BACKOFF_SEC:
+                    return False
+                await self._spawn()
+            if not self.ready.is_set():
+                # Either the script finishes loading, or the reader sees the process exit.
+                waiter = asyncio.ensure_future(self.ready.wait())
+                await asyncio.wait({waiter, self._reader}, timeout=RAG_START_TIMEOUT_SEC, return_when=asyncio.FIRST_COMPLETED)
+                waiter.cancel()
+                if not self.ready.is_set():
+                    logging.error("RAG worker failed to start (see logs/rag_worker.log)")
+                    self._fail()
+                    return False
+        return self.alive()
+
+    async def _spawn(self) -> None:
+        if self.started_at:
+            self.restarts += 1
+        self.ready = asyncio.Event()
+        with open(LOGS_DIR / "rag_worker.log", "ab") as errlog:
+            self.proc = await asyncio.create_subprocess_exec(
+                str(RAG_PYTHON_EXE), str(RAG_WORKER), str(RAG_SCRIPT),
+                stdin=asyncio.subprocess.PIPE,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=errlog,
+                cwd=str(RAG_PROJECT_DIR),
+                limit=4 * 1024 * 1024,
+            )
+        self.started_at = time.monotonic()
+        self._reader = asyncio.create_task(self._read(self.proc))
+        log_event("rag_worker_started", pid=self.proc.pid, restarts=self.restarts)
+
+    def _fail(self) -> None:
+        self.failed_at = time.monotonic()
+        self.kill()
+
+    async def _read(self, proc) -> None:
+        while True:
+            line = await proc.stdout.readline()
+            if not line:
+                break
+            try:
+                msg = json.loads(line)
+            except ValueError:
+                continue
+            if msg.get("event") == "ready":
+                self.ready.set()
+                continue
+            fut = self.pending.pop(msg.get("id"), None)
+            if fut and not fut.done():
+                fut.set_result(msg)
+        # EOF: the worker exited. Fail everything in flight; the next call respawns it.
+        if proc is self.proc:
+            self.failed_at = time.monotonic()
+            self.proc = None
+        for fut in self.pending.values():
+            if not fut.done():
+                fut.set_exception(ConnectionError("RAG worker exited"))
+        self.pending.clear()
+
+    async def request(self, op: str, timeout: float, kill_on_timeout: bool = True, **payload) -> dict:
+        if not await self.ensure():
+            raise ConnectionError("RAG worker unavailable")
+        self.next_id += 1
+        rid = self.next_id
+        fut = self.loop.create_future()
+        self.pending[rid] = fut
+        self.proc.stdin.write((json.dumps({"id": rid, "op": op, **payload}, ensure_ascii=False) + "\n").encode("utf-8"))
+        await self.proc.stdin.drain()
+        try:
+            return await asyncio.wait_for(fut, timeout=timeout)
+        except asyncio.TimeoutError:
+            self.pending.pop(rid, None)
+            if not kill_on_timeout:
+                raise
+            # Requests are served in order, so a hung one blocks the rest: restart the worker.
+            logging.error("RAG worker timed out after %ss; restarting", timeout)
+            self.kill()
+            raise
+
 
-async def get_rag_context(query: str) -> str:
+_WORKER = _RagWorker()
+
+
+def _project_available() -> bool:
+    return RAG_PYTHON_EXE.exists() and RAG_SCRIPT.exists()
+
+
+async def get_rag_context(query: str, local_query: str | None = None, scope: str | None = None) -> str:
     """
     Senior IT: Isolated Async RAG Bridge.
-    Calls the LangChain project asynchronously to keep the bot responsive.
+    Asks the warm RAG worker; without an answer from it, the best matches from the
+    built-in invoice index (searched for ``local_query``, default ``query``) are returned.
+    ``scope`` is the caller's ``storage_router.search_scope``; the active backend's table by default.
     """
-    if not RAG_PYTHON_EXE.exists() or not RAG_SCRIPT.exists():
-        logging.warning("RAG Project not found at %s. Falling back.", RAG_PROJECT_DIR)
+    answer = await _ask_worker(query)
+    return answer or search_index.context_for(local_query or query, scope=scope or search_index.active_scope())
+
+
+async def _ask_worker(query: str) -> str:
+    if not _project_available():
         return ""
 
+    t0 = time.perf_counter()
     try:
-        # Run the RAG demo script as an async subprocess
-        process = await asyncio.create_subprocess_exec(
-            str(RAG_PYTHON_EXE), str(RAG_SCRIPT), "-q", query,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE,
-            cwd=str(RAG_PROJECT_DIR)
-        )
-        
-        try:
-            stdout, stderr = await asyncio.wait_for(process.communicate(), timeout=60)
-            
-            if process.returncode == 0:
-                output = stdout.decode("utf-8", errors="ignore")
-                # Senior IT: Extract answer between markers or fallback to 'A: '
-                if "A: " in output:
-                    # If markers exist, stay within them
-                    content = output
-                    if "---RAG-START---" in output and "---RAG-END---" in output:
-                        content = output.split("---RAG-START---")[1].split("---RAG-END---")[0]
-                    
-                    return content.split("A: ", 1)[1].strip()
-                return output.strip()
-            else:
-                logging.error("RAG Subprocess Error: %s", stderr.decode())
-                return ""
-        except asyncio.TimeoutError:
-            process.kill()
-            logging.error("RAG Subprocess timed out after 60s")
-            return ""
-            
+        resp = await _WORKER.request("query", RAG_TIMEOUT_SEC, q=query)
     except Exception as e:
+        record_metric("rag_query", ok=False, latency_ms=int((time.perf_counter() - t0) * 1000), error=type(e).__name__)
         logging.error("RAG Bridge Exception: %s", e)
         return ""
+    record_metric("rag_query", ok=bool(resp.get("ok")), latency_ms=int((time.perf_counter() - t0) * 1000))
+    if not resp.get("ok"):
+        logging.error("RAG Worker Error: %s", resp.get("error"))
+        return ""
+    return (resp.get("answer") or "").strip()
+
+
+async def rag_health(timeout: float = 5.0) -> dict:
+    """Pings a running worker; never starts or restarts one."""
+    if not _WORKER.alive():
+        return {"ok": False, "state": "down" if _WORKER.started_at else "not_started", "restarts": _WORKER.restarts}
+    if _WORKER.pending:
+        # The worker answers one request at a time; a ping would just queue behind the running query.
+        return {"ok": True, "state": "busy", "pid": _WORKER.proc.pid, "in_flight": len(_WORKER.pending), "restarts": _WORKER.restarts}
+    try:
+        resp = await _WORKER.request("ping", timeout, kill_on_timeout=False)
+    except asyncio.TimeoutError:
+        return {"ok": True, "state": "busy", "pid": _WORKER.proc.pid if _WORKER.proc else None, "restarts": _WORKER.restarts}
+    except Exception as e:
+        return {"ok": False, "state": f"error: {type(e).__name__}", "restarts": _WORKER.restarts}
+    return {"ok": True, "state": "up", "pid": _WORKER.proc.pid if _WORKER.proc else None, "uptime_s": resp.get("uptime_s"), "restarts": _WORKER.restarts}
+
+
+async def shutdown_rag_worker() -> None:
+    proc, reader = _WORKER.proc, _WORKER._reader
+    _WORKER.kill()
+    if proc is not None and _WORKER.loop is asyncio.get_running_loop():
+        # Reap the process on its own loop so its pipes are closed before the loop goes away.
+        await proc.wait()
+        if reader is not None:
+            await reader
+
 
-async def get_smart_context_for_invoice(ocr_text: str) -> str:
+async def get_smart_context_for_invoice(ocr_text: str, scope: str | None = None) -> str:
     """
     Extracts keywords from OCR and queries the RAG system for business context.
     """
     # Extract first 200 chars or some keywords
     words = ocr_text.split()[:20]
     query = " ".join(words)
-    return await get_rag_context(f"Znajdz informacje o firmie i typowych fakturach dla: {query}")
+    # Past invoices from the built-in index are enough context; the external project is the fallback.
+    local = search_index.context_for(query, scope=scope or search_index.active_scope())
+    if local:
+        return local
+    return await _ask_worker(f"Znajdz informacje o firmie i typowych fakturach dla: {query}")
 
-async def analyze_spending_trend(query: str) -> str:
+async def analyze_spending_trend(query: str, scope: str | None = None) -> str:
     """
     Senior IT: Advanced BI Analysis using RAG.
     Asks the RAG system to perform trend analysis and synthesis on the retrieved documents.
@@ -72,12 +228,13 @@ async def analyze_spending_trend(query: str) -> str:
         "Jesli widzisz powtarzajace sie zakupy, wspomnij o tym. "
         "Jesli to pytanie o rekomendacje, opieraj sie na poprzednich zakupach."
     )
-    return await get_rag_context(prompt)
+    return await get_rag_context(prompt, local_query=query, scope=scope)
 
 def teach_rag_invoice(invoice_data: dict, full_ocr_text: str):
     """
     Senior IT: Continuous Learning Pipeline.
-    Injects new invoice data into the RAG knowledge base for future retrieval.
+    Injects new invoice data into the external RAG knowledge base, when present.
+    The built-in index is fed separately via ``search_index.add_invoice``.
     """
     KNOWLEDGE_FILE = RAG_PROJECT_DIR / "knowledge.txt"
     if not KNOWLEDGE_FILE.exists():
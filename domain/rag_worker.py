@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""Long-running host for the sibling RAG project's ``rag_demo.py``.
+
+Started once by ``domain.rag_bridge`` with the RAG project's own interpreter, so it
+must stay stdlib-only. The demo script is imported a single time (models and index
+stay warm) and then answers JSON-lines requests on stdin:
+
+    {"id": 1, "op": "query", "q": "..."}  ->  {"id": 1, "ok": true, "answer": "..."}
+    {"id": 2, "op": "ping"}               ->  {"id": 2, "ok": true, "uptime_s": 12.3}
+
+A ``{"event": "ready"}`` line is written once the script has loaded.
+"""
+import contextlib
+import importlib.util
+import io
+import json
+import sys
+import time
+
+# The bridge speaks UTF-8 JSON lines; the locale default is cp1252 on Windows.
+sys.stdin.reconfigure(encoding="utf-8")
+sys.stdout.reconfigure(encoding="utf-8")
+
+# Anything the RAG code prints goes to stderr; stdout carries protocol lines only.
+_OUT = sys.stdout
+sys.stdout = sys.stderr
+
+
+def _emit(obj: dict) -> None:
+    _OUT.write(json.dumps(obj, ensure_ascii=False) + "\n")
+    _OUT.flush()
+
+
+def _parse_answer(output: str) -> str:
+    if "A: " not in output:
+        return output.strip()
+    content = output
+    if "---RAG-START---" in output and "---RAG-END---" in output:
+        content = output.split("---RAG-START---")[1].split("---RAG-END---")[0]
+    return content.split("A: ", 1)[1].strip() if "A: " in content else content.strip()
+
+
+def _load(script: str):
+    spec = importlib.util.spec_from_file_location("rag_demo", script)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def _answer(module, script: str, query: str) -> str:
+    # Prefer a direct API when the script exposes one; otherwise drive its CLI entry point in-process.
+    for name in ("answer", "ask", "query"):
+        fn = getattr(module, name, None)
+        if callable(fn):
+            return str(fn(query) or "").strip()
+    buf = io.StringIO()
+    argv = sys.argv
+    sys.argv = [script, "-q", query]
+    try:
+        with contextlib.redirect_stdout(buf):
+            try:
+                module.main()
+            except SystemExit:
+                pass
+    finally:
+        sys.argv = argv
+    return _parse_answer(buf.getvalue())
+
+
+def main() -> None:
+    script = sys.argv[1]
+    started = time.monotonic()
+    module = _load(script)
+    _emit({"event": "ready"})
+
+    for line in sys.stdin:
+        try:
+            req = json.loads(line)
+        except ValueError:
+            continue
+        rid = req.get("id")
+        op = req.get("op")
+        try:
+            if op == "ping":
+                _emit({"id": rid, "ok": True, "uptime_s": round(time.monotonic() - started, 1)})
+            elif op == "query":
+                _emit({"id": rid, "ok": True, "answer": _answer(module, script, req.get("q", ""))})
+            else:
+                _emit({"id": rid, "ok": False, "error": f"unknown op {op!r}"})
+        except Exception as exc:
+            _emit({"id": rid, "ok": False, "error": f"{type(exc).__name__}: {exc}"})
+
+
+if __name__ == "__main__":
+    main()
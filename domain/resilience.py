@@ -0,0 +1,280 @@
+# -*- coding: utf-8 -*-
+"""Retries with jittered backoff and per-backend circuit breakers.
+
+``retry_async`` sleeps with ``asyncio.sleep`` and is what coroutines should use.
+``retry_call`` serves the synchronous storage clients: off the event loop it backs
+off with ``time.sleep``, but on the event-loop thread it never sleeps (that would
+freeze every chat), so it makes a single attempt and leaves the rest to the breaker
+and ``domain.retry_queue``.
+
+A breaker opens after ``BREAKER_FAILURES`` consecutive transient failures and then
+rejects calls with ``CircuitOpenError`` until ``BREAKER_RESET_SEC`` have passed, when
+one probe call is let through (half-open). Client errors (4xx) prove the backend is
+reachable, so they neither trip a breaker nor get retried. Only network errors,
+timeouts and 408/429/5xx answers count as transient; any other exception (a bug in the
+wrapped call) is raised at once and leaves the breaker alone. A probe that ends
+without an answer (cancelled task, interpreter shutdown) hands the probe slot back.
+
+Breaker state lives in the bot process; every state change is mirrored to
+``BREAKERS_FILE`` so the panel (a separate process) can show it.
+"""
+import asyncio
+import http.client
+import json
+import logging
+import random
+import threading
+import time
+
+from config import BREAKER_FAILURES, BREAKER_RESET_SEC, DATA_DIR
+
+log = logging.getLogger("danex.resilience")
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+BACKENDS = ("sheets", "drive", "api")
+BREAKERS_FILE = DATA_DIR / "breaker_states.json"
+
+_TRANSIENT_TYPES: tuple = (OSError, TimeoutError, http.client.HTTPException)
+try:
+    import httpx
+
+    _TRANSIENT_TYPES += (httpx.TransportError,)
+except ImportError:
+    pass
+try:
+    import httplib2
+
+    _TRANSIENT_TYPES += (httplib2.HttpLib2Error,)
+except ImportError:
+    pass
+try:
+    from google.auth.exceptions import TransportError as _AuthTransportError
+
+    _TRANSIENT_TYPES += (_AuthTransportError,)
+except ImportError:
+    pass
+
+
+class CircuitOpenError(RuntimeError):
+    def __init__(self, name: str, retry_in: float):
+        super().__init__(f"{name} niedostepny (circuit open, ponowna proba za {int(retry_in)} s)")
+        self.name = name
+        self.retry_in = retry_in
+
+
+class CircuitBreaker:
+    def __init__(self, name: str, failures: int = BREAKER_FAILURES, reset_sec: float = BREAKER_RESET_SEC):
+        self.name = name
+        self.max_failures = max(1, int(failures))
+        self.reset_sec = float(reset_sec)
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self._trips = 0
+
+    def before_call(self) -> None:
+        """Raises ``CircuitOpenError`` while open; lets a single probe through once the reset time passed."""
+        with self._lock:
+            if self._state == CLOSED:
+                return
+            wait = self._opened_at + self.reset_sec - time.monotonic()
+            if self._state == OPEN and wait <= 0:
+                self._state = HALF_OPEN
+                self._probing = False
+            if self._state == HALF_OPEN and not self._probing:
+                self._probing = True
+                return
+            raise CircuitOpenError(self.name, max(0.0, wait))
+
+    def record_success(self) -> None:
+        with self._lock:
+            changed = self._state != CLOSED or self._failures > 0
+            if self._state != CLOSED:
+                log.info("Circuit %s closed", self.name)
+            self._state = CLOSED
+            self._failures = 0
+            self._probing = False
+        if changed:
+            _persist()
+
+    def release_probe(self) -> None:
+        """Frees the half-open probe slot when the probe ended without a verdict."""
+        with self._lock:
+            self._probing = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            if self._state == HALF_OPEN or self._failures >= self.max_failures:
+                if self._state != OPEN:
+                    self._trips += 1
+                    log.warning("Circuit %s opened after %s failures", self.name, self._failures)
+                self._state = OPEN
+                self._opened_at = time.monotonic()
+                self._probing = False
+        _persist()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._state == OPEN and time.monotonic() >= self._opened_at + self.reset_sec:
+                return HALF_OPEN
+            return self._state
+
+    def snapshot(self) -> dict:
+        state = self.state
+        with self._lock:
+            retry_in = max(0.0, self._opened_at + self.reset_sec - time.monotonic()) if state == OPEN else 0.0
+            return {"state": state, "failures": self._failures, "trips": self._trips, "retry_in_s": round(retry_in, 1)}
+
+    def reset(self) -> None:
+        with self._lock:
+            self._state = CLOSED
+            self._failures = 0
+            self._probing = False
+
+
+_BREAKERS = {name: CircuitBreaker(name) for name in BACKENDS}
+
+
+def breaker(name: str) -> CircuitBreaker:
+    return _BREAKERS[name]
+
+
+def breaker_states() -> dict[str, dict]:
+    return {name: b.snapshot() for name, b in _BREAKERS.items()}
+
+
+def _persist() -> None:
+    data = {"saved_at": time.time(), "breakers": breaker_states()}
+    try:
+        tmp = BREAKERS_FILE.with_suffix(".tmp")
+        tmp.write_text(json.dumps(data), encoding="utf-8")
+        tmp.replace(BREAKERS_FILE)
+    except OSError as exc:
+        log.warning("Breaker states not saved: %s", exc)
+
+
+def saved_breaker_states() -> dict[str, dict]:
+    """Breaker states as last written by the bot, aged to now (for other processes, e.g. the panel)."""
+    try:
+        data = json.loads(BREAKERS_FILE.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        data = {}
+    age = max(0.0, time.time() - float(data.get("saved_at") or 0))
+    out = {name: {"state": CLOSED, "failures": 0, "trips": 0, "retry_in_s": 0.0} for name in BACKENDS}
+    for name, snap in (data.get("breakers") or {}).items():
+        snap = dict(snap)
+        if snap.get("state") == OPEN:
+            snap["retry_in_s"] = round(max(0.0, float(snap.get("retry_in_s") or 0) - age), 1)
+            if snap["retry_in_s"] <= 0:
+                snap["state"] = HALF_OPEN
+        out[name] = snap
+    return out
+
+
+def is_open(name: str) -> bool:
+    return _BREAKERS[name].state == OPEN
+
+
+def _status_of(exc: BaseException) -> int | None:
+    for attr in ("response", "resp"):
+        resp = getattr(exc, attr, None)
+        code = getattr(resp, "status_code", None) or getattr(resp, "status", None)
+        if code:
+            try:
+                return int(code)
+            except (TypeError, ValueError):
+                pass
+    code = getattr(exc, "code", None)
+    return code if isinstance(code, int) and 100 <= code < 600 else None
+
+
+def is_transient(exc: BaseException) -> bool:
+    """Network errors, timeouts, 408/429 and 5xx are worth retrying; 4xx, open circuits and bugs are not."""
+    if isinstance(exc, CircuitOpenError):
+        return False
+    status = _status_of(exc)
+    if status is None:
+        return isinstance(exc, _TRANSIENT_TYPES)
+    return status in (408, 429) or status >= 500
+
+
+def backoff_delay(attempt: int, base_delay: float, max_delay: float) -> float:
+    """Full jitter: uniform in [0, base * 2^(attempt-1)], capped at ``max_delay``."""
+    return random.uniform(0, min(max_delay, base_delay * (2 ** (attempt - 1))))
+
+
+def _on_event_loop() -> bool:
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return False
+    return True
+
+
+def _failed(cb: CircuitBreaker | None, exc: Exception) -> bool:
+    transient = is_transient(exc)
+    if cb is not None and not isinstance(exc, CircuitOpenError):
+        if transient:
+            cb.record_failure()
+        elif _status_of(exc) is not None:
+            # A 4xx answer: the backend is reachable.
+            cb.record_success()
+        else:
+            # A local error says nothing about the backend.
+            cb.release_probe()
+    return transient
+
+
+def retry_call(fn, what: str, attempts: int = 3, base_delay: float = 0.5, max_delay: float = 8.0, breaker_name: str | None = None):
+    cb = _BREAKERS[breaker_name] if breaker_name else None
+    if _on_event_loop():
+        attempts = 1
+    for attempt in range(1, attempts + 1):
+        if cb is not None:
+            cb.before_call()
+        try:
+            out = fn()
+        except Exception as exc:
+            if not _failed(cb, exc) or attempt >= attempts:
+                raise
+            log.warning("Retry %s failed (%s/%s): %s", what, attempt, attempts, exc)
+            time.sleep(backoff_delay(attempt, base_delay, max_delay))
+            continue
+        except BaseException:
+            if cb is not None:
+                cb.release_probe()
+            raise
+        if cb is not None:
+            cb.record_success()
+        return out
+
+
+async def retry_async(fn, what: str, attempts: int = 3, base_delay: float = 0.5, max_delay: float = 8.0, breaker_name: str | None = None):
+    """Like ``retry_call`` for a coroutine factory (``fn()`` must return an awaitable)."""
+    cb = _BREAKERS[breaker_name] if breaker_name else None
+    for attempt in range(1, attempts + 1):
+        if cb is not None:
+            cb.before_call()
+        try:
+            out = await fn()
+        except Exception as exc:
+            if not _failed(cb, exc) or attempt >= attempts:
+                raise
+            log.warning("Retry %s failed (%s/%s): %s", what, attempt, attempts, exc)
+            await asyncio.sleep(backoff_delay(attempt, base_delay, max_delay))
+            continue
+        except BaseException:
+            # Cancelled mid-call: no verdict on the backend, but the probe slot must not stay taken.
+            if cb is not None:
+                cb.release_probe()
+            raise
+        if cb is not None:
+            cb.record_success()
+        return out
@@ -70,7 +70,7 @@ def _prune_idempotency(days: int) -> int:
         return 0
     cut = datetime.now() - timedelta(days=days)
     total_removed = 0
-    for name in ("file_hash_index.json", "content_hash_index.json"):
+    for name in ("file_hash_index.json", "content_hash_index.json", "upload_id_index.json", "phash_index.json"):
         path = DATA_DIR / name
         if not path.exists():
             continue
@@ -91,6 +91,19 @@ def _prune_idempotency(days: int) -> int:
             else:
                 total_removed += 1
         path.write_text(json.dumps(kept, ensure_ascii=False, indent=2), encoding="utf-8")
+
+    # The soft-duplicate index is bucketed by invoice date; whole old days are dropped.
+    path = DATA_DIR / "soft_dup_index.json"
+    if path.exists():
+        try:
+            data = json.loads(path.read_text(encoding="utf-8"))
+        except Exception:
+            data = None
+        if data is not None:
+            cut_day = cut.strftime("%Y-%m-%d")
+            kept = {day: v for day, v in data.items() if day >= cut_day}
+            total_removed += sum(len(b) for day, v in data.items() if day < cut_day for b in v.values())
+            path.write_text(json.dumps(kept, ensure_ascii=False, indent=2), encoding="utf-8")
     return total_removed
 
 
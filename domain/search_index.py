@@ -0,0 +1,399 @@
+# -*- coding: utf-8 -*-
+"""BM25 index over invoice rows and their OCR text.
+
+Documents are keyed by storage scope (the snapshot key: one shared sheet, or one API
+user) and sheet row number. Every change is one appended JSON line in
+``DATA_DIR/search_index.jsonl`` (a later line for the same row supersedes earlier
+ones), so indexing a new invoice never rewrites the file; the log is compacted only
+when it is loaded and mostly made of superseded lines. Postings live in memory.
+
+Query terms match exactly, by prefix ("orl" -> "orlen") and, for row fields, within
+one edit ("orlne" -> "orlen"); lookups only touch the matching postings, so latency
+does not grow with the number of rows.
+"""
+import bisect
+import hashlib
+import json
+import math
+import re
+import threading
+import time
+import unicodedata
+from collections import Counter
+
+from config import (
+    COL_CAT,
+    COL_COMP,
+    COL_DATE,
+    COL_GROSS,
+    COL_NO,
+    COL_STATUS,
+    COL_TYPE,
+    DATA_DIR,
+    STORAGE_BACKEND,
+)
+
+INDEX_FILE = DATA_DIR / "search_index.jsonl"
+DEFAULT_SCOPE = "SheetsStorage"
+
+# OCR text kept per invoice; enough for the header, seller block and totals.
+_MAX_TEXT_CHARS = 4000
+_K1 = 1.5
+_B = 0.75
+# Score multipliers for non-exact term matches.
+_PREFIX_WEIGHT = 0.7
+_FUZZY_WEIGHT = 0.5
+_MIN_FUZZY_LEN = 4
+# Sheet edits made outside the bot are picked up by a resync this often.
+RESYNC_SEC = 900
+
+_TOKEN_RE = re.compile(r"\d+(?:[.,]\d+)*|[^\W\d_]+")
+_STOPWORDS = {
+    "a", "i", "w", "z", "o", "na", "do", "od", "po", "za", "ze", "to", "sie", "jak", "co", "czy",
+    "dla", "ile", "jest", "sa", "nie", "tak", "the", "and", "of",
+}
+_ROW_FIELDS = {
+    "date": COL_DATE,
+    "no": COL_NO,
+    "company": COL_COMP,
+    "gross": COL_GROSS,
+    "type": COL_TYPE,
+    "category": COL_CAT,
+    "status": COL_STATUS,
+}
+_COL_FIELD = {col: name for name, col in _ROW_FIELDS.items()}
+
+_LOCK = threading.Lock()
+_LOADED = False
+_INDEXES: dict[str, "_Index"] = {}
+_SYNCED_AT: dict[str, float] = {}
+
+
+def fold(s: str) -> str:
+    """Lower-cases and strips Polish diacritics, so "Żabka", "zabka" and "ZABKA" index alike."""
+    s = unicodedata.normalize("NFKD", (s or "").casefold().replace("ł", "l"))
+    return "".join(c for c in s if not unicodedata.combining(c))
+
+
+def tokenize(s: str) -> list[str]:
+    out = []
+    for tok in _TOKEN_RE.findall(fold(s)):
+        if tok[0].isdigit():
+            out.append(tok.replace(",", "."))
+        elif len(tok) > 1 and tok not in _STOPWORDS:
+            out.append(tok)
+    return out
+
+
+def row_fields(row: list) -> dict:
+    return {k: str(row[c - 1]).strip() if len(row) >= c else "" for k, c in _ROW_FIELDS.items()}
+
+
+def _identity(fields: dict) -> tuple[str, str] | None:
+    """Invoice number and date: what ties OCR text to its invoice when rows move."""
+    key = (fields.get("no", ""), fields.get("date", ""))
+    return key if any(key) else None
+
+
+def _sig(fields: dict) -> str:
+    return hashlib.sha1(json.dumps(fields, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()[:16]
+
+
+def _deletes(term: str) -> set[str]:
+    return {term[:i] + term[i + 1:] for i in range(len(term))}
+
+
+def _within_one_edit(a: str, b: str) -> bool:
+    if a == b:
+        return True
+    if abs(len(a) - len(b)) > 1:
+        return False
+    if len(a) == len(b):
+        diff = [i for i in range(len(a)) if a[i] != b[i]]
+        # One substitution, or two adjacent letters swapped.
+        return len(diff) == 1 or (len(diff) == 2 and diff[1] == diff[0] + 1 and a[diff[0]] == b[diff[1]] and a[diff[1]] == b[diff[0]])
+    short, long_ = (a, b) if len(a) < len(b) else (b, a)
+    return any(long_[:i] + long_[i + 1:] == short for i in range(len(long_)))
+
+
+class _Index:
+    """Postings for one storage scope."""
+
+    def __init__(self):
+        self.docs: dict[int, dict] = {}
+        self.postings: dict[str, dict[int, int]] = {}
+        self.total_len = 0
+        # Sorted vocabulary for prefix lookups.
+        self.vocab: list[str] = []
+        # Row-field terms by single-deletion variant, for one-edit fuzzy lookups.
+        self.field_terms: Counter = Counter()
+        self.deletes: dict[str, set[str]] = {}
+
+    def remove(self, row_no: int) -> dict | None:
+        doc = self.docs.pop(row_no, None)
+        if doc is None:
+            return None
+        for term in doc["terms"]:
+            posting = self.postings.get(term)
+            if posting is None:
+                continue
+            posting.pop(row_no, None)
+            if not posting:
+                del self.postings[term]
+                i = bisect.bisect_left(self.vocab, term)
+                if i < len(self.vocab) and self.vocab[i] == term:
+                    del self.vocab[i]
+        for term in doc["field_terms"]:
+            self.field_terms[term] -= 1
+            if self.field_terms[term] <= 0:
+                del self.field_terms[term]
+                for d in _deletes(term) | {term}:
+                    bucket = self.deletes.get(d)
+                    if bucket is not None:
+                        bucket.discard(term)
+                        if not bucket:
+                            del self.deletes[d]
+        self.total_len -= doc["len"]
+        return doc
+
+    def add(self, row_no: int, fields: dict, text: str) -> None:
+        field_terms = set(tokenize(" ".join(fields.values())))
+        terms = Counter(tokenize(" ".join(fields.values())) + tokenize(text))
+        for term, tf in terms.items():
+            posting = self.postings.get(term)
+            if posting is None:
+                posting = self.postings[term] = {}
+                bisect.insort(self.vocab, term)
+            posting[row_no] = tf
+        for term in field_terms:
+            if not term[0].isdigit() and len(term) >= _MIN_FUZZY_LEN:
+                if not self.field_terms[term]:
+                    for d in _deletes(term) | {term}:
+                        self.deletes.setdefault(d, set()).add(term)
+                self.field_terms[term] += 1
+        length = sum(terms.values())
+        self.docs[row_no] = {
+            "fields": fields,
+            "text": text,
+            "terms": terms,
+            "field_terms": [t for t in field_terms if t in self.field_terms],
+            "len": length,
+            "sig": _sig(fields),
+        }
+        self.total_len += length
+
+    def expand(self, token: str) -> dict[str, float]:
+        """Index terms a query token matches, with their weight."""
+        out = {}
+        if token in self.postings:
+            out[token] = 1.0
+        if len(token) >= 2:
+            i = bisect.bisect_left(self.vocab, token)
+            while i < len(self.vocab) and self.vocab[i].startswith(token):
+                out.setdefault(self.vocab[i], _PREFIX_WEIGHT)
+                i += 1
+        if not out and len(token) >= _MIN_FUZZY_LEN and not token[0].isdigit():
+            for d in _deletes(token) | {token}:
+                for term in self.deletes.get(d, ()):
+                    if _within_one_edit(token, term):
+                        out.setdefault(term, _FUZZY_WEIGHT)
+        return out
+
+    def rank(self, query: str) -> list[tuple[int, float]]:
+        n = len(self.docs)
+        tokens = set(tokenize(query))
+        if not tokens or not n:
+            return []
+        avgdl = self.total_len / n or 1.0
+        scores: dict[int, float] = {}
+        for token in tokens:
+            # Per token, a document counts with its best-matching variant only.
+            best: dict[int, float] = {}
+            for term, weight in self.expand(token).items():
+                posting = self.postings[term]
+                idf = math.log(1 + (n - len(posting) + 0.5) / (len(posting) + 0.5))
+                for row_no, tf in posting.items():
+                    dl = self.docs[row_no]["len"]
+                    s = weight * idf * tf * (_K1 + 1) / (tf + _K1 * (1 - _B + _B * dl / avgdl))
+                    if s > best.get(row_no, 0.0):
+                        best[row_no] = s
+            for row_no, s in best.items():
+                scores[row_no] = scores.get(row_no, 0.0) + s
+        return sorted(scores.items(), key=lambda kv: (-kv[1], -kv[0]))
+
+
+def _index_for(scope: str) -> _Index:
+    idx = _INDEXES.get(scope)
+    if idx is None:
+        idx = _INDEXES[scope] = _Index()
+    return idx
+
+
+def _apply(entry: dict) -> None:
+    idx = _index_for(entry.get("scope") or DEFAULT_SCOPE)
+    row_no = int(entry["row"])
+    old = idx.remove(row_no)
+    if entry.get("del"):
+        return
+    # Partial entries keep what they do not carry: field updates keep the OCR text, text updates the fields.
+    text = entry["text"] if "text" in entry else (old or {}).get("text", "")
+    fields = entry["fields"] if "fields" in entry else (old or {}).get("fields", {})
+    idx.add(row_no, fields, text)
+
+
+def _load() -> None:
+    global _LOADED
+    if _LOADED:
+        return
+    lines = 0
+    if INDEX_FILE.exists():
+        with open(INDEX_FILE, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    _apply(json.loads(line))
+                    lines += 1
+                except (ValueError, KeyError, TypeError):
+                    continue
+    _LOADED = True
+    if lines > 2 * sum(len(idx.docs) for idx in _INDEXES.values()) + 100:
+        _compact()
+
+
+def _compact() -> None:
+    tmp = INDEX_FILE.with_suffix(".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        for scope, idx in _INDEXES.items():
+            for row_no, doc in idx.docs.items():
+                entry = {"scope": scope, "row": row_no, "fields": doc["fields"], "text": doc["text"]}
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+    tmp.replace(INDEX_FILE)
+
+
+def _append(entries: list[dict]) -> None:
+    if not entries:
+        return
+    with open(INDEX_FILE, "a", encoding="utf-8") as f:
+        for entry in entries:
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+    for entry in entries:
+        _apply(entry)
+
+
+def add_invoice(row_no: int, fields: dict, text: str | None = None, scope: str = DEFAULT_SCOPE) -> None:
+    """Indexes (or re-indexes) one invoice row; ``fields`` as from ``row_fields``. ``text=None`` keeps indexed OCR text."""
+    entry = {"scope": scope, "row": int(row_no), "fields": {k: str(fields.get(k) or "").strip() for k in _ROW_FIELDS}}
+    if text is not None:
+        entry["text"] = text[:_MAX_TEXT_CHARS]
+    with _LOCK:
+        _load()
+        _append([entry])
+
+
+def attach_text(row_no: int, text: str, scope: str = DEFAULT_SCOPE) -> None:
+    """Adds the OCR text of an already indexed row (fields come from the storage write)."""
+    if not text:
+        return
+    with _LOCK:
+        _load()
+        _append([{"scope": scope, "row": int(row_no), "text": text[:_MAX_TEXT_CHARS]}])
+
+
+def update_cells(row_no: int, cells: dict, scope: str = DEFAULT_SCOPE) -> None:
+    """Mirrors a confirmed cell write; rows the index has not seen yet are left to the next sync."""
+    with _LOCK:
+        _load()
+        doc = _index_for(scope).docs.get(int(row_no))
+        if doc is None:
+            return
+        fields = dict(doc["fields"])
+        for col, value in cells.items():
+            name = _COL_FIELD.get(int(col))
+            if name:
+                fields[name] = "" if value is None else str(value).strip()
+        if fields != doc["fields"]:
+            _append([{"scope": scope, "row": int(row_no), "fields": fields}])
+
+
+def sync_rows(rows: list[list], scope: str = DEFAULT_SCOPE) -> int:
+    """Brings the index in line with sheet rows (header first); only changed rows are appended. Returns the count.
+
+    OCR text follows its invoice (by number and date) when rows were sorted, inserted or
+    deleted; a row now holding a different invoice never keeps the previous one's text.
+    """
+    entries = []
+    with _LOCK:
+        _load()
+        idx = _index_for(scope)
+        new_fields = {row_no: row_fields(row) for row_no, row in enumerate(rows[1:], 2)}
+        new_ids = {_identity(f) for f in new_fields.values()}
+        texts: dict[tuple, str | None] = {}
+        for doc in idx.docs.values():
+            key = _identity(doc["fields"])
+            if key and doc["text"]:
+                # Two invoices with one identity: ambiguous, so neither text moves.
+                texts[key] = None if key in texts else doc["text"]
+        for row_no, fields in new_fields.items():
+            doc = idx.docs.get(row_no)
+            if not any(fields.values()):
+                if doc is not None:
+                    entries.append({"scope": scope, "row": row_no, "del": True})
+            elif doc is None or doc["sig"] != _sig(fields):
+                entry = {"scope": scope, "row": row_no, "fields": fields}
+                key = _identity(fields)
+                old_key = _identity(doc["fields"]) if doc is not None else None
+                if key != old_key and (doc is None or old_key in new_ids or key in texts):
+                    # Another invoice moved here (an in-place edit of number or date keeps the text).
+                    entry["text"] = texts.get(key) or ""
+                entries.append(entry)
+        entries += [{"scope": scope, "row": r, "del": True} for r in idx.docs if r > len(rows)]
+        _append(entries)
+        _SYNCED_AT[scope] = time.time()
+    return len(entries)
+
+
+def active_scope() -> str:
+    """Scope of the shared invoice table, for callers that have no Telegram update at hand."""
+    return "SqliteStorage" if STORAGE_BACKEND == "sqlite" else DEFAULT_SCOPE
+
+
+def text_for(row_no: int, scope: str = DEFAULT_SCOPE, row: list | None = None) -> str:
+    """OCR text attached to a row ("" when none was kept, or when ``row`` shows another invoice there)."""
+    with _LOCK:
+        _load()
+        doc = _index_for(scope).docs.get(int(row_no))
+        if doc is None or (row is not None and _identity(doc["fields"]) != _identity(row_fields(row))):
+            return ""
+        return doc["text"]
+
+
+def needs_sync(scope: str = DEFAULT_SCOPE) -> bool:
+    return time.time() - _SYNCED_AT.get(scope, 0.0) > RESYNC_SEC
+
+
+def search_page(query: str, page: int = 1, page_size: int = 5, scope: str = DEFAULT_SCOPE) -> tuple[list[dict], int]:
+    """One page of ranked matches and the total match count. Hits: ``{"row_no", "score", "date", "company", ...}``."""
+    with _LOCK:
+        _load()
+        idx = _index_for(scope)
+        ranked = idx.rank(query)
+        start = max(0, (page - 1) * page_size)
+        hits = [
+            {"row_no": row_no, "score": round(score, 4), **idx.docs[row_no]["fields"]}
+            for row_no, score in ranked[start:start + page_size]
+        ]
+    return hits, len(ranked)
+
+
+def search(query: str, limit: int = 5, scope: str = DEFAULT_SCOPE) -> list[dict]:
+    return search_page(query, 1, limit, scope)[0]
+
+
+def context_for(query: str, limit: int = 3, scope: str = DEFAULT_SCOPE) -> str:
+    """Top matches as plain-text context lines for the LLM or a direct answer."""
+    lines = []
+    for hit in search(query, limit, scope):
+        with _LOCK:
+            snippet = " ".join(_index_for(scope).docs.get(hit["row_no"], {}).get("text", "").split())[:200]
+        line = f"[#{hit['row_no']}] {hit['date']} | {hit['company']} | {hit['no']} | {hit['gross']} PLN | {hit['category']}"
+        lines.append(f"{line} | {snippet}" if snippet else line)
+    return "\n".join(lines)
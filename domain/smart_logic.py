@@ -1,5 +1,4 @@
 # -*- coding: utf-8 -*-
-import difflib
 import re
 from datetime import datetime
 
@@ -23,31 +22,26 @@ def predict_category(company: str) -> str:
             return cat
     return "inne"
 
-def fuzzy_match_company(input_name: str, known_companies: list[str]) -> str | None:
+def fuzzy_match_company(input_name: str, known_companies: list[str] | None = None) -> str | None:
     """
     Znajduje najbardziej podobna nazwe firmy w bazie (poprawia literowki).
-    Np. 'Biedronk' -> 'Biedronka'.
+    Np. 'Biedronk' -> 'Biedronka'. Korzysta z indeksu trigramow (domain.company_index);
+    z ``known_companies`` wybiera tylko sposrod podanych nazw, nie dopisujac ich do indeksu.
     """
-    if not input_name or not known_companies:
+    if not input_name:
         return None
-    
-    # 1. Exact match (case insensitive)
-    norm_input = input_name.strip().lower()
-    for k in known_companies:
-        if k.strip().lower() == norm_input:
-            return k
+    from domain import company_index
 
-    # 2. Fuzzy match
-    matches = difflib.get_close_matches(input_name, known_companies, n=1, cutoff=0.7)
-    if matches:
-        return matches[0]
-    
-    return None
+    if known_companies:
+        return company_index.match_in(input_name, known_companies)
+    return company_index.best_match(input_name)
 
 def is_soft_duplicate(new_row: dict, existing_rows: list[list]) -> tuple[bool, str]:
     """
     Sprawdza, czy faktura nie dubluje sie logicznie (ta sama firma, data i kwota),
     nawet jesli plik jest inny (inne zdjecie tego samego dokumentu).
+    Liniowe przejscie po wierszach arkusza (z naglowkiem); przy wysylce faktury
+    uzywany jest indeks domain.idempotency.find_soft_duplicate.
     """
     # new_row expected keys: date, company, gross
     new_date = new_row.get("date", "")
@@ -57,9 +51,9 @@ def is_soft_duplicate(new_row: dict, existing_rows: list[list]) -> tuple[bool, s
     if not new_date or not new_gross:
         return False, ""
 
-    from config import COL_DATE, COL_GROSS, COL_COMP, COL_STATUS, STATUS_OK, STATUS_TODO
+    from config import COL_DATE, COL_GROSS, COL_COMP
 
-    for r in existing_rows:
+    for row_no, r in enumerate(existing_rows, 1):
         if len(r) < COL_GROSS: continue
         
         # Check amount (exact match)
@@ -75,8 +69,7 @@ def is_soft_duplicate(new_row: dict, existing_rows: list[list]) -> tuple[bool, s
         # Check company (fuzzy start)
         ex_comp = (r[COL_COMP-1] or "").lower().strip()[:10]
         if new_comp in ex_comp or ex_comp in new_comp:
-            row_no = existing_rows.index(r) + 1 # simplistic row finding
-            return True, f"Znaleziono identyczna fakture (Data: {new_date}, Kwota: {new_gross}) juz w systemie."
+            return True, f"Znaleziono identyczna fakture (Data: {new_date}, Kwota: {new_gross}) juz w systemie (wiersz {row_no})."
 
     return False, ""
 
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+import time
+from threading import Lock
+
+from config import STORAGE_CACHE_TTL_SEC
+from domain import columns as col_proj
+
+# key -> {"rows": list[list[str]], "loaded_at": float, "version": int}
+_SNAPSHOTS: dict[str, dict] = {}
+_LOCK = Lock()
+
+
+def _fresh(snap: dict | None) -> bool:
+    if not snap or STORAGE_CACHE_TTL_SEC <= 0:
+        return False
+    return (time.time() - snap["loaded_at"]) < STORAGE_CACHE_TTL_SEC
+
+
+def get_rows(key: str) -> list[list[str]] | None:
+    """Returns a copy of the cached sheet (with header) or None when missing/expired."""
+    with _LOCK:
+        snap = _SNAPSHOTS.get(key)
+        if not _fresh(snap):
+            return None
+        return [list(r) for r in snap["rows"]]
+
+
+def get_row(key: str, row_no: int) -> list[str] | None:
+    with _LOCK:
+        snap = _SNAPSHOTS.get(key)
+        if not _fresh(snap):
+            return None
+        rows = snap["rows"]
+        if row_no < 1 or row_no > len(rows):
+            return None
+        return list(rows[row_no - 1])
+
+
+def put_rows(key: str, rows: list[list[str]]) -> int:
+    with _LOCK:
+        prev = _SNAPSHOTS.get(key)
+        version = (prev["version"] if prev else 0) + 1
+        _SNAPSHOTS[key] = {"rows": [list(r) for r in rows], "loaded_at": time.time(), "version": version}
+        return version
+
+
+def patch_cells(key: str, row_no: int, cells: dict[int, object]) -> None:
+    """Applies a confirmed write in place, so the next read does not hit the backend."""
+    with _LOCK:
+        snap = _SNAPSHOTS.get(key)
+        if not snap:
+            return
+        rows = snap["rows"]
+        if row_no < 1 or row_no > len(rows):
+            # Row outside the snapshot (edited in the sheet meanwhile) - reload on next read.
+            snap["loaded_at"] = 0.0
+            return
+        r = rows[row_no - 1]
+        for col, value in cells.items():
+            col = int(col)
+            if len(r) < col:
+                r.extend([""] * (col - len(r)))
+            r[col - 1] = "" if value is None else str(value)
+        snap["version"] += 1
+
+
+def append_values(key: str, row_no: int | None, values) -> None:
+    with _LOCK:
+        snap = _SNAPSHOTS.get(key)
+        if not snap:
+            return
+        rows = snap["rows"]
+        if row_no is None:
+            row_no = len(rows) + 1
+        if row_no < len(rows) + 1:
+            snap["loaded_at"] = 0.0
+            return
+        while len(rows) < row_no - 1:
+            rows.append([])
+        rows.append(["" if v is None else str(v) for v in values])
+        snap["version"] += 1
+
+
+def get_columns(key: str, cols, month: str | None = None) -> col_proj.Columns | None:
+    """Projects a few columns out of a fresh snapshot without copying whole rows."""
+    with _LOCK:
+        snap = _SNAPSHOTS.get(key)
+        if not _fresh(snap):
+            return None
+        return col_proj.project(snap["rows"][1:], cols, month)
+
+
+def count_where(key: str, col: int, value: str) -> int | None:
+    with _LOCK:
+        snap = _SNAPSHOTS.get(key)
+        if not snap:
+            return None
+        return sum(1 for r in snap["rows"][1:] if len(r) >= col and r[col - 1] == value)
+
+
+def invalidate(key: str | None = None) -> None:
+    """Expires the snapshot but keeps its version counter monotonic."""
+    with _LOCK:
+        for k, snap in _SNAPSHOTS.items():
+            if key is None or k == key:
+                snap["loaded_at"] = 0.0
+
+
+def version(key: str) -> int:
+    with _LOCK:
+        snap = _SNAPSHOTS.get(key)
+        return int(snap["version"]) if snap else 0
+
+
+def age_sec(key: str) -> int | None:
+    with _LOCK:
+        snap = _SNAPSHOTS.get(key)
+        return int(time.time() - snap["loaded_at"]) if snap else None
@@ -1,8 +1,16 @@
 # -*- coding: utf-8 -*-
 import json
-from config import DATA_DIR
+import re
+from datetime import datetime
+
+from config import COL_COMP, COL_DATE, COL_GROSS, COL_NO, DATA_DIR, OWN_NIPS
+from domain.text_scan import amounts_in, dates_in, seller_nip
+from domain.utils import parse_amount
 
 SUPPLIERS_FILE = DATA_DIR / "known_suppliers.json"
+TEMPLATES_FILE = DATA_DIR / "supplier_templates.json"
+
+_NO_TOKEN_RE = re.compile(r"[A-Z0-9][A-Z0-9/.-]{3,}", re.IGNORECASE)
 
 def remember_supplier(nip: str, name: str, category: str):
     """Learns supplier details to automate future processing."""
@@ -28,3 +36,163 @@ def get_supplier_info(nip: str) -> dict | None:
         data = json.loads(SUPPLIERS_FILE.read_text(encoding="utf-8"))
         return data.get(nip)
     except: return None
+
+
+# --- Per-NIP layout templates ---------------------------------------------
+# A template records where each field sat on a past accepted invoice: the line
+# (from the top and from the bottom) and an anchor - the normalised label in
+# front of the value, or the line above when the value stands alone. Templates
+# are learned only from values the operator accepted or corrected, never from
+# the automatic extraction alone, so a misread cannot reinforce itself. They are
+# keyed by the seller's NIP: the buyer's (our own) NIP is on every invoice.
+
+def _norm(s: str) -> str:
+    return " ".join(re.sub(r"[^\w]+", " ", (s or "").casefold()).split())
+
+
+def _load_templates() -> dict:
+    if not TEMPLATES_FILE.exists():
+        return {}
+    try:
+        return json.loads(TEMPLATES_FILE.read_text(encoding="utf-8"))
+    except Exception:
+        return {}
+
+
+def _value_in_line(field: str, line: str, value: str) -> int:
+    """Start offset of ``value`` in ``line`` (-1 when absent), comparing parsed values, not text."""
+    if field == "gross":
+        want = parse_amount(value)
+        if want <= 0 or want not in amounts_in(line):
+            return -1
+        for m in re.finditer(r"(?<!\d)\d", line):
+            if amounts_in(line[m.start():])[:1] == [want]:
+                return m.start()
+        return -1
+    if field == "date":
+        for m in re.finditer(r"(?<!\d)\d", line):
+            if dates_in(line[m.start():])[:1] == [value]:
+                return m.start()
+        return -1
+    return line.find(value)
+
+
+def _locate(field: str, lines: list[str], value: str) -> dict | None:
+    # Totals sit at the bottom, so gross is searched bottom-up; everything else top-down.
+    order = range(len(lines) - 1, -1, -1) if field == "gross" else range(len(lines))
+    for i in order:
+        pos = _value_in_line(field, lines[i], value)
+        if pos < 0:
+            continue
+        anchor = _norm(lines[i][:pos])
+        next_line = False
+        if not anchor:
+            prev = next((j for j in range(i - 1, -1, -1) if lines[j].strip()), None)
+            if prev is None:
+                return None
+            anchor = _norm(lines[prev])
+            next_line = True
+        return {"anchor": " ".join(anchor.split()[-4:]), "next_line": next_line, "line": i, "from_end": len(lines) - 1 - i}
+    return None
+
+
+def learn_template(nip: str, text: str, fields: dict) -> None:
+    """Records field positions from an accepted invoice so the next one from this NIP skips regex/LLM."""
+    if not nip or not text:
+        return
+    lines = text.splitlines()
+    spots = {}
+    for field in ("date", "no", "gross"):
+        value = str(fields.get(field) or "").strip()
+        if value:
+            spot = _locate(field, lines, value)
+            if spot:
+                spots[field] = spot
+    if not spots and not fields.get("company"):
+        return
+
+    data = _load_templates()
+    tpl = data.get(nip) or {"fields": {}, "seen": 0}
+    tpl["fields"].update(spots)
+    if fields.get("company"):
+        tpl["company"] = fields["company"]
+    tpl["seen"] = int(tpl.get("seen", 0)) + 1
+    tpl["updated"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    data[nip] = tpl
+    TEMPLATES_FILE.write_text(json.dumps(data, ensure_ascii=False, indent=2), encoding="utf-8")
+
+
+def supplier_nip(text: str) -> str:
+    """NIP the invoice's template is keyed by (``OWN_NIPS`` never count as the supplier)."""
+    return seller_nip(text or "", exclude=OWN_NIPS)
+
+
+def learn_accepted(text: str, row: list) -> None:
+    """Learns from an invoice the operator accepted; ``row`` holds the verified sheet values."""
+    nip = supplier_nip(text)
+    if not nip:
+        return
+    cell = lambda col: (row[col - 1] if len(row) >= col else "") or ""
+    fields = {"date": cell(COL_DATE), "no": cell(COL_NO), "gross": cell(COL_GROSS), "company": cell(COL_COMP)}
+    learn_template(nip, text, fields)
+
+
+def _read_value(field: str, snippet: str) -> str:
+    if field == "gross":
+        found = amounts_in(snippet)
+        return f"{found[0]:.2f}" if found else ""
+    if field == "date":
+        found = dates_in(snippet)
+        return found[0] if found else ""
+    for m in _NO_TOKEN_RE.finditer(snippet):
+        tok = m.group().rstrip(".,")
+        if any(c.isdigit() for c in tok):
+            return tok
+    return ""
+
+
+def apply_template(nip: str, text: str) -> tuple[dict, dict]:
+    """Fields read from the supplier's learned layout; only values that parse are returned.
+
+    Returns ``(anchored, positional)``: values found next to their remembered label, and
+    values read from the remembered line number because the label was missing. The
+    latter break on any layout change, so callers let other extractors win over them.
+    The remembered company is only returned once an anchored field confirmed the layout.
+    """
+    tpl = _load_templates().get(nip) if nip else None
+    if not tpl or not text:
+        return {}, {}
+    lines = text.splitlines()
+    norm_lines = [_norm(ln) for ln in lines]
+    out = {}
+    positional = {}
+    for field, spot in (tpl.get("fields") or {}).items():
+        anchor = spot.get("anchor", "")
+        order = range(len(lines) - 1, -1, -1) if field == "gross" else range(len(lines))
+        value = ""
+        for i in order:
+            if not anchor or anchor not in norm_lines[i]:
+                continue
+            if spot.get("next_line"):
+                nxt = next((j for j in range(i + 1, len(lines)) if lines[j].strip()), None)
+                value = _read_value(field, lines[nxt]) if nxt is not None else ""
+            else:
+                # Text after the anchor's last word on the raw line.
+                last = anchor.split()[-1]
+                idx = lines[i].casefold().rfind(last)
+                value = _read_value(field, lines[i][idx + len(last):] if idx >= 0 else lines[i])
+            if value:
+                break
+        if value:
+            out[field] = value
+        elif lines:
+            # Anchor not found (OCR noise): fall back to the remembered line position.
+            i = spot.get("from_end", 0) if field == "gross" else spot.get("line", 0)
+            i = len(lines) - 1 - i if field == "gross" else i
+            if 0 <= i < len(lines):
+                value = _read_value(field, lines[i])
+            if value:
+                positional[field] = value
+    if out and tpl.get("company"):
+        out["company"] = tpl["company"]
+    return out, positional
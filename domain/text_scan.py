@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+"""Single-pass candidate scanner for OCR text.
+
+Two precompiled scans - one over keywords, one over digit runs - collect every
+candidate the extractors care about (dates, amounts, invoice number, NIP, IBAN,
+currency, seller) in a single pass each. ``scan()`` is memoised on the text, so ocr_service, premium_ocr and
+payments share one scan per document instead of rescanning it each.
+"""
+import re
+from datetime import date
+from functools import lru_cache
+
+# Keywords are matched on the lower-cased text without IGNORECASE: every branch then
+# starts with a literal, which lets the regex engine skip ahead in C instead of
+# trying each alternative at every character.
+_KW_RE = re.compile(
+    r"kwota\s+do\s+zap[łl]aty|do\s+zap[łl]aty|razem|suma|total"
+    r"|data|dnia|wystawienia|sprzedaży"
+    r"|sprzedawca|wystawca|dostawca"
+    r"|faktura|fv|nr"
+    r"|nip|vat\s*id"
+    r"|eur|usd|gbp|€|\$|£"
+)
+_KW_KIND = {
+    "kwotadozapłaty": "amount_kw", "kwotadozaplaty": "amount_kw", "dozapłaty": "amount_kw", "dozaplaty": "amount_kw",
+    "razem": "amount_kw", "suma": "amount_kw", "total": "amount_kw",
+    "data": "date_kw", "dnia": "date_kw", "wystawienia": "date_kw", "sprzedaży": "date_kw",
+    "sprzedawca": "seller", "wystawca": "seller", "dostawca": "seller",
+    "faktura": "no", "fv": "no", "nr": "no",
+    "nip": "nip", "vatid": "nip",
+    "eur": "currency", "€": "currency", "usd": "currency", "$": "currency", "gbp": "currency", "£": "currency",
+}
+
+_AMOUNT = r"\d{1,3}(?:[  .,]\d{3})+(?:[.,]\d{1,2})?(?!\d)|\d+(?:[.,]\d{1,2})?(?!\d)"
+# Every branch starts at the first digit of a run. Amounts only count here with a currency suffix;
+# keyword-anchored amounts are picked up from the keyword scan. An account number must keep the
+# NRB grouping (2 + 6x4 digits), so dates, amounts and table columns are never glued into one.
+_NUM_RE = re.compile(
+    r"(?<!\d)(?=\d)(?:"
+    r"(?P<iban>\d{2}(?:[ -]?\d{4}){6})(?!\d)"
+    r"|(?P<y1>\d{4})(?P<s1>[-./])(?P<m1>\d{2})(?P=s1)(?P<d1>\d{2})"
+    r"|(?P<d2>\d{2})(?P<s2>[-./])(?P<m2>\d{2})(?P=s2)(?P<y2>\d{4})"
+    rf"|(?P<amount>{_AMOUNT})\s*(?:pln|zł|zlt)"
+    r")"
+)
+_AMOUNT_RE = re.compile(rf"(?<!\d)(?:{_AMOUNT})")
+_DATE_TOKEN_RE = re.compile(r"(?<!\d)(\d{4})([-./])(\d{2})\2(\d{2})|(?<!\d)(\d{2})([-./])(\d{2})\6(\d{4})")
+_KEYED_AMOUNT_RE = re.compile(rf"\s*:?\s*(?P<amount>{_AMOUNT})")
+_NO_VAL_RE = re.compile(r"\s*(?:VAT|nr)?\s*[:.]?\s*([A-Z0-9/.-]{4,})", re.IGNORECASE)
+_NIP_VAL_RE = re.compile(r"[:\s]*([0-9-]{10,13})")
+_SELLER_VAL_RE = re.compile(r"[:\s]*\n?(.+)")
+_ISO_DATE_RE = re.compile(r"\d{4}[-./]\d{2}[-./]\d{2}")
+_CURRENCY_RANK = {"eur": 0, "€": 0, "usd": 1, "$": 1, "gbp": 2, "£": 2}
+_CURRENCY_CODE = {"eur": "EUR", "€": "EUR", "usd": "USD", "$": "USD", "gbp": "GBP", "£": "GBP"}
+
+# Upper sanity bound for a single invoice total.
+MAX_AMOUNT = 1_000_000
+
+
+def _iso(y: str, m: str, d: str) -> str:
+    try:
+        return date(int(y), int(m), int(d)).isoformat()
+    except ValueError:
+        return ""
+
+
+def _amount(run: str) -> float:
+    # Same separator heuristic as domain.utils.parse_amount, on an already-clean digit run.
+    s = run.replace(" ", "").replace("\u00a0", "")
+    if "," in s and "." in s:
+        if s.rfind(",") > s.rfind("."):
+            s = s.replace(".", "").replace(",", ".")
+        else:
+            s = s.replace(",", "")
+    else:
+        s = s.replace(",", ".")
+    if s.count(".") > 1:
+        head, _, tail = s.rpartition(".")
+        s = head.replace(".", "") + "." + tail
+    try:
+        return float(s)
+    except ValueError:
+        return 0.0
+
+
+def _lower(text: str) -> str:
+    low = text.lower()
+    if len(low) == len(text):
+        return low
+    # A few characters (e.g. "İ") grow when lower-cased; keep offsets aligned with ``text``.
+    return "".join(c if len(c.lower()) != 1 else c.lower() for c in text)
+
+
+def _add_amount(amounts: list, run: str) -> None:
+    val = _amount(run)
+    if 0 < val < MAX_AMOUNT:
+        amounts.append(val)
+
+
+@lru_cache(maxsize=32)
+def scan(text: str) -> dict:
+    """Returns every candidate found in ``text``. The result is shared - treat it as read-only."""
+    low = _lower(text)
+    dates: list[tuple[int, str]] = []
+    amounts: list[float] = []
+    date_kw_end = None
+    no = nip = iban = seller = ""
+    nips: list[tuple[int, str]] = []
+    seller_at = None
+    iban_pl = False
+    currency_rank = None
+    currency = "PLN"
+
+    for m in _KW_RE.finditer(low):
+        word = m.group()
+        kind = _KW_KIND.get("".join(word.split()))
+        end = m.end()
+        if kind == "amount_kw":
+            v = _KEYED_AMOUNT_RE.match(low, end)
+            if v:
+                _add_amount(amounts, v.group("amount"))
+        elif kind == "date_kw":
+            if date_kw_end is None:
+                date_kw_end = end
+        elif kind == "no":
+            if not no:
+                v = _NO_VAL_RE.match(text, end)
+                no = v.group(1) if v else ""
+        elif kind == "nip":
+            v = _NIP_VAL_RE.match(text, end)
+            digits = "".join(filter(str.isdigit, v.group(1))) if v else ""
+            if not nip:
+                nip = digits
+            if digits:
+                nips.append((m.start(), digits))
+        elif kind == "seller":
+            if seller_at is None:
+                seller_at = m.start()
+            if not seller:
+                v = _SELLER_VAL_RE.match(text, end)
+                seller = v.group(1) if v else ""
+        elif kind == "currency":
+            rank = _CURRENCY_RANK[word]
+            if currency_rank is None or rank < currency_rank:
+                currency_rank = rank
+                currency = _CURRENCY_CODE[word]
+
+    for m in _NUM_RE.finditer(low):
+        if m.group("amount"):
+            _add_amount(amounts, m.group("amount"))
+        elif m.group("y1"):
+            iso = _iso(m.group("y1"), m.group("m1"), m.group("d1"))
+            if iso:
+                dates.append((m.start(), iso))
+        elif m.group("y2"):
+            iso = _iso(m.group("y2"), m.group("m2"), m.group("d2"))
+            if iso:
+                dates.append((m.start(), iso))
+        elif m.group("iban"):
+            # An explicit "PL..." account beats a bare 26-digit run found earlier.
+            has_pl = low[max(0, m.start() - 8):m.start()].rstrip(" -").endswith("pl")
+            if not iban or (has_pl and not iban_pl):
+                iban = "PL" + "".join(filter(str.isdigit, m.group("iban")))
+                iban_pl = has_pl
+
+    return {
+        "dates": tuple(dates),
+        "date_kw_end": date_kw_end,
+        "amounts": tuple(amounts),
+        "no": no,
+        "nip": nip,
+        "nips": tuple(nips),
+        "seller_at": seller_at,
+        "iban": iban,
+        "currency": currency,
+        "seller": seller,
+    }
+
+
+def seller_nip(text: str, exclude=()) -> str:
+    """The supplier's NIP: the first one after the seller keyword, else the first one not in ``exclude``."""
+    res = scan(text)
+    candidates = [n for _, n in res["nips"] if n not in exclude]
+    if res["seller_at"] is not None:
+        after = [n for pos, n in res["nips"] if pos > res["seller_at"] and n not in exclude]
+        if after:
+            return after[0]
+    return candidates[0] if candidates else ""
+
+
+def invoice_date(text: str) -> str:
+    """First valid date after the first date keyword, else the first ISO-ordered date."""
+    res = scan(text)
+    kw_end = res["date_kw_end"]
+    if kw_end is not None:
+        for pos, iso in res["dates"]:
+            if pos >= kw_end:
+                return iso
+    for pos, iso in res["dates"]:
+        if _ISO_DATE_RE.match(text, pos):
+            return iso
+    return ""
+
+
+def amounts_in(s: str) -> list[float]:
+    """Plain amounts (no keyword or currency required) in a short snippet, e.g. one line."""
+    return [v for v in (_amount(m.group()) for m in _AMOUNT_RE.finditer(s)) if 0 < v < MAX_AMOUNT]
+
+
+def dates_in(s: str) -> list[str]:
+    out = []
+    for m in _DATE_TOKEN_RE.finditer(s):
+        iso = _iso(*m.group(1, 3, 4)) if m.group(1) else _iso(*m.group(8, 7, 5))
+        if iso:
+            out.append(iso)
+    return out
@@ -17,9 +17,11 @@ from config import (
     STATUS_TODO, STATUS_OK, STATUS_SENT,
 )
 
-from storage_router import get_all_values, get_row, update_cell
+from storage_router import aget_all_values, aget_columns, aget_row, aupdate_cell, search_scope
+from domain import search_index
 from domain.invoices import missing_fields  # jeli masz; jak nie masz, daj zna
 from domain.audit import log_event
+from domain.supplier_intel import learn_accepted
 from keyboards import (
     kb_page,
     kb_mama_tiles,
@@ -152,16 +154,20 @@ def month_from_row(r: list) -> str:
 # =========================
 #  SHEETS READERS
 # =========================
-def get_all_rows(update: Update):
+async def get_all_rows(update: Update):
     """Zwraca wszystkie wiersze (bez nagwka), jako list[list[str]]"""
-    allv = get_all_values(update)
+    allv = await aget_all_values(update)
     return allv[1:] if len(allv) > 1 else []
 
 def pad_row(r: list, n: int):
     return r + [""] * (n - len(r))
 
-def compute_month_stats(update: Update, m: str):
-    rows = get_all_rows(update)
+_STATS_COLS = (COL_GROSS, COL_TYPE, COL_VAT, COL_NET, COL_STATUS)
+
+
+async def compute_month_stats(update: Update, m: str):
+    # Only the columns the stats need, and only rows of month m.
+    row_nos, cols = await aget_columns(update, _STATS_COLS, month=m)
 
     total_gross = 0.0
     total_vat = 0.0
@@ -175,20 +181,16 @@ def compute_month_stats(update: Update, m: str):
     todo_rows = []
     todo_missing_price_rows = []
 
-    for idx, r in enumerate(rows, start=2):
-        r = pad_row(r, COL_FILE)
-        if not (r[COL_DATE - 1] or "").startswith(m):
-            continue
-
-        st = (r[COL_STATUS - 1] or "").strip()
+    for i, idx in enumerate(row_nos):
+        st = (cols[COL_STATUS][i] or "").strip()
         if st == STATUS_OK:
             cnt_ok += 1
         elif st == STATUS_SENT:
             cnt_sent += 1
 
-        gross = parse_amount(r[COL_GROSS - 1])
-        vat = parse_amount(r[COL_VAT - 1])
-        net = parse_amount(r[COL_NET - 1])
+        gross = parse_amount(cols[COL_GROSS][i])
+        vat = parse_amount(cols[COL_VAT][i])
+        net = parse_amount(cols[COL_NET][i])
 
         if gross > 0:
             total_gross += gross
@@ -197,7 +199,7 @@ def compute_month_stats(update: Update, m: str):
         if net > 0:
             total_net += net
 
-        inv_type = (r[COL_TYPE - 1] or "").strip().upper()
+        inv_type = (cols[COL_TYPE][i] or "").strip().upper()
         if inv_type == TYPE_VAT:
             total_vat_gross += gross
         else:
@@ -223,16 +225,13 @@ def compute_month_stats(update: Update, m: str):
         "todo_missing_price": todo_missing_price_rows,
     }
 
-def find_next_missing_price_in_month(update: Update, m: str, after_row: int | None = None) -> int | None:
-    rows = get_all_rows(update)
-    for idx, r in enumerate(rows, start=2):
+async def find_next_missing_price_in_month(update: Update, m: str, after_row: int | None = None) -> int | None:
+    row_nos, cols = await aget_columns(update, (COL_GROSS, COL_STATUS), month=m)
+    for idx, gross_s, st in zip(row_nos, cols[COL_GROSS], cols[COL_STATUS]):
         if after_row is not None and idx <= after_row:
             continue
-        r = pad_row(r, COL_FILE)
-        if not (r[COL_DATE - 1] or "").startswith(m):
-            continue
-        gross = parse_amount(r[COL_GROSS - 1])
-        st = (r[COL_STATUS - 1] or "").strip()
+        gross = parse_amount(gross_s)
+        st = (st or "").strip()
         if gross <= 0 or st == STATUS_TODO:
             return idx
     return None
@@ -241,6 +240,11 @@ def find_next_missing_price_in_month(update: Update, m: str, after_row: int | No
 # =========================
 #  VAT/NET CALC
 # =========================
+def learn_supplier_layout(update: Update, row_no: int, r: list) -> None:
+    """Teaches the supplier template from a row the operator just accepted (values are verified)."""
+    learn_accepted(search_index.text_for(row_no, scope=search_scope(update), row=r), r)
+
+
 def calc_vat_net(gross: float, inv_type: str):
     inv_type = (inv_type or "").strip().upper()
     if inv_type == TYPE_VAT:
@@ -314,8 +318,8 @@ def kb_ocr_fields(row_no: int, link: str, month: str | None = None) -> InlineKey
         [InlineKeyboardButton("Data", callback_data=f"i:ocrf:{row_no}:date"), InlineKeyboardButton("Kwota", callback_data=f"i:ocrf:{row_no}:gross")],
         [InlineKeyboardButton("Powrot", callback_data=f"i:open:{row_no}")],
     ])
-def nice_month_report(update: Update, m: str) -> str:
-    st = compute_month_stats(update, m)
+async def nice_month_report(update: Update, m: str) -> str:
+    st = await compute_month_stats(update, m)
     todo_txt = "brak " if not st["todo"] else ", ".join(map(str, st["todo"][:20])) + (" " if len(st["todo"]) > 20 else "")
     miss_txt = "brak " if not st["todo_missing_price"] else ", ".join(map(str, st["todo_missing_price"][:20])) + (" " if len(st["todo_missing_price"]) > 20 else "")
 
@@ -338,8 +342,8 @@ def nice_month_report(update: Update, m: str) -> str:
 # =========================
 #  ZIP DO KSIGOWEJ
 # =========================
-def build_month_zip(update: Update, m: str) -> tuple[bytes, str]:
-    rows = get_all_rows(update)
+async def build_month_zip(update: Update, m: str) -> tuple[bytes, str]:
+    rows = await get_all_rows(update)
     out_rows = []
     links = []
 
@@ -376,7 +380,7 @@ def build_month_zip(update: Update, m: str) -> tuple[bytes, str]:
 #  AUTO-NEXT / CONTINUE
 # =========================
 async def open_row(update: Update, q, uid: int, row_no: int, note: str = ""):
-    r = get_row(update, row_no)
+    r = await aget_row(update, row_no)
     r = pad_row(r, COL_FILE)
     link = (r[COL_FILE - 1] or "").strip()
     m = month_from_row(r)
@@ -550,10 +554,10 @@ async def on_click(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
         m = ensure_month(m) or today_ym()
 
         if prefix == "snap":
-            return await safe_edit(q, nice_month_report(update, m), kb_page(2))
+            return await safe_edit(q, await nice_month_report(update, m), kb_page(2))
 
         if prefix in ("todo", "todo_missing"):
-            st = compute_month_stats(update, m)
+            st = await compute_month_stats(update, m)
             lst = st["todo"] if prefix == "todo" else st["todo_missing_price"]
             if not lst:
                 return await safe_edit(q, f"Nic do poprawy w {m}.", kb_page(2))
@@ -562,7 +566,7 @@ async def on_click(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
             return await open_row(update, q, uid, first, note=f" Lista ({m})  start")
 
         if prefix == "pack":
-            zip_bytes, filename = build_month_zip(update, m)
+            zip_bytes, filename = await build_month_zip(update, m)
             await q.message.reply_document(document=zip_bytes, filename=filename)
             return await safe_edit(q, f"ZIP wyslany dla {m}.", kb_page(2))
 
@@ -573,7 +577,7 @@ async def on_click(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
         after = int(last_row) if last_row.isdigit() else None
         if not m:
             return await safe_edit(q, "Brak kontekstu. Wejdz w Do sprawdzenia albo Podglad miesiaca.", kb_page(1))
-        nxt = find_next_missing_price_in_month(update, m, after_row=after)
+        nxt = await find_next_missing_price_in_month(update, m, after_row=after)
         if not nxt:
             return await safe_edit(q, f"Nic wiecej do poprawy w {m}.", kb_page(1))
         return await open_row(update, q, uid, nxt, note=" Kontynuuj")
@@ -601,7 +605,7 @@ async def on_click(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
         if not row_s.isdigit():
             return
         row_no = int(row_s)
-        r = get_row(update, row_no)
+        r = await aget_row(update, row_no)
         r = pad_row(r, COL_FILE)
         link = (r[COL_FILE - 1] or "").strip()
         m = month_from_row(r)
@@ -644,17 +648,18 @@ async def on_click(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
             miss = missing_fields(r)
             if miss:
                 old_status = (r[COL_STATUS - 1] if len(r) >= COL_STATUS else "") or ""
-                update_cell(update, row_no, COL_STATUS, STATUS_TODO)
+                await aupdate_cell(update, row_no, COL_STATUS, STATUS_TODO)
                 log_event("status_change", user_id=uid, row_no=row_no, old_status=old_status, new_status=STATUS_TODO, source="callbacks:i:ok:missing")
                 return await safe_edit(q, f" Brakuje: {', '.join(miss)}\nKliknij  Napraw.", kb_invoice(row_no, link, m))
 
             old_status = (r[COL_STATUS - 1] if len(r) >= COL_STATUS else "") or ""
-            update_cell(update, row_no, COL_STATUS, STATUS_OK)
+            await aupdate_cell(update, row_no, COL_STATUS, STATUS_OK)
             log_event("status_change", user_id=uid, row_no=row_no, old_status=old_status, new_status=STATUS_OK, source="callbacks:i:ok")
+            learn_supplier_layout(update, row_no, r)
             await safe_edit(q, f"OK. Wiersz {row_no} -> {STATUS_OK}", kb_invoice(row_no, link, m))
 
             # AUTO-NEXT
-            nxt = find_next_missing_price_in_month(update, m, after_row=row_no)
+            nxt = await find_next_missing_price_in_month(update, m, after_row=row_no)
             if not nxt:
                 return await q.message.reply_text(f" Koniec na dzi. W {m} nie ma ju rzeczy do poprawy.")
             try:
@@ -664,12 +669,12 @@ async def on_click(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
 
         if action == "sent":
             old_status = (r[COL_STATUS - 1] if len(r) >= COL_STATUS else "") or ""
-            update_cell(update, row_no, COL_STATUS, STATUS_SENT)
+            await aupdate_cell(update, row_no, COL_STATUS, STATUS_SENT)
             log_event("status_change", user_id=uid, row_no=row_no, old_status=old_status, new_status=STATUS_SENT, source="callbacks:i:sent")
             await safe_edit(q, f"Wiersz {row_no} -> {STATUS_SENT}", kb_invoice(row_no, link, m))
 
             # AUTO-NEXT
-            nxt = find_next_missing_price_in_month(update, m, after_row=row_no)
+            nxt = await find_next_missing_price_in_month(update, m, after_row=row_no)
             if not nxt:
                 return await q.message.reply_text(f" W {m} nie ma ju kolejnych do poprawy.")
             try:
@@ -678,7 +683,7 @@ async def on_click(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
                 return
 
         if action == "next":
-            nxt = find_next_missing_price_in_month(update, m, after_row=row_no)
+            nxt = await find_next_missing_price_in_month(update, m, after_row=row_no)
             if not nxt:
                 return await safe_edit(q, f"Nic wiecej do poprawy w {m}.", kb_invoice(row_no, link, m))
             return await open_row(update, q, uid, nxt, note=" Next")
@@ -1,4 +1,5 @@
 ﻿# -*- coding: utf-8 -*-
+import asyncio
 import time
 from datetime import datetime
 from pathlib import Path
@@ -24,13 +25,23 @@ from config import (
 from domain.audit import count_last_hours, read_recent
 from domain.backup import build_backup_zip, restore_test_latest_backup
 from domain.metrics import summarize_24h
+from domain.rag_bridge import rag_health
 from domain.reporting import parse_month_arg
 from domain.retention import apply_retention
 from handlers.callbacks import build_month_zip, compute_month_stats
 from handlers.errors import error_count_last_24h, get_last_error
 from keyboards import kb_mama_tiles, kb_page, kb_splash
 from sheets_service import sa_path, ws
-from storage_router import get_all_values, get_storage, process_retry_backlog, retry_stats
+from storage_router import (
+    aget_all_values,
+    aprocess_retry_backlog,
+    arefresh,
+    circuit_stats,
+    get_storage,
+    mirror_stats,
+    retry_stats,
+    snapshot_version,
+)
 
 _BOOT_TS = datetime.now()
 _LAST_HEALTH_ALERT_AT: datetime | None = None
@@ -142,8 +153,8 @@ async def cmd_export(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
         return await update.message.reply_text("Tylko operator lub admin.")
 
     month = parse_month_arg(list(ctx.args or []))
-    zip_bytes, filename = build_month_zip(update, month)
-    st = compute_month_stats(update, month)
+    zip_bytes, filename = await build_month_zip(update, month)
+    st = await compute_month_stats(update, month)
     caption = (
         f"Export {month}\n"
         f"Brutto: {st['gross']:.2f} | Netto: {st['net']:.2f} | VAT: {st['vat']:.2f}\n"
@@ -152,6 +163,50 @@ async def cmd_export(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_document(document=zip_bytes, filename=filename, caption=caption)
 
 
+def _to_a1_col(col_idx: int) -> str:
+    out = []
+    n = max(1, int(col_idx))
+    while n > 0:
+        n, r = divmod(n - 1, 26)
+        out.append(chr(ord("A") + r))
+    return "".join(reversed(out))
+
+
+def _sheets_diag(run_rw: bool) -> list[str]:
+    """Blocking gspread checks (and the optional write probe); run via ``asyncio.to_thread``."""
+    lines = []
+    try:
+        worksheet = ws()
+        header = worksheet.row_values(1)
+        header_preview = ", ".join(header[:5]) if header else "(empty)"
+        lines.extend(
+            [
+                "sheets_conn: OK",
+                f"worksheet_title: {worksheet.title}",
+                f"worksheet_rows: {worksheet.row_count}",
+                f"worksheet_cols: {worksheet.col_count}",
+                f"header_preview: {header_preview}",
+            ]
+        )
+
+        if run_rw:
+            probe_col = max(1, int(worksheet.col_count or 1))
+            probe_row = 2 if int(worksheet.row_count or 1) >= 2 else 1
+            probe_cell = f"{_to_a1_col(probe_col)}{probe_row}"
+            token = f"DIAG_{datetime.now():%Y%m%d_%H%M%S}"
+            old_value = worksheet.acell(probe_cell).value
+            worksheet.update_acell(probe_cell, token)
+            read_back = worksheet.acell(probe_cell).value
+            worksheet.update_acell(probe_cell, old_value or "")
+            lines.extend([f"rw_probe_cell: {probe_cell}", f"rw_write_ok: {'yes' if read_back == token else 'no'}"])
+        else:
+            lines.append("rw_test: skipped (use /diag rw)")
+
+    except Exception as exc:
+        lines.extend(["sheets_conn: ERROR", f"sheets_error: {exc}"])
+    return lines
+
+
 async def cmd_diag(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
     if not is_allowed(update):
         return await update.message.reply_text("Brak dostepu.")
@@ -179,50 +234,14 @@ async def cmd_diag(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
 
     t0 = time.perf_counter()
     try:
-        get_all_values(update)
+        await aget_all_values(update)
         latency_ms = int((time.perf_counter() - t0) * 1000)
         lines.append(f"backend_read_latency_ms: {latency_ms}")
     except Exception as exc:
         lines.append(f"backend_read_error: {exc}")
 
     if backend == "SheetsStorage":
-        try:
-            worksheet = ws()
-            header = worksheet.row_values(1)
-            header_preview = ", ".join(header[:5]) if header else "(empty)"
-            lines.extend(
-                [
-                    "sheets_conn: OK",
-                    f"worksheet_title: {worksheet.title}",
-                    f"worksheet_rows: {worksheet.row_count}",
-                    f"worksheet_cols: {worksheet.col_count}",
-                    f"header_preview: {header_preview}",
-                ]
-            )
-
-            if run_rw:
-                def _to_a1_col(col_idx: int) -> str:
-                    out = []
-                    n = max(1, int(col_idx))
-                    while n > 0:
-                        n, r = divmod(n - 1, 26)
-                        out.append(chr(ord("A") + r))
-                    return "".join(reversed(out))
-
-                probe_col = max(1, int(worksheet.col_count or 1))
-                probe_row = 2 if int(worksheet.row_count or 1) >= 2 else 1
-                probe_cell = f"{_to_a1_col(probe_col)}{probe_row}"
-                token = f"DIAG_{datetime.now():%Y%m%d_%H%M%S}"
-                old_value = worksheet.acell(probe_cell).value
-                worksheet.update_acell(probe_cell, token)
-                read_back = worksheet.acell(probe_cell).value
-                worksheet.update_acell(probe_cell, old_value or "")
-                lines.extend([f"rw_probe_cell: {probe_cell}", f"rw_write_ok: {'yes' if read_back == token else 'no'}"])
-            else:
-                lines.append("rw_test: skipped (use /diag rw)")
-
-        except Exception as exc:
-            lines.extend(["sheets_conn: ERROR", f"sheets_error: {exc}"])
+        lines.extend(await asyncio.to_thread(_sheets_diag, run_rw))
     else:
         lines.append("sheets_conn: skipped (user routed to API backend)")
 
@@ -251,7 +270,7 @@ async def cmd_metrics(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
 async def cmd_retry(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
     if not is_admin(update):
         return await update.message.reply_text("Brak dostepu.")
-    res = process_retry_backlog(limit=50)
+    res = await aprocess_retry_backlog(limit=50)
     rq = retry_stats()
     await update.message.reply_text(
         "RETRY QUEUE\n"
@@ -320,7 +339,8 @@ async def cmd_health(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
 
     t0 = time.perf_counter()
     try:
-        allv = get_all_values(update)
+        # Past the snapshot cache: the probe times the backend itself.
+        allv = await aget_all_values(update, fresh=True)
         rows = max(0, len(allv) - 1)
         latency_ms = int((time.perf_counter() - t0) * 1000)
     except Exception as exc:
@@ -330,13 +350,19 @@ async def cmd_health(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
     err_24h = error_count_last_24h()
     metrics = summarize_24h()
     rq = retry_stats()
+    circuits = circuit_stats()
+    open_circuits = [name for name, c in circuits.items() if c["state"] == "open"]
 
+    if status == "ok" and open_circuits:
+        status = "degraded"
+        detail = f"circuit open: {', '.join(open_circuits)}"
     if status == "ok" and (latency_ms > 1500 or err_24h > 20 or rq["queue"] > 20):
         status = "degraded"
         detail = "high latency/errors/retry queue"
 
     uptime = datetime.now() - _BOOT_TS
     last_error = get_last_error()
+    rag = await rag_health()
     lines = [
         "HEALTH",
         f"status: {status}",
@@ -353,8 +379,18 @@ async def cmd_health(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
         f"ocr_latency_p95_ms_24h: {metrics['ocr_latency_p95_ms']}",
         f"retry_queue: {rq['queue']}",
         f"dead_letter: {rq['dlq']}",
+        f"snapshot_version: {snapshot_version(update)}",
+        f"rag_worker: {rag['state']} (restarts {rag['restarts']})",
+        *(
+            f"circuit_{name}: {c['state']} (failures {c['failures']}, trips {c['trips']}"
+            + (f", retry_in {c['retry_in_s']}s)" if c["state"] == "open" else ")")
+            for name, c in circuits.items()
+        ),
         f"ts: {datetime.now():%Y-%m-%d %H:%M:%S}",
     ]
+    mirror = mirror_stats()
+    if mirror is not None:
+        lines.insert(-1, f"sqlite_mirror: pending {mirror['pending']}, pulled {mirror['pulled_ago_s']}s ago, pushed {mirror['pushed_ago_s']}s ago")
     await update.message.reply_text("\n".join(lines), reply_markup=kb_page(1))
 
     if _health_alert_due(status):
@@ -386,8 +422,8 @@ async def cmd_refresh(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
     if not is_mama(update):
         return
     
-    # Force reload from sheets
-    get_all_values(update) 
+    # Force reload from sheets (drops the cached snapshot)
+    await arefresh(update)
     
     await cmd_start(update, ctx)
 
@@ -1,13 +1,11 @@
 ﻿# -*- coding: utf-8 -*-
+import asyncio
 import hashlib
-import re
 import time
-from collections import Counter
 from datetime import datetime
 from pathlib import Path
 
 import fitz
-from PIL import Image, ImageStat
 from googleapiclient.http import MediaFileUpload
 from telegram import Update
 from telegram.ext import ContextTypes, MessageHandler, filters
@@ -39,16 +37,44 @@ from config import (
     is_mama,
     is_operator,
 )
+from domain import company_index, search_index
 from domain.audit import begin_request, log_event
-from domain.idempotency import find_duplicate, find_duplicate_content, register_content_hash, register_file_hash
+from domain.idempotency import (
+    find_duplicate,
+    find_duplicate_content,
+    find_duplicate_upload,
+    find_near_duplicate_image,
+    find_soft_duplicate,
+    forget_soft_duplicate,
+    register_content_hash,
+    register_file_hash,
+    register_image_hash,
+    register_soft_duplicate,
+    register_upload_id,
+    seed_soft_index,
+    soft_index_seeded,
+    soft_row_matches,
+)
 from domain.invoices import missing_fields, today_ymd, user_label, vat_net_from_gross
 from domain.mappers import preview_fields_map
 from domain.metrics import record_metric
-from domain.smart_logic import is_soft_duplicate, predict_category, sanitize_company_name
+from domain.resilience import retry_async
+from domain.smart_logic import predict_category, sanitize_company_name
+from domain.utils import parse_amount
 from keyboards import kb_invoice, kb_mama_company_suggestions, kb_mama_next_only, kb_mama_review_tiles, kb_mama_tiles, kb_page
-from ocr_service import extract_fields, ocr_image, ocr_pdf, parse_amount, setup_tesseract
-from sheets_service import drive, ensure_drive_root
-from storage_router import append_row, get_all_values, next_row
+from ocr_service import (
+    OcrBusyError,
+    aocr_cache_key,
+    check_image_quality,
+    extract_fields,
+    ocr_file,
+    perceptual_hash,
+    setup_tesseract,
+)
+from sheets_service import drive, drive_call, ensure_drive_root
+from storage_router import aappend_row, aget_all_values, aget_columns, aget_row, search_scope
+
+_OCR_BUSY_MSG = "⏳ Duzo faktur w kolejce OCR. Wyslij plik ponownie za chwile."
 
 _ALLOWED_DOC_MIME = {
     "application/pdf",
@@ -57,12 +83,48 @@ _ALLOWED_DOC_MIME = {
 }
 
 
-def sha256_file(path: Path) -> str:
-    h = hashlib.sha256()
-    with open(path, "rb") as f:
-        for chunk in iter(lambda: f.read(1024 * 1024), b""):
-            h.update(chunk)
-    return h.hexdigest()
+class _HashingWriter:
+    """File sink for download_to_memory that hashes bytes as they are written."""
+
+    def __init__(self, f):
+        self._f = f
+        self.sha = hashlib.sha256()
+
+    def write(self, data) -> int:
+        self.sha.update(data)
+        return self._f.write(data)
+
+
+async def _download_hashed(tg, local: Path) -> str:
+    with local.open("wb") as f:
+        sink = _HashingWriter(f)
+        await tg.download_to_memory(out=sink)
+    return sink.sha.hexdigest()
+
+
+async def _live_soft_duplicate(update: Update, fields: dict):
+    """Soft-duplicate hit whose row still holds that invoice; the index is written on save only,
+    so rows sorted or edited in the sheet since then are re-read and stale entries dropped."""
+    key = (fields.get("date", ""), fields.get("gross", ""), fields.get("company", ""))
+    while (stamp := find_soft_duplicate(*key)) is not None:
+        try:
+            row = await aget_row(update, int(stamp.get("row_no") or 0))
+        except Exception:
+            return stamp  # cannot check now: warn as before
+        if soft_row_matches(row, *key, COL_DATE, COL_GROSS, COL_COMP):
+            return stamp
+        forget_soft_duplicate(stamp)
+    return None
+
+
+async def _reject_duplicate(update: Update, uid: int, dup: dict, request_id: str, **ids):
+    STATE.pop(uid, None)
+    log_event("invoice_duplicate_rejected", user_id=uid, duplicate_of=dup, request_id=request_id, **ids)
+    row_ref = dup.get("row_no", "?")
+    return await update.message.reply_text(
+        f"🔁 Duplikat pliku. Ta faktura byla juz dodana (wiersz {row_ref}).",
+        reply_markup=menu_kb(update),
+    )
 
 
 def _safe_int(value) -> int:
@@ -97,18 +159,11 @@ def menu_kb(update: Update):
     return kb_mama_tiles() if is_mama(update) else kb_page(1)
 
 
-def _mama_top_companies(update: Update, limit: int = 8) -> list[str]:
-    counts = Counter()
-    allv = get_all_values(update)
-    rows = allv[1:] if len(allv) > 1 else []
-    for r in rows:
-        if len(r) < COL_COMP:
-            continue
-        comp = (r[COL_COMP - 1] or "").strip()
-        if len(comp) < 2:
-            continue
-        counts[comp] += 1
-    return [name for name, _ in counts.most_common(limit)]
+async def _mama_top_companies(update: Update, limit: int = 8) -> list[str]:
+    if company_index.is_empty():
+        _, cols = await aget_columns(update, [COL_COMP])
+        company_index.seed_names(cols[COL_COMP])
+    return company_index.top(limit)
 
 
 async def _mama_missing_amount_reminder(ctx: ContextTypes.DEFAULT_TYPE):
@@ -134,12 +189,12 @@ def ensure_month_folder(parent_id: str, month: str) -> str:
         "mimeType='application/vnd.google-apps.folder' "
         f"and name='{month}' and '{parent_id}' in parents and trashed=false"
     )
-    res = svc.files().list(q=q, fields="files(id,name)", pageSize=10).execute()
+    res = drive_call(lambda: svc.files().list(q=q, fields="files(id,name)", pageSize=10).execute(), "drive_list")
     files = res.get("files", [])
     if files:
         return files[0]["id"]
     meta = {"name": month, "mimeType": "application/vnd.google-apps.folder", "parents": [parent_id]}
-    created = svc.files().create(body=meta, fields="id").execute()
+    created = drive_call(lambda: svc.files().create(body=meta, fields="id").execute(), "drive_mkdir")
     return created["id"]
 
 
@@ -148,7 +203,9 @@ def upload_to_drive(filepath: Path, month: str) -> str:
     folder = ensure_month_folder(parent, month)
     media = MediaFileUpload(str(filepath), resumable=True)
     meta = {"name": filepath.name, "parents": [folder]}
-    created = drive().files().create(body=meta, media_body=media, fields="id,webViewLink").execute()
+    created = drive_call(
+        lambda: drive().files().create(body=meta, media_body=media, fields="id,webViewLink").execute(), "drive_upload"
+    )
     fid = created["id"]
     return created.get("webViewLink") or f"https://drive.google.com/file/d/{fid}/view?usp=sharing"
 
@@ -163,39 +220,6 @@ def normalize_inv_type(v: str) -> str:
 
 
 
-def _check_image_quality(local: Path) -> tuple[bool, str]:
-    try:
-        with Image.open(local) as img:
-            gray = img.convert("L")
-            stat = ImageStat.Stat(gray)
-            mean = float(stat.mean[0]) if stat.mean else 0.0
-            std = float(stat.stddev[0]) if stat.stddev else 0.0
-
-        reasons = []
-        if mean < 55:
-            reasons.append("ciemne")
-        if std < 18:
-            reasons.append("niewyrazne")
-
-        try:
-            import pytesseract
-
-            osd = pytesseract.image_to_osd(str(local))
-            m = re.search(r"Rotate:\s*(\d+)", osd)
-            if m:
-                angle = int(m.group(1)) % 360
-                if angle in (90, 180, 270):
-                    reasons.append("krzywe")
-        except Exception:
-            pass
-
-        if reasons:
-            return False, f"Zdjecie wyglada na {'/'.join(reasons)}. Zrob jeszcze raz - jasniej i prosto nad faktura."
-        return True, ""
-    except Exception:
-        return True, ""
-
-
 def _validate_saved_file(local: Path, is_pdf: bool) -> tuple[bool, str]:
     size = _safe_int(local.stat().st_size if local.exists() else 0)
     if size <= 0:
@@ -258,10 +282,15 @@ async def handle_file(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 reply_markup=menu_kb(update),
             )
 
+        unique_id = str(getattr(doc, "file_unique_id", "") or "")
+        dup = find_duplicate_upload(unique_id)
+        if dup:
+            return await _reject_duplicate(update, uid, dup, request_id, file_unique_id=unique_id)
+
         tg = await context.bot.get_file(doc.file_id)
         name = doc.file_name or "faktura"
         local = INV_DIR / f"{datetime.now():%Y%m%d_%H%M%S}_{name}"
-        await tg.download_to_drive(local)
+        file_hash = await _download_hashed(tg, local)
         is_pdf = local.suffix.lower() == ".pdf" or mime == "application/pdf"
     else:
         photo = update.message.photo[-1]
@@ -271,9 +300,21 @@ async def handle_file(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 f"Plik jest za duzy (max {MAX_UPLOAD_BYTES // (1024 * 1024)} MB).",
                 reply_markup=menu_kb(update),
             )
+        unique_id = str(getattr(photo, "file_unique_id", "") or "")
+        dup = find_duplicate_upload(unique_id)
+        if dup:
+            return await _reject_duplicate(update, uid, dup, request_id, file_unique_id=unique_id)
+
         tg = await context.bot.get_file(photo.file_id)
         local = INV_DIR / f"{datetime.now():%Y%m%d_%H%M%S}_photo.jpg"
-        await tg.download_to_drive(local)
+        file_hash = await _download_hashed(tg, local)
+
+    # Known file: reject before validation, quality check, OCR and Drive upload.
+    dup = find_duplicate(file_hash)
+    if dup:
+        register_upload_id(unique_id, row_no=dup.get("row_no"), file_link=dup.get("file_link", ""), user_id=uid)
+        local.unlink(missing_ok=True)
+        return await _reject_duplicate(update, uid, dup, request_id, file_hash=file_hash)
 
     ok, reason = _validate_saved_file(local, is_pdf=is_pdf)
     if not ok:
@@ -281,7 +322,17 @@ async def handle_file(update: Update, context: ContextTypes.DEFAULT_TYPE):
         log_event("invoice_rejected_validation", user_id=uid, request_id=request_id, reason=reason)
         return await update.message.reply_text(reason, reply_markup=menu_kb(update))
 
+    phash = None
     if not is_pdf:
+        # A second photo of the same paper differs byte-wise but not perceptually; flag it before OCR.
+        phash = await perceptual_hash(local)
+        near = find_near_duplicate_image(phash)
+        if near:
+            log_event("invoice_near_duplicate", user_id=uid, duplicate_of=near, request_id=request_id, file_hash=file_hash)
+            await update.message.reply_text(
+                f"📸 To zdjecie wyglada jak faktura z wiersza {near.get('row_no', '?')}. Sprawdz, czy to nie duplikat."
+            )
+
         if is_mama(update):
             try:
                 with local.open("rb") as img_f:
@@ -289,7 +340,13 @@ async def handle_file(update: Update, context: ContextTypes.DEFAULT_TYPE):
             except Exception:
                 pass
 
-        q_ok, q_msg = _check_image_quality(local)
+        try:
+            q_ok, q_msg = await check_image_quality(local, file_hash=file_hash)
+        except OcrBusyError:
+            STATE.pop(uid, None)
+            return await update.message.reply_text(_OCR_BUSY_MSG, reply_markup=menu_kb(update))
+        except Exception:
+            q_ok, q_msg = True, ""
         if not q_ok:
             if is_mama(update):
                 voice_mode = bool(st.get("voice_mode", False))
@@ -301,25 +358,19 @@ async def handle_file(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     t0 = time.perf_counter()
     try:
-        text = ocr_pdf(local) if is_pdf else ocr_image(local)
-        record_metric("ocr_process", ok=True, latency_ms=int((time.perf_counter() - t0) * 1000), source=("pdf" if is_pdf else "image"))
+        text, ocr_path = await ocr_file(local, is_pdf, file_hash=file_hash)
+        record_metric("ocr_process", ok=True, latency_ms=int((time.perf_counter() - t0) * 1000), source=("pdf" if is_pdf else "image"), path=ocr_path)
+    except OcrBusyError:
+        record_metric("ocr_process", ok=False, latency_ms=int((time.perf_counter() - t0) * 1000), source=("pdf" if is_pdf else "image"), busy=True)
+        log_event("ocr_busy", user_id=uid, request_id=request_id)
+        STATE.pop(uid, None)
+        return await update.message.reply_text(_OCR_BUSY_MSG, reply_markup=menu_kb(update))
     except Exception as exc:
         record_metric("ocr_process", ok=False, latency_ms=int((time.perf_counter() - t0) * 1000), source=("pdf" if is_pdf else "image"))
         log_event("ocr_failed", user_id=uid, request_id=request_id, error=str(exc))
         STATE.pop(uid, None)
         return await update.message.reply_text("❌ OCR nie powiodl sie. Sprobuj ponownie.", reply_markup=menu_kb(update))
 
-    file_hash = sha256_file(local)
-    dup = find_duplicate(file_hash)
-    if dup:
-        STATE.pop(uid, None)
-        log_event("invoice_duplicate_rejected", user_id=uid, file_hash=file_hash, duplicate_of=dup, request_id=request_id)
-        row_ref = dup.get("row_no", "?")
-        return await update.message.reply_text(
-            f"🔁 Duplikat pliku. Ta faktura byla juz dodana (wiersz {row_ref}).",
-            reply_markup=menu_kb(update),
-        )
-
     # Senior IT: Variable Scoping - Initialize defaults early
     vat_s = ""
     net_s = ""
@@ -327,17 +378,32 @@ async def handle_file(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     up_m = month_now()
     try:
-        link = upload_to_drive(local, up_m)
+        # Off the event loop; an open Drive breaker fails at once and the local name is kept.
+        link = await retry_async(lambda: asyncio.to_thread(upload_to_drive, local, up_m), "drive_upload", attempts=2)
     except Exception:
         link = local.name
     
-    fields = await extract_fields(text)
+    fields = await extract_fields(text, cache_key=await aocr_cache_key(file_hash, is_pdf), scope=search_scope(update))
     
     # Senior IT: Smart Sanitize & Categorize
     if fields.get("company"):
         fields["company"] = sanitize_company_name(fields["company"])
+        # OCR readings the operators corrected before map straight to the canonical name.
+        fields["company"] = company_index.resolve(fields["company"]) or fields["company"]
     
     content_hash = content_hash_from_fields(fields, inv_type)
+
+    # Same date, amount and seller as a saved invoice: most likely a second scan of it.
+    if not soft_index_seeded():
+        rows = await aget_all_values(update)
+        seed_soft_index(lambda: rows, COL_DATE, COL_GROSS, COL_COMP)
+    soft_dup = await _live_soft_duplicate(update, fields)
+    if soft_dup:
+        log_event("invoice_soft_duplicate", user_id=uid, duplicate_of=soft_dup, request_id=request_id, file_hash=file_hash)
+        await update.message.reply_text(
+            f"⚠️ Podobna faktura (ta sama data, kwota i firma) jest juz w wierszu {soft_dup.get('row_no', '?')}. "
+            "Zapisuje, ale sprawdz, czy to nie duplikat."
+        )
     
     # Senior IT: Premium Features (NBP + WhiteList + Supplier Intel)
     from domain.premium_ocr import extract_currency, extract_nip
@@ -371,7 +437,7 @@ async def handle_file(update: Update, context: ContextTypes.DEFAULT_TYPE):
     gross_f = parse_amount(fields.get("gross", ""))
     
     if fields.get("company") and gross_f > 0:
-        is_anomaly, anomaly_msg = analyze_expense_anomaly(gross_f, fields["company"], get_all_values(update))
+        is_anomaly, anomaly_msg = analyze_expense_anomaly(gross_f, fields["company"], await aget_all_values(update))
         if is_anomaly:
             await update.message.reply_text(f"{anomaly_msg}\nCzy to na pewno poprawna kwota?", parse_mode="Markdown")
 
@@ -410,9 +476,8 @@ async def handle_file(update: Update, context: ContextTypes.DEFAULT_TYPE):
     status = STATUS_OK if not miss else STATUS_TODO
     preview[COL_STATUS - 1] = status
 
-    row_no = next_row(update)
     try:
-        append_row(update, preview)
+        row_no = await aappend_row(update, preview)
     except Exception as exc:
         log_event("invoice_queue_fallback", user_id=uid, request_id=request_id, error=str(exc))
         STATE.pop(uid, None)
@@ -422,7 +487,11 @@ async def handle_file(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
 
     register_file_hash(file_hash, row_no=row_no, file_link=link, user_id=uid)
+    register_upload_id(unique_id, row_no=row_no, file_link=link, user_id=uid)
     register_content_hash(content_hash, row_no=row_no, file_link=link, user_id=uid)
+    register_image_hash(phash, row_no=row_no, file_link=link, user_id=uid)
+    register_soft_duplicate(fields.get("date", ""), fields.get("gross", ""), fields.get("company", ""), row_no=row_no, file_link=link, user_id=uid)
+    company_index.observe(preview[COL_COMP - 1])
 
     log_event(
         "invoice_added",
@@ -437,6 +506,7 @@ async def handle_file(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     # Senior IT: Teach the Brain (RAG)
     try:
+        search_index.attach_text(row_no, text, scope=search_scope(update))
         from domain.rag_bridge import teach_rag_invoice
         teach_rag_invoice(preview_fields_map(preview), text)
     except: pass
@@ -450,7 +520,7 @@ async def handle_file(update: Update, context: ContextTypes.DEFAULT_TYPE):
         ocr_company = (preview[COL_COMP - 1] or "").strip()
         if ocr_company:
             companies.append(ocr_company)
-        companies.extend(_mama_top_companies(update, limit=8))
+        companies.extend(await _mama_top_companies(update, limit=8))
         uniq_companies = []
         for c in companies:
             if c and c not in uniq_companies:
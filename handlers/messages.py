@@ -1,8 +1,6 @@
 ﻿# -*- coding: utf-8 -*-
-import asyncio
 import re
 import time
-from collections import Counter
 from datetime import datetime
 from statistics import median
 
@@ -33,13 +31,14 @@ from config import (
     is_mama,
     is_operator,
 )
+from domain import company_index
 from domain.audit import log_event, count_last_hours
 from domain.audit_trail import log_change
 from domain.invoices import missing_fields
 from domain.reporting import get_monthly_insights
 from domain.state_cache import get_todo_count_cached
 from domain.user_prefs import set_user_pref
-from handlers.callbacks import build_month_zip, today_ym
+from handlers.callbacks import build_month_zip, learn_supplier_layout, today_ym
 from keyboards import (
     kb_mama_amount_confirm,
     kb_mama_ask_ai,
@@ -57,11 +56,12 @@ from keyboards import (
 )
 from domain.smart_logic import fuzzy_match_company
 from domain.utils import parse_amount
-from storage_router import get_all_values, get_row, update_cell
+from storage_router import aget_all_values, aget_columns, aget_row, asearch_invoices, aupdate_cell, aupdate_cells, search_scope
+import ai_service
 
 
-def _rows_for_month(update: Update, month: str):
-    allv = get_all_values(update)
+async def _rows_for_month(update: Update, month: str):
+    allv = await aget_all_values(update)
     rows = allv[1:] if len(allv) > 1 else []
     out = []
     for idx, r in enumerate(rows, start=2):
@@ -91,8 +91,8 @@ def _calc_net_vat_from_type(type_raw: str, gross: float):
     return net, vat
 
 
-def _find_next_missing_amount(update: Update, month: str):
-    for row_no, r in _rows_for_month(update, month):
+async def _find_next_missing_amount(update: Update, month: str):
+    for row_no, r in await _rows_for_month(update, month):
         r = r + [""] * (max(COL_GROSS, COL_STATUS, COL_FILE) - len(r))
         st = (r[COL_STATUS - 1] or "").strip()
         gross = parse_amount(r[COL_GROSS - 1] or "")
@@ -101,24 +101,24 @@ def _find_next_missing_amount(update: Update, month: str):
     return None
 
 
-def _find_next_todo(update: Update, month: str):
-    for row_no, r in _rows_for_month(update, month):
+async def _find_next_todo(update: Update, month: str):
+    for row_no, r in await _rows_for_month(update, month):
         r = r + [""] * (max(COL_GROSS, COL_STATUS, COL_FILE) - len(r))
         if (r[COL_STATUS - 1] or "").strip() == STATUS_TODO:
             return row_no
     return None
 
 
-def _month_from_row(update: Update, row_no: int) -> str:
-    r = get_row(update, row_no)
+async def _month_from_row(update: Update, row_no: int) -> str:
+    r = await aget_row(update, row_no)
     d = (r[COL_DATE - 1] if len(r) >= COL_DATE else "") or ""
     return d[:7] if len(d) >= 7 else ""
 
 
-def _pick_next_row(update: Update, month: str):
-    nxt = _find_next_missing_amount(update, month) if month else None
+async def _pick_next_row(update: Update, month: str):
+    nxt = await _find_next_missing_amount(update, month) if month else None
     if not nxt and month:
-        nxt = _find_next_todo(update, month)
+        nxt = await _find_next_todo(update, month)
     return nxt
 
 _POLISH_MONTH_NAMES = {
@@ -204,11 +204,11 @@ def _reset_mama_amount_failure(uid: int) -> None:
     _set_mama_progress(uid, wrong_amount_streak=0)
 
 
-def _today_mama_ok_count(update: Update, month: str) -> int:
+async def _today_mama_ok_count(update: Update, month: str) -> int:
     today = datetime.now().strftime("%Y-%m-%d")
     cnt = 0
     try:
-        rows = _rows_for_month(update, month)
+        rows = await _rows_for_month(update, month)
     except Exception:
         return 0
     for _, r in rows:
@@ -218,18 +218,28 @@ def _today_mama_ok_count(update: Update, month: str) -> int:
     return cnt
 
 
-def _mama_company_suggestions(update: Update, limit: int = 8) -> list[str]:
-    hist = Counter()
-    allv = get_all_values(update)
-    rows = allv[1:] if len(allv) > 1 else []
-    for r in rows:
-        if len(r) < COL_COMP:
-            continue
-        c = (r[COL_COMP - 1] or "").strip()
-        if len(c) < 2:
-            continue
-        hist[c] += 1
-    popular = [name for name, _ in hist.most_common(max(0, limit - len(MAMA_FAVORITE_SHOPS)))]
+async def _ensure_company_index(update: Update) -> None:
+    if company_index.is_empty():
+        _, cols = await aget_columns(update, [COL_COMP])
+        company_index.seed_names(cols[COL_COMP])
+    company_index.add_names(MAMA_FAVORITE_SHOPS)
+
+
+async def _confirm_company(update: Update, row_no: int, typed: str) -> str:
+    """Snaps typed text to a known company, saves it and learns the replaced OCR reading as an alias."""
+    await _ensure_company_index(update)
+    chosen = fuzzy_match_company(typed) or typed
+    old = ((await _row_with_padding(update, row_no))[COL_COMP - 1] or "").strip()
+    await aupdate_cell(update, row_no, COL_COMP, chosen)
+    if old and old != chosen:
+        company_index.learn_alias(old, chosen)
+    company_index.observe(chosen)
+    return chosen
+
+
+async def _mama_company_suggestions(update: Update, limit: int = 8) -> list[str]:
+    await _ensure_company_index(update)
+    popular = company_index.top(max(0, limit - len(MAMA_FAVORITE_SHOPS)))
     out = []
     for v in list(MAMA_FAVORITE_SHOPS) + popular:
         if v not in out:
@@ -237,9 +247,9 @@ def _mama_company_suggestions(update: Update, limit: int = 8) -> list[str]:
     return out[:limit]
 
 
-def _mama_company_keyboard(update: Update, uid: int):
+async def _mama_company_keyboard(update: Update, uid: int):
     st = dict(STATE.get(uid, {}) or {})
-    return kb_mama_company_suggestions(_mama_company_suggestions(update), large_font=_mama_large_font(st))
+    return kb_mama_company_suggestions(await _mama_company_suggestions(update), large_font=_mama_large_font(st))
 
 
 def _mama_active_mode(mode: str) -> bool:
@@ -256,9 +266,9 @@ def _mama_active_mode(mode: str) -> bool:
     }
 
 
-def _mama_remaining_todo(update: Update, month: str) -> int:
+async def _mama_remaining_todo(update: Update, month: str) -> int:
     cnt = 0
-    for _, r in _rows_for_month(update, month):
+    for _, r in await _rows_for_month(update, month):
         r = r + [""] * (max(COL_GROSS, COL_STATUS) - len(r))
         st = (r[COL_STATUS - 1] or "").strip()
         gross = parse_amount(r[COL_GROSS - 1] or "")
@@ -267,8 +277,8 @@ def _mama_remaining_todo(update: Update, month: str) -> int:
     return cnt
 
 
-def _mama_next_step_hint(update: Update, row_no: int) -> str:
-    r = _row_with_padding(update, row_no)
+async def _mama_next_step_hint(update: Update, row_no: int) -> str:
+    r = await _row_with_padding(update, row_no)
     gross = parse_amount((r[COL_GROSS - 1] if len(r) >= COL_GROSS else "") or "")
     if gross <= 0:
         return "wpisz kwote"
@@ -278,16 +288,16 @@ def _mama_next_step_hint(update: Update, row_no: int) -> str:
     return "potwierdz Kwota OK"
 
 
-def _mama_progress_text(update: Update, month: str, row_no: int) -> str:
-    left = _mama_remaining_todo(update, month)
-    return f"Zostalo: {left}. Teraz: {_mama_next_step_hint(update, row_no)}."
+async def _mama_progress_text(update: Update, month: str, row_no: int) -> str:
+    left = await _mama_remaining_todo(update, month)
+    return f"Zostalo: {left}. Teraz: {await _mama_next_step_hint(update, row_no)}."
 
 
-def _company_amount_history(update: Update, company: str, limit: int = 60) -> list[float]:
+async def _company_amount_history(update: Update, company: str, limit: int = 60) -> list[float]:
     comp_norm = (company or "").strip().lower()
     if not comp_norm:
         return []
-    allv = get_all_values(update)
+    allv = await aget_all_values(update)
     rows = allv[1:] if len(allv) > 1 else []
     vals: list[float] = []
     for r in rows:
@@ -301,8 +311,8 @@ def _company_amount_history(update: Update, company: str, limit: int = 60) -> li
     return vals[-limit:]
 
 
-def _is_suspicious_amount(update: Update, company: str, value: float) -> tuple[bool, float, int]:
-    vals = _company_amount_history(update, company)
+async def _is_suspicious_amount(update: Update, company: str, value: float) -> tuple[bool, float, int]:
+    vals = await _company_amount_history(update, company)
     if len(vals) < 5 or value <= 0:
         return False, 0.0, len(vals)
     med = float(median(vals))
@@ -319,8 +329,8 @@ def _clear_pending_amount_state(uid: int) -> None:
         st.pop(k, None)
     STATE[uid] = st
 
-def _row_with_padding(update: Update, row_no: int):
-    r = get_row(update, row_no)
+async def _row_with_padding(update: Update, row_no: int):
+    r = await aget_row(update, row_no)
     return r + [""] * (max(COL_GROSS, COL_STATUS, COL_NET, COL_VAT, COL_FILE) - len(r))
 
 
@@ -357,9 +367,9 @@ def _human_todo_reason(r: list) -> str:
     return "wymaga sprawdzenia"
 
 
-def _human_todo_rows(update: Update, month: str, limit: int = 5):
+async def _human_todo_rows(update: Update, month: str, limit: int = 5):
     ranked = []
-    for row_no, r in _rows_for_month(update, month):
+    for row_no, r in await _rows_for_month(update, month):
         r = r + [""] * (max(COL_GROSS, COL_STATUS, COL_COMP, COL_DATE) - len(r))
         st = (r[COL_STATUS - 1] or "").strip()
         gross = parse_amount(r[COL_GROSS - 1] or "")
@@ -374,8 +384,31 @@ def _human_todo_rows(update: Update, month: str, limit: int = 5):
     return [(row_no, text) for _, row_no, text in ranked[:limit]]
 
 
-def _find_next_after(update: Update, month: str, after_row: int | None):
-    rows = _rows_for_month(update, month)
+_SEARCH_PAGE_SIZE = 5
+_SEARCH_PAGE_RE = re.compile(r"\s+(?:str\.?|strona)\s*(\d+)\s*$")
+
+
+async def _search_reply(update: Update, query: str) -> str:
+    """Ranked, paginated search; "szukaj orlen strona 2" shows the second page."""
+    page = 1
+    m = _SEARCH_PAGE_RE.search(query)
+    if m:
+        page = max(1, int(m.group(1)))
+        query = query[:m.start()].strip()
+    found, total = await asearch_invoices(update, query, page=page, page_size=_SEARCH_PAGE_SIZE)
+    if not found:
+        return f"Nie znalazlam nic dla: `{query}`."
+    pages = (total + _SEARCH_PAGE_SIZE - 1) // _SEARCH_PAGE_SIZE
+    msg = f"🔍 Znaleziono {total} faktur (strona {page}/{pages}):\n\n"
+    for hit in found:
+        msg += f"• #{hit['row_no']}: {hit['date']} | {hit['company']} | {hit['gross']} zl\n"
+    if page < pages:
+        msg += f"\nWiecej: `szukaj {query} strona {page + 1}`"
+    return msg
+
+
+async def _find_next_after(update: Update, month: str, after_row: int | None):
+    rows = await _rows_for_month(update, month)
     for row_no, r in rows:
         if after_row is not None and row_no <= after_row:
             continue
@@ -387,8 +420,8 @@ def _find_next_after(update: Update, month: str, after_row: int | None):
     return None
 
 
-def _mama_review_text(update: Update, row_no: int) -> str:
-    r = _row_with_padding(update, row_no)
+async def _mama_review_text(update: Update, row_no: int) -> str:
+    r = await _row_with_padding(update, row_no)
     comp = (r[COL_COMP - 1] if len(r) >= COL_COMP else "") or "nieznana firma"
     gross = (r[COL_GROSS - 1] if len(r) >= COL_GROSS else "") or "-"
     reason = _human_todo_reason(r)
@@ -612,25 +645,11 @@ async def _send_mama_soft_alert(ctx: ContextTypes.DEFAULT_TYPE, update: Update,
 def _voice_integration_ready() -> tuple[bool, str]:
     if not env(ENV_OPENAI_API_KEY, ""):
         return False, "Brak OPENAI_API_KEY w konfiguracji. Nie moge rozpoznac glosu."
-    try:
-        import openai  # noqa: F401
-    except Exception:
+    if not ai_service.ai_available():
         return False, "Brak biblioteki openai. Zainstaluj requirements."
     return True, ""
 
 
-def _transcribe_voice_sync(local_path: str) -> str:
-    from openai import OpenAI
-
-    client = OpenAI(api_key=env(ENV_OPENAI_API_KEY, ""))
-    with open(local_path, "rb") as f:
-        out = client.audio.transcriptions.create(model="whisper-1", file=f, language="pl")
-    txt = getattr(out, "text", None)
-    if txt is None and isinstance(out, dict):
-        txt = out.get("text")
-    return (txt or "").strip()
-
-
 async def _transcribe_voice_note(update: Update, ctx: ContextTypes.DEFAULT_TYPE) -> str:
     if not update.message or not update.message.voice:
         return ""
@@ -638,7 +657,7 @@ async def _transcribe_voice_note(update: Update, ctx: ContextTypes.DEFAULT_TYPE)
     local = INV_DIR / f"{datetime.now():%Y%m%d_%H%M%S}_voice.ogg"
     await tg_file.download_to_drive(local)
     try:
-        return await asyncio.to_thread(_transcribe_voice_sync, str(local))
+        return await ai_service.transcribe(local, language="pl")
     finally:
         try:
             local.unlink(missing_ok=True)
@@ -685,9 +704,9 @@ async def _handle_mama_text(update: Update, ctx: ContextTypes.DEFAULT_TYPE, txt_
         return True
 
     if "prognozuj" in txt or "przyszlosc" in txt:
-        from storage_router import get_all_values
+        from storage_router import aget_all_values
         from domain.premium_forecast import predict_next_month_spending
-        rows = get_all_values(update)
+        rows = await aget_all_values(update)
         res = predict_next_month_spending(rows[1:])
         await update.message.reply_text(f"🔮 <b>PRZEWIDYWANIE WYDATKÓW</b>\n\n{res['msg']}", parse_mode="HTML", reply_markup=_mama_kb_for_mode(uid))
         return True
@@ -708,8 +727,8 @@ async def _handle_mama_text(update: Update, ctx: ContextTypes.DEFAULT_TYPE, txt_
     if "symulacja" in txt:
         # Senior IT: Crisis Simulator
         await update.message.reply_chat_action("typing")
-        from storage_router import get_all_values
-        rows = get_all_values(update)
+        from storage_router import aget_all_values
+        rows = await aget_all_values(update)
         
         # Calculate monthly average burn rate
         monthly_burn = 0.0
@@ -756,8 +775,8 @@ async def _handle_mama_text(update: Update, ctx: ContextTypes.DEFAULT_TYPE, txt_
     if "podsumuj" in txt or "raport" in txt or "statystyki" in txt:
         # ... logic for reports ...
         m = today_ym()
-        from storage_router import get_all_values
-        rows = get_all_values(update)
+        from storage_router import aget_all_values
+        rows = await aget_all_values(update)
         st = get_monthly_insights(rows[1:] if len(rows)>1 else [], m)
         
         if not st:
@@ -831,21 +850,7 @@ async def _handle_mama_text(update: Update, ctx: ContextTypes.DEFAULT_TYPE, txt_
             await update.message.reply_text("Co mam znalezc? Wpisz np. `szukaj Orlen`.")
             return True
             
-        from storage_router import get_all_values
-        rows = get_all_values(update)
-        found = []
-        for idx, r in enumerate(rows[1:], 2):
-            line = " ".join(map(str, r)).lower()
-            if query in line:
-                found.append((idx, r))
-        
-        if not found:
-            await update.message.reply_text(f"Nie znalazlam nic dla: `{query}`.")
-        else:
-            msg = f"🔍 Znaleziono {len(found[:5])} faktur:\n\n"
-            for row_no, r in found[:5]:
-                msg += f"• #{row_no}: {r[COL_DATE-1]} | {r[COL_COMP-1]} | {r[COL_GROSS-1]} zl\n"
-            await update.message.reply_text(msg, reply_markup=_mama_kb_for_mode(uid))
+        await update.message.reply_text(await _search_reply(update, query), reply_markup=_mama_kb_for_mode(uid))
         return True
 
     # SOS and Help
@@ -914,7 +919,7 @@ async def _handle_mama_text(update: Update, ctx: ContextTypes.DEFAULT_TYPE, txt_
             row_no = state.get("row")
             _merge_mama_state(uid, mode="mama_review", row=str(row_no))
             await update.message.reply_text("🔙 Wrocilam do podgladu faktury.", reply_markup=_mama_kb_for_mode(uid))
-            await update.message.reply_text(_mama_review_text(update, int(row_no)), reply_markup=_mama_kb_for_mode(uid))
+            await update.message.reply_text(await _mama_review_text(update, int(row_no)), reply_markup=_mama_kb_for_mode(uid))
             return True
         if mode in ("mama_set_company", "mama_pick_company"):
             return await _handle_mama_text(update, ctx, "dodaj fakture")
@@ -940,19 +945,25 @@ async def _handle_mama_text(update: Update, ctx: ContextTypes.DEFAULT_TYPE, txt_
             await update.message.reply_text("⚠️ Nie moge cofnac tej akcji.", reply_markup=_mama_kb_for_mode(uid))
             return True
 
-        update_cell(update, row_no, COL_GROSS, undo.get("gross", ""))
-        update_cell(update, row_no, COL_NET, undo.get("net", ""))
-        update_cell(update, row_no, COL_VAT, undo.get("vat", ""))
-        update_cell(update, row_no, COL_STATUS, undo.get("status", ""))
+        await aupdate_cells(
+            update,
+            row_no,
+            {
+                COL_GROSS: undo.get("gross", ""),
+                COL_NET: undo.get("net", ""),
+                COL_VAT: undo.get("vat", ""),
+                COL_STATUS: undo.get("status", ""),
+            },
+        )
 
-        month = (undo.get("month") or _month_from_row(update, row_no) or today_ym()).strip()
+        month = (undo.get("month") or await _month_from_row(update, row_no) or today_ym()).strip()
         _merge_mama_state(uid, mode="mama_review", row=str(row_no), month=month, next_row="", last_step=f"undo:{row_no}")
         MAMA_UNDO.pop(uid, None)
         await update.message.reply_text(
             f"Cofnelam ostatnia akcje. Wrocilam do faktury #{row_no}.",
             reply_markup=_mama_review_tiles_for(uid),
         )
-        await update.message.reply_text(_mama_review_text(update, row_no), reply_markup=_mama_review_tiles_for(uid))
+        await update.message.reply_text(await _mama_review_text(update, row_no), reply_markup=_mama_review_tiles_for(uid))
         return True
 
     # Main flows
@@ -973,14 +984,14 @@ async def _handle_mama_text(update: Update, ctx: ContextTypes.DEFAULT_TYPE, txt_
 
     if "poprawic" in txt or "todo" in txt:
         m = today_ym()
-        items = _human_todo_rows(update, m, limit=7)
+        items = await _human_todo_rows(update, m, limit=7)
         
         if not items:
             # Senior IT: If nothing simple to fix, run deep integrity check
             from domain.integrity import check_business_integrity
-            from storage_router import get_all_values
+            from storage_router import aget_all_values
             
-            rows = get_all_values(update)
+            rows = await aget_all_values(update)
             warnings = check_business_integrity(rows)
             
             if warnings:
@@ -1028,7 +1039,7 @@ async def _handle_mama_text(update: Update, ctx: ContextTypes.DEFAULT_TYPE, txt_
                 if target_row:
                     _merge_mama_state(uid, mode="mama_review", row=str(target_row), month=today_ym())
                     await update.message.reply_text(f"🔍 Otwieram zadanie #{idx}...", reply_markup=_mama_kb_for_mode(uid))
-                    await update.message.reply_text(_mama_review_text(update, int(target_row)), reply_markup=_mama_kb_for_mode(uid))
+                    await update.message.reply_text(await _mama_review_text(update, int(target_row)), reply_markup=_mama_kb_for_mode(uid))
                     return True
             except:
                 pass
@@ -1037,17 +1048,17 @@ async def _handle_mama_text(update: Update, ctx: ContextTypes.DEFAULT_TYPE, txt_
              # Auto-jump to the first one and set next logic
              # Re-fetch to be sure
              m = today_ym()
-             items = _human_todo_rows(update, m, limit=1)
+             items = await _human_todo_rows(update, m, limit=1)
              if items:
                  row_no = items[0][0]
                  _merge_mama_state(uid, mode="mama_review", row=str(row_no), month=m, next_row="auto") # 'auto' will need logic in 'next' handler
                  await update.message.reply_text("🚀 Lecimy ze wszystkim po kolei!", reply_markup=_mama_kb_for_mode(uid))
-                 await update.message.reply_text(_mama_review_text(update, int(row_no)), reply_markup=_mama_kb_for_mode(uid))
+                 await update.message.reply_text(await _mama_review_text(update, int(row_no)), reply_markup=_mama_kb_for_mode(uid))
                  return True
 
     if "wyslij" in txt and ("ksiegowej" in txt or "export" in txt):
         m = today_ym()
-        zip_bytes, filename = build_month_zip(update, m)
+        zip_bytes, filename = await build_month_zip(update, m)
         await update.message.reply_document(document=zip_bytes, filename=filename, caption=f"Paczka {m}")
         _merge_mama_state(uid, mode="mama_after_send", month=m, last_step=f"export:{m}")
         await update.message.reply_text("📦 Wyslane do ksiegowej.", reply_markup=kb_mama_next_only(_mama_large_font(state)))
@@ -1076,14 +1087,8 @@ async def _handle_mama_text(update: Update, ctx: ContextTypes.DEFAULT_TYPE, txt_
                 await update.message.reply_text("Wpisz nazwe firmy.", reply_markup=_mama_tiles_for(uid))
                 return True
             
-            # Fuzzy match company from suggestions
-            chosen = txt_raw.strip()
-            suggestions = _mama_company_suggestions(update, limit=20)
-            best_match = fuzzy_match_company(chosen, suggestions)
-            if best_match:
-                chosen = best_match
-
-            update_cell(update, row_no, COL_COMP, chosen)
+            # Fuzzy match company against the company index
+            chosen = await _confirm_company(update, row_no, txt_raw.strip())
             _merge_mama_state(uid, mode="mama_wait_amount", row=str(row_no), month=state.get("month", today_ym()), last_step="company:set")
             await update.message.reply_text(f"🏪 Firma zapisana: {chosen}", reply_markup=_mama_review_tiles_for(uid))
             return True
@@ -1094,13 +1099,7 @@ async def _handle_mama_text(update: Update, ctx: ContextTypes.DEFAULT_TYPE, txt_
             row_no = int(row_s)
             
             # Fuzzy match
-            chosen = txt_raw.strip()
-            suggestions = _mama_company_suggestions(update, limit=50)
-            best_match = fuzzy_match_company(chosen, suggestions)
-            if best_match:
-                chosen = best_match
-                
-            update_cell(update, row_no, COL_COMP, chosen)
+            chosen = await _confirm_company(update, row_no, txt_raw.strip())
             _merge_mama_state(uid, mode="mama_wait_amount", row=str(row_no), month=state.get("month", today_ym()), last_step="company:manual_set")
             await update.message.reply_text(f"🏪 Firma zapisana: {chosen}", reply_markup=_mama_review_tiles_for(uid))
             return True
@@ -1139,9 +1138,9 @@ async def _handle_mama_text(update: Update, ctx: ContextTypes.DEFAULT_TYPE, txt_
             nxt = int(nxt_s)
         else:
             cur = int(state.get("row")) if str(state.get("row", "")).isdigit() else None
-            nxt = _find_next_after(update, month, after_row=cur)
+            nxt = await _find_next_after(update, month, after_row=cur)
             if not nxt and cur is not None:
-                nxt = _find_next_after(update, month, after_row=None)
+                nxt = await _find_next_after(update, month, after_row=None)
                 if nxt == cur:
                     nxt = None
 
@@ -1151,7 +1150,7 @@ async def _handle_mama_text(update: Update, ctx: ContextTypes.DEFAULT_TYPE, txt_
             return True
 
         _merge_mama_state(uid, mode="mama_review", row=str(nxt), month=month, next_row="", last_step=f"next:{nxt}")
-        await update.message.reply_text(_mama_review_text(update, nxt), reply_markup=_mama_review_tiles_for(uid))
+        await update.message.reply_text(await _mama_review_text(update, nxt), reply_markup=_mama_review_tiles_for(uid))
         return True
 
     if txt in ("nagraj kwote",) and mode == "mama_ultra_amount":
@@ -1169,7 +1168,7 @@ async def _handle_mama_text(update: Update, ctx: ContextTypes.DEFAULT_TYPE, txt_
         row_s = state.get("row", "")
         if str(row_s).isdigit():
             row_no = int(row_s)
-            month = state.get("month") or _month_from_row(update, row_no) or today_ym()
+            month = state.get("month") or await _month_from_row(update, row_no) or today_ym()
             _merge_mama_state(uid, mode="mama_set_price", row=str(row_no), month=month, last_step=f"price:ask:{row_no}")
             await update.message.reply_text("💰 Wpisz tylko kwote, np. 123,45.", reply_markup=_mama_review_tiles_for(uid))
             return True
@@ -1178,26 +1177,28 @@ async def _handle_mama_text(update: Update, ctx: ContextTypes.DEFAULT_TYPE, txt_
         row_s = state.get("row", "")
         if row_s.isdigit():
             row_no = int(row_s)
-            month = (state.get("month") or _month_from_row(update, row_no) or today_ym()).strip()
-            r_before = _row_with_padding(update, row_no)
+            month = (state.get("month") or await _month_from_row(update, row_no) or today_ym()).strip()
+            r_before = await _row_with_padding(update, row_no)
             _remember_mama_undo(uid, row_no, r_before, month, "mama_ok")
 
             old_status = (r_before[COL_STATUS - 1] if len(r_before) >= COL_STATUS else "") or ""
             miss = missing_fields(r_before)
             new_status = STATUS_TODO if miss else STATUS_OK
-            update_cell(update, row_no, COL_STATUS, new_status)
+            await aupdate_cell(update, row_no, COL_STATUS, new_status)
             log_event("status_change", user_id=uid, row_no=row_no, old_status=old_status, new_status=new_status, source="messages:mama:ok")
+            if not miss:
+                learn_supplier_layout(update, row_no, r_before)
 
             if miss:
                 _merge_mama_state(uid, mode="mama_review", row=str(row_no), month=month, last_step=f"ok:missing:{row_no}")
                 await update.message.reply_text("⚠️ Brakuje danych. Kliknij Popraw kwote.", reply_markup=_mama_review_tiles_for(uid))
                 return True
 
-            done_today = _today_mama_ok_count(update, month)
+            done_today = await _today_mama_ok_count(update, month)
             if done_today and done_today % 3 == 0:
                 await update.message.reply_text(f"🌟 Super, {done_today}/3 gotowe dzisiaj.", reply_markup=_mama_review_tiles_for(uid))
 
-            nxt = _find_next_after(update, month, after_row=row_no)
+            nxt = await _find_next_after(update, month, after_row=row_no)
             if nxt:
                 _merge_mama_state(uid, mode="mama_review", row=str(row_no), month=month, next_row=str(nxt), last_step=f"ok:{row_no}")
                 await update.message.reply_text("✅ Zapisane.", reply_markup=kb_mama_next_only(_mama_large_font(state)))
@@ -1211,7 +1212,7 @@ async def _handle_mama_text(update: Update, ctx: ContextTypes.DEFAULT_TYPE, txt_
         row_s = state.get("row", "")
         if str(row_s).isdigit():
             row_no = int(row_s)
-            month = state.get("month") or _month_from_row(update, row_no) or today_ym()
+            month = state.get("month") or await _month_from_row(update, row_no) or today_ym()
             _merge_mama_state(uid, mode="mama_set_price", row=str(row_no), month=month, last_step=f"price:ask:{row_no}")
             await update.message.reply_text("💰 Wpisz tylko kwote, np. 123,45.", reply_markup=_mama_review_tiles_for(uid))
             return True
@@ -1237,11 +1238,11 @@ async def _handle_mama_text(update: Update, ctx: ContextTypes.DEFAULT_TYPE, txt_
             return True
 
         _reset_mama_amount_failure(uid)
-        month = (state.get("month") or _month_from_row(update, row_no) or today_ym()).strip()
-        row_before = _row_with_padding(update, row_no)
+        month = (state.get("month") or await _month_from_row(update, row_no) or today_ym()).strip()
+        row_before = await _row_with_padding(update, row_no)
         company = (row_before[COL_COMP - 1] if len(row_before) >= COL_COMP else "") or ""
 
-        suspicious, med, hist_n = _is_suspicious_amount(update, company, val)
+        suspicious, med, hist_n = await _is_suspicious_amount(update, company, val)
         if suspicious and not bool(state.get("amount_confirmed", False)):
             _merge_mama_state(
                 uid,
@@ -1265,26 +1266,30 @@ async def _handle_mama_text(update: Update, ctx: ContextTypes.DEFAULT_TYPE, txt_
         # Senior IT: Logging change to Audit Trail
         log_change(uid, row_no, "gross", str(row_before[COL_GROSS-1]), f"{val:.2f}")
         
-        update_cell(update, row_no, COL_GROSS, f"{val:.2f}")
-        row_after = _row_with_padding(update, row_no)
-        type_v = (row_after[COL_TYPE - 1] if len(row_after) >= COL_TYPE else "") or ""
+        type_v = (row_before[COL_TYPE - 1] if len(row_before) >= COL_TYPE else "") or ""
         net, vat = _calc_net_vat_from_type(type_v, val)
-        update_cell(update, row_no, COL_NET, f"{net:.2f}")
-        update_cell(update, row_no, COL_VAT, f"{vat:.2f}")
+        row_after = list(row_before)
+        row_after[COL_GROSS - 1] = f"{val:.2f}"
+        row_after[COL_NET - 1] = f"{net:.2f}"
+        row_after[COL_VAT - 1] = f"{vat:.2f}"
 
-        row_after = _row_with_padding(update, row_no)
-        old_status = (row_after[COL_STATUS - 1] if len(row_after) >= COL_STATUS else "") or ""
+        old_status = (row_before[COL_STATUS - 1] if len(row_before) >= COL_STATUS else "") or ""
         miss = missing_fields(row_after)
         new_status = STATUS_TODO if miss else STATUS_OK
-        update_cell(update, row_no, COL_STATUS, new_status)
+        await aupdate_cells(
+            update,
+            row_no,
+            {COL_GROSS: row_after[COL_GROSS - 1], COL_NET: row_after[COL_NET - 1], COL_VAT: row_after[COL_VAT - 1], COL_STATUS: new_status},
+        )
         log_event("status_change", user_id=uid, row_no=row_no, old_status=old_status, new_status=new_status, source="messages:mama:set_price")
 
         if new_status == STATUS_OK:
-            done_today = _today_mama_ok_count(update, month)
+            learn_supplier_layout(update, row_no, row_after)
+            done_today = await _today_mama_ok_count(update, month)
             if done_today and done_today % 3 == 0:
                 await update.message.reply_text(f"🌟 Super, {done_today}/3 gotowe dzisiaj.", reply_markup=_mama_review_tiles_for(uid))
 
-        nxt = _find_next_after(update, month, after_row=row_no)
+        nxt = await _find_next_after(update, month, after_row=row_no)
         if nxt:
             _merge_mama_state(uid, mode="mama_review", row=str(row_no), month=month, next_row=str(nxt), last_step=f"price:set:{row_no}")
             await update.message.reply_text("✅ Zapisane.", reply_markup=kb_mama_next_only(_mama_large_font(state)))
@@ -1401,23 +1406,30 @@ async def on_text(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
                 return await update.message.reply_text("Podaj poprawna kwote, np. 123,45", reply_markup=kb_page(1))
             value = f"{val:.2f}"
 
-        update_cell(update, row_no, col, value)
+        r = await _row_with_padding(update, row_no)
+        old_status = (r[COL_STATUS - 1] if len(r) >= COL_STATUS else "") or ""
+        old_value = (r[col - 1] or "").strip()
+        cells = {col: value}
+        r[col - 1] = value
 
         if field == "gross":
-            r = get_row(update, row_no)
-            gross = parse_amount((r[COL_GROSS - 1] if len(r) >= COL_GROSS else "") or "")
+            gross = parse_amount(value)
             inv_type = (r[COL_TYPE - 1] if len(r) >= COL_TYPE else "") or ""
             net, vat = _calc_net_vat_from_type(inv_type, gross)
-            update_cell(update, row_no, COL_NET, f"{net:.2f}")
-            update_cell(update, row_no, COL_VAT, f"{vat:.2f}")
+            cells[COL_NET] = r[COL_NET - 1] = f"{net:.2f}"
+            cells[COL_VAT] = r[COL_VAT - 1] = f"{vat:.2f}"
 
-        r = get_row(update, row_no)
-        old_status = (r[COL_STATUS - 1] if len(r) >= COL_STATUS else "") or ""
         miss = missing_fields(r)
         new_status = STATUS_OK if not miss else STATUS_TODO
-        update_cell(update, row_no, COL_STATUS, new_status)
+        cells[COL_STATUS] = new_status
+        await aupdate_cells(update, row_no, cells)
         log_event("status_change", user_id=uid, row_no=row_no, old_status=old_status, new_status=new_status, source=f"messages:edit_field:{field}")
-        log_event("ocr_fix", user_id=uid, row_no=row_no, field=field, value=value)
+        log_event("ocr_fix", user_id=uid, row_no=row_no, field=field, value=value, old=old_value)
+        if new_status == STATUS_OK:
+            learn_supplier_layout(update, row_no, r)
+        if field == "comp" and old_value:
+            # Operator corrections teach the company index which OCR readings mean which supplier.
+            company_index.learn_alias(old_value, value)
 
         STATE.pop(uid, None)
         return await update.message.reply_text(f"Poprawiono pole `{field}` w wierszu {row_no}.", reply_markup=kb_page(1))
@@ -1428,21 +1440,7 @@ async def on_text(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
             await update.message.reply_text("Co mam znalezc? Wpisz np. `szukaj Orlen`.")
             return True
             
-        from storage_router import get_all_values
-        rows = get_all_values(update)
-        found = []
-        for idx, r in enumerate(rows[1:], 2):
-            line = " ".join(map(str, r)).lower()
-            if query in line:
-                found.append((idx, r))
-        
-        if not found:
-            await update.message.reply_text(f"Nie znalazlam nic dla: `{query}`.")
-        else:
-            msg = f"🔍 Znaleziono {len(found[:5])} faktur:\n\n"
-            for row_no, r in found[:5]:
-                msg += f"• #{row_no}: {r[COL_DATE-1]} | {r[COL_COMP-1]} | {r[COL_GROSS-1]} zl\n"
-            await update.message.reply_text(msg, reply_markup=_mama_kb_for_mode(uid))
+        await update.message.reply_text(await _search_reply(update, query), reply_markup=_mama_kb_for_mode(uid))
         return True
 
     # Senior IT: RAG Q&A (Question Answering)
@@ -1461,11 +1459,11 @@ async def on_text(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
         is_analytical = any(word in question.lower() for word in ["planuje", "kupic", "warto", "ile", "czesto", "srednio", "trendy", "rekomendacja", "opinie"])
         
         if is_analytical:
-             answer = await analyze_spending_trend(question)
+             answer = await analyze_spending_trend(question, scope=search_scope(update))
              header = "📈 <b>Analiza Biznesowa AI:</b>"
         else:
              # Senior IT: Open-ended query
-             answer = await get_rag_context(question)
+             answer = await get_rag_context(question, scope=search_scope(update))
              header = "🧠 <b>AI Asystent:</b>"
         
         if not answer:
@@ -1488,11 +1486,10 @@ async def on_text(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
             return await update.message.reply_text(" Anulowano ustawianie VAT.", reply_markup=kb_page(1))
 
         vat_type_raw = txt_raw.strip()
-        update_cell(update, row_no, COL_TYPE, vat_type_raw)
-
-        r = get_row(update, row_no)
+        r = await aget_row(update, row_no)
         gross = parse_amount((r[COL_GROSS - 1] if len(r) >= COL_GROSS else "") or "")
         if gross <= 0:
+            await aupdate_cell(update, row_no, COL_TYPE, vat_type_raw)
             STATE.pop(uid, None)
             return await update.message.reply_text(
                 "Nie moge przeliczyc: brak kwoty brutto.\nNajpierw wpisz brutto, potem ustaw VAT.",
@@ -1500,8 +1497,7 @@ async def on_text(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
             )
 
         net, vat = _calc_net_vat_from_type(vat_type_raw, gross)
-        update_cell(update, row_no, COL_NET, f"{net:.2f}")
-        update_cell(update, row_no, COL_VAT, f"{vat:.2f}")
+        await aupdate_cells(update, row_no, {COL_TYPE: vat_type_raw, COL_NET: f"{net:.2f}", COL_VAT: f"{vat:.2f}"})
 
         STATE.pop(uid, None)
         return await update.message.reply_text(
@@ -1519,7 +1515,7 @@ async def on_text(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
 
         row_no = int(row_s)
         if not month:
-            month = _month_from_row(update, row_no)
+            month = await _month_from_row(update, row_no)
 
         if txt in ("stop", "/stop", "cancel", "anuluj", "koniec"):
             STATE.pop(uid, None)
@@ -1529,20 +1525,19 @@ async def on_text(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
         if val <= 0:
             return await update.message.reply_text("Podaj poprawna kwote, np. 123,45 (albo `stop`)", reply_markup=kb_page(1))
 
-        update_cell(update, row_no, COL_GROSS, f"{val:.2f}")
-
-        r = get_row(update, row_no)
+        r = await _row_with_padding(update, row_no)
+        old_status = (r[COL_STATUS - 1] if len(r) >= COL_STATUS else "") or ""
         type_v = (r[COL_TYPE - 1] if len(r) >= COL_TYPE else "") or ""
         net, vat = _calc_net_vat_from_type(type_v, val)
-        update_cell(update, row_no, COL_NET, f"{net:.2f}")
-        update_cell(update, row_no, COL_VAT, f"{vat:.2f}")
-
-        r = get_row(update, row_no)
-        old_status = (r[COL_STATUS - 1] if len(r) >= COL_STATUS else "") or ""
+        r[COL_GROSS - 1] = f"{val:.2f}"
+        r[COL_NET - 1] = f"{net:.2f}"
+        r[COL_VAT - 1] = f"{vat:.2f}"
         miss = missing_fields(r)
+        cells = {COL_GROSS: r[COL_GROSS - 1], COL_NET: r[COL_NET - 1], COL_VAT: r[COL_VAT - 1]}
 
         if miss:
-            update_cell(update, row_no, COL_STATUS, STATUS_TODO)
+            cells[COL_STATUS] = STATUS_TODO
+            await aupdate_cells(update, row_no, cells)
             log_event("status_change", user_id=uid, row_no=row_no, old_status=old_status, new_status=STATUS_TODO, source="messages:set_price:missing")
             STATE.pop(uid, None)
             return await update.message.reply_text(
@@ -1550,8 +1545,10 @@ async def on_text(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
                 reply_markup=kb_page(1),
             )
 
-        update_cell(update, row_no, COL_STATUS, STATUS_OK)
+        cells[COL_STATUS] = STATUS_OK
+        await aupdate_cells(update, row_no, cells)
         log_event("status_change", user_id=uid, row_no=row_no, old_status=old_status, new_status=STATUS_OK, source="messages:set_price:ok")
+        learn_supplier_layout(update, row_no, r)
 
         STATE.pop(uid, None)
         return await update.message.reply_text(
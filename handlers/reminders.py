@@ -1,4 +1,5 @@
 ﻿# -*- coding: utf-8 -*-
+import asyncio
 import logging
 import time as _time
 from datetime import time
@@ -10,7 +11,9 @@ from config import (
     MAMA_STUCK_ALERT_MIN,
     REMINDER_HOUR,
     REMINDER_MINUTE,
+    SQLITE_SYNC_SEC,
     STATE,
+    STORAGE_BACKEND,
     WEEKLY_REPORT_HOUR,
     WEEKLY_REPORT_MINUTE,
     WEEKLY_REPORT_WEEKDAY,
@@ -22,7 +25,7 @@ from domain.backup import restore_test_latest_backup
 from domain.retention import apply_retention
 from handlers.callbacks import compute_month_stats, today_ym
 from keyboards import kb_mama_daily_one_button
-from storage_router import get_all_values, process_retry_backlog
+from storage_router import aget_all_values, aprocess_retry_backlog, sync_local_mirror
 
 log = logging.getLogger("danex.reminders")
 
@@ -49,8 +52,8 @@ async def _send_todo_reminder(ctx):
     for uid in sorted(admin_ids()):
         upd = _fake_update(uid)
         try:
-            get_all_values(upd)
-            st = compute_month_stats(upd, month)
+            await aget_all_values(upd)
+            st = await compute_month_stats(upd, month)
             mama = mama_activity_last_24h(mama_ids())
             txt = (
                 f"📊 MAMA SKROT {month}\n"
@@ -137,7 +140,7 @@ async def _monitor_mama_soft_alerts(ctx):
 
 
 async def _maintenance_job(ctx):
-    res_retry = process_retry_backlog(limit=100)
+    res_retry = await aprocess_retry_backlog(limit=100)
     res_ret = apply_retention()
     res_restore = restore_test_latest_backup()
     mama = mama_activity_last_24h(mama_ids())
@@ -157,6 +160,17 @@ async def _maintenance_job(ctx):
             continue
 
 
+async def _sqlite_sync_job(ctx):
+    try:
+        res = await asyncio.to_thread(sync_local_mirror)
+    except Exception as exc:
+        # Unpushed rows stay marked in the mirror; the next round retries them.
+        log.warning("SQLite mirror sync failed: %s", exc)
+        return
+    if res.get("pulled") or res.get("pushed"):
+        log.info("SQLite mirror sync: pulled=%s pushed=%s pending=%s", res["pulled"], res["pushed"], res["pending"])
+
+
 async def _month_end_guard(ctx):
     """Senior IT: Proactively alert about pending invoices at month end."""
     from datetime import datetime
@@ -167,8 +181,8 @@ async def _month_end_guard(ctx):
     for uid in sorted(mama_ids()):
         upd = _fake_update(uid)
         try:
-            get_all_values(upd)
-            st = compute_month_stats(upd, month)
+            await aget_all_values(upd)
+            st = await compute_month_stats(upd, month)
             pending = len(st['todo']) + len(st['todo_missing_price'])
             if pending > 0:
                 msg = (
@@ -198,6 +212,14 @@ def register_reminders(app: Application) -> None:
         name="mama_daily_one_button",
     )
 
+    if STORAGE_BACKEND == "sqlite":
+        app.job_queue.run_repeating(
+            _sqlite_sync_job,
+            interval=SQLITE_SYNC_SEC,
+            first=5,
+            name="sqlite_sync",
+        )
+
     app.job_queue.run_repeating(
         _monitor_mama_soft_alerts,
         interval=5 * 60,
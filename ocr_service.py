@@ -1,155 +1,582 @@
 # -*- coding: utf-8 -*-
+import asyncio
+import hashlib
 import re
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+from concurrent.futures.process import BrokenProcessPool
 from pathlib import Path
 import fitz
 import pytesseract
-from PIL import Image
+from PIL import Image, ImageStat
 
-from config import env, ENV_TESS
+from config import env, ENV_TESS, OCR_QUEUE_LIMIT, OCR_WORKERS
+
+from domain import ocr_cache, text_scan
+from domain.audit import log_event
+from domain.metrics import record_metric
+from domain.supplier_intel import apply_template, supplier_nip
+from domain.utils import normalize_text
+
+_POOL: ProcessPoolExecutor | None = None
+_POOL_LOCK = threading.Lock()
+_INFLIGHT = 0
+_INFLIGHT_LOCK = threading.Lock()
+
+_DATE_RE = re.compile(r"(\d{4})([-./])(\d{2})\2(\d{2})|(\d{2})([-./])(\d{2})\6(\d{4})")
+_PREFERRED_LANGS = ("pol", "eng")
+_PDF_MAX_PAGES = 3
+_ENGINE = None
+_ENGINE_LOCK = threading.Lock()
+_LANG: str | None = None
+_LANG_LOCK = threading.Lock()
+
+
+class OcrBusyError(RuntimeError):
+    """Raised when more OCR jobs are waiting than OCR_QUEUE_LIMIT allows."""
 
-from domain.utils import parse_amount, normalize_text
 
 def setup_tesseract():
     t = env(ENV_TESS, "")
     if t:
         pytesseract.pytesseract.tesseract_cmd = t
 
-def ocr_image(path: Path) -> str:
+
+def _has_tesserocr() -> bool:
     try:
-        return pytesseract.image_to_string(Image.open(path), lang="pol")
+        import tesserocr  # noqa: F401
+        return True
     except Exception:
-        return pytesseract.image_to_string(Image.open(path))
+        return False
 
-def ocr_pdf(path: Path) -> str:
-    doc = fitz.open(path)
-    out = []
-    # OCR max 3 pages for invoices
-    for i in range(min(3, len(doc))):
-        pix = doc.load_page(i).get_pixmap(dpi=250) # Higher DPI for better OCR
-        img = path.with_suffix(f".p{i}.png")
-        pix.save(img)
-        out.append(ocr_image(img))
+
+def _installed_langs() -> set[str]:
+    if _has_tesserocr():
+        import tesserocr
+
+        return set(tesserocr.get_languages()[1])
+    setup_tesseract()
+    return set(pytesseract.get_languages(config=""))
+
+
+def ocr_lang() -> str:
+    """"pol" when installed, else the best available fallback.
+
+    The probe can start tesseract, so it blocks: coroutines go through ``aocr_lang``.
+    Only a successful probe is remembered; after a failure the next call tries again.
+    """
+    global _LANG
+    with _LANG_LOCK:
+        if _LANG is not None:
+            return _LANG
         try:
-            img.unlink(missing_ok=True)
-        except Exception:
-            pass
-    doc.close()
-    return "\n\n".join(out)
+            available = _installed_langs()
+        except Exception as exc:
+            log_event("ocr_lang_probe_failed", error=str(exc))
+            return ""
+        _LANG = next((lang for lang in _PREFERRED_LANGS if lang in available), "")
+        return _LANG
 
-def normalize_date(s: str) -> str:
-    s = (s or "").strip()
-    patterns = ("%Y-%m-%d", "%Y/%m/%d", "%Y.%m.%d", "%d.%m.%Y", "%d-%m-%Y", "%d/%m/%Y")
-    for f in patterns:
+
+async def aocr_lang() -> str:
+    return _LANG if _LANG is not None else await asyncio.to_thread(ocr_lang)
+
+
+def warm_ocr_lang() -> None:
+    """Resolves the language in a background thread at startup, off the event loop."""
+    threading.Thread(target=ocr_lang, name="ocr-lang-probe", daemon=True).start()
+
+
+class _TesserocrEngine:
+    """Warm in-process tesseract: traineddata is loaded once and stays resident in the worker."""
+
+    name = "tesserocr"
+    _DEGREES = {0: 0, 1: 90, 2: 180, 3: 270}
+
+    def __init__(self, lang: str) -> None:
+        import tesserocr
+
+        kwargs = {"lang": lang} if lang else {}
+        self._api = tesserocr.PyTessBaseAPI(psm=tesserocr.PSM.AUTO_OSD, **kwargs)
+        self._lock = threading.Lock()
+
+    def recognize(self, img: Image.Image) -> str:
+        with self._lock:
+            self._api.SetImage(img)
+            return self._api.GetUTF8Text()
+
+    def recognize_with_osd(self, img: Image.Image) -> tuple[str, int | None]:
+        # One layout analysis serves both orientation and recognition.
+        with self._lock:
+            self._api.SetImage(img)
+            angle = None
+            try:
+                it = self._api.AnalyseLayout()
+                if it is not None:
+                    angle = self._DEGREES.get(int(it.Orientation()[0]))
+            except Exception:
+                angle = None
+            return self._api.GetUTF8Text(), angle
+
+
+class _PytesseractEngine:
+    """Fallback when tesserocr is not installed: one tesseract process per call, language fixed up front."""
+
+    name = "pytesseract"
+
+    def __init__(self, lang: str) -> None:
+        self._lang = lang or None
+
+    def recognize(self, img: Image.Image) -> str:
+        return pytesseract.image_to_string(img, lang=self._lang)
+
+    def recognize_with_osd(self, img: Image.Image) -> tuple[str, int | None]:
+        angle = None
         try:
-            from datetime import datetime
-            return datetime.strptime(s, f).strftime("%Y-%m-%d")
+            m = re.search(r"Rotate:\s*(\d+)", pytesseract.image_to_osd(img))
+            if m:
+                angle = int(m.group(1)) % 360
         except Exception:
-            pass
-    return ""
+            angle = None
+        return self.recognize(img), angle
+
+
+def _engine():
+    global _ENGINE
+    with _ENGINE_LOCK:
+        if _ENGINE is None:
+            setup_tesseract()
+            lang = ocr_lang()
+            try:
+                _ENGINE = _TesserocrEngine(lang) if _has_tesserocr() else _PytesseractEngine(lang)
+            except Exception as exc:
+                log_event("ocr_engine_fallback", error=str(exc))
+                _ENGINE = _PytesseractEngine(lang)
+        return _ENGINE
+
+
+def _init_worker() -> None:
+    # Pay engine start-up (and traineddata load) once per worker, not once per page.
+    _engine()
+
+
+def _ocr_pil(img: Image.Image) -> str:
+    return _engine().recognize(img)
+
+
+def _ocr_image(path: Path) -> str:
+    with Image.open(path) as img:
+        return _ocr_pil(img)
+
+# A page counts as digital when its text layer has enough real characters.
+_MIN_TEXT_CHARS = 40
+_MIN_TEXT_RATIO = 0.6
+
+
+def _page_text(page) -> str:
+    """Rebuilds visual lines from fitz words, so labels and amounts in one table row stay together."""
+    words = page.get_text("words")
+    if not words:
+        return ""
+    words.sort(key=lambda w: ((w[1] + w[3]) / 2, w[0]))
+    lines: list[list] = []
+    for w in words:
+        mid = (w[1] + w[3]) / 2
+        if lines:
+            last = lines[-1]
+            ref = last[0]
+            if abs(mid - (ref[1] + ref[3]) / 2) <= max(2.0, (ref[3] - ref[1]) * 0.5):
+                last.append(w)
+                continue
+        lines.append([w])
+    return "\n".join(" ".join(w[4] for w in sorted(line, key=lambda w: w[0])) for line in lines)
+
+
+def _usable_text(text: str) -> bool:
+    chars = [c for c in text if not c.isspace()]
+    good = sum(1 for c in chars if c.isalnum())
+    return good >= _MIN_TEXT_CHARS and good >= _MIN_TEXT_RATIO * len(chars)
+
+
+# Rasterised pages aim for ~3000 px on the long side (about 250 DPI on A4), so
+# small receipts get more detail and oversized scans do not explode in memory.
+_TARGET_LONG_PX = 3000
+_MIN_DPI = 150
+_MAX_DPI = 300
+
+
+def _render_dpi(page) -> int:
+    long_pt = max(page.rect.width, page.rect.height) or 842.0
+    return max(_MIN_DPI, min(_MAX_DPI, int(_TARGET_LONG_PX * 72 / long_pt)))
+
+
+def _render_page(page) -> Image.Image:
+    """Renders straight into a grayscale PIL image - no PNG encode/decode, nothing on disk."""
+    pix = page.get_pixmap(dpi=_render_dpi(page), colorspace=fitz.csGRAY, alpha=False)
+    return Image.frombytes("L", (pix.width, pix.height), pix.samples)
+
+
+def _pdf_page(page) -> tuple[str, str]:
+    text = _page_text(page)
+    if _usable_text(text):
+        return text, "text"
+    return _ocr_pil(_render_page(page)), "raster"
+
+
+def _ocr_pdf_page(path: Path, index: int) -> tuple[str, str]:
+    with fitz.open(path) as doc:
+        return _pdf_page(doc.load_page(index))
+
+
+def _pdf_page_count(path: Path) -> int:
+    # OCR max 3 pages for invoices
+    with fitz.open(path) as doc:
+        return min(_PDF_MAX_PAGES, len(doc))
+
+
+def _fields_complete(text: str) -> bool:
+    fields = _extract_fields_regex(text)
+    return all(fields.get(k) for k in ("date", "no", "company", "gross"))
+
+
+def _merge_modes(modes) -> str:
+    used = set(modes)
+    return "mixed" if len(used) > 1 else (used.pop() if used else "text")
+
+
+def _ocr_pdf(path: Path) -> tuple[str, str]:
+    # Every page: the result is cached as the text of the whole document.
+    out = []
+    modes = []
+    with fitz.open(path) as doc:
+        for i in range(min(_PDF_MAX_PAGES, len(doc))):
+            text, mode = _pdf_page(doc.load_page(i))
+            out.append(text)
+            modes.append(mode)
+    return "\n\n".join(out), _merge_modes(modes)
+
+
+def _ocr_file(path: Path, is_pdf: bool) -> tuple[str, str]:
+    return _ocr_pdf(path) if is_pdf else (_ocr_image(path), "raster")
+
+
+def ocr_cache_key(file_hash: str, is_pdf: bool, lang: str | None = None) -> str:
+    settings = {"kind": "pdf" if is_pdf else "image", "lang": ocr_lang() if lang is None else lang}
+    if is_pdf:
+        settings.update(
+            pages=_PDF_MAX_PAGES,
+            dpi=[_TARGET_LONG_PX, _MIN_DPI, _MAX_DPI],
+            text_layer=[_MIN_TEXT_CHARS, _MIN_TEXT_RATIO],
+        )
+    return ocr_cache.make_key(file_hash, settings)
+
+
+async def aocr_cache_key(file_hash: str, is_pdf: bool) -> str:
+    return ocr_cache_key(file_hash, is_pdf, lang=await aocr_lang())
+
+
+def _ocr_file_cached(path: Path, is_pdf: bool) -> str:
+    key = ocr_cache_key(ocr_cache.file_sha256(path), is_pdf)
+    text = ocr_cache.get(key, "text")
+    if text is None:
+        text, mode = _ocr_file(path, is_pdf)
+        ocr_cache.put(key, text=text, path=mode)
+    return text
+
+
+def ocr_image(path: Path) -> str:
+    return _ocr_file_cached(path, False)
 
-async def ai_refine_ocr(text: str) -> dict | None:
+
+def ocr_pdf(path: Path) -> str:
+    return _ocr_file_cached(path, True)
+
+
+def _image_quality(local: Path) -> tuple[bool, str, str | None]:
+    """Brightness/contrast gate, then a single OSD+recognition pass; returns (ok, message, text)."""
+    try:
+        with Image.open(local) as img:
+            gray = img.convert("L")
+            stat = ImageStat.Stat(gray)
+            mean = float(stat.mean[0]) if stat.mean else 0.0
+            std = float(stat.stddev[0]) if stat.stddev else 0.0
+
+            reasons = []
+            if mean < 55:
+                reasons.append("ciemne")
+            if std < 18:
+                reasons.append("niewyrazne")
+
+            text = None
+            if not reasons:
+                try:
+                    text, angle = _engine().recognize_with_osd(gray)
+                except Exception:
+                    text, angle = None, None
+                if angle in (90, 180, 270):
+                    reasons.append("krzywe")
+
+        if reasons:
+            return False, f"Zdjecie wyglada na {'/'.join(reasons)}. Zrob jeszcze raz - jasniej i prosto nad faktura.", None
+        return True, "", text
+    except Exception:
+        return True, "", None
+
+
+def image_dhash(local: Path) -> int | None:
+    """64-bit difference hash: one bit per horizontally adjacent pixel pair of a 9x8 thumbnail.
+
+    JPEG draft mode decodes at 1/8 scale, so this costs a few milliseconds even for phone photos.
+    """
+    try:
+        with Image.open(local) as img:
+            img.draft("L", (72, 64))
+            px = img.convert("L").resize((9, 8), Image.Resampling.LANCZOS).tobytes()
+    except Exception:
+        return None
+    bits = 0
+    for y in range(8):
+        row = px[y * 9:(y + 1) * 9]
+        for x in range(8):
+            bits = (bits << 1) | (row[x] > row[x + 1])
+    return bits
+
+
+async def perceptual_hash(path: Path) -> int | None:
+    # Off the OCR pool on purpose: the near-duplicate check must not queue behind recognition jobs.
+    return await asyncio.to_thread(image_dhash, path)
+
+
+def _timed(fn, *args):
+    # Runs in the worker process; wall-clock start lets the caller split queue wait from execution.
+    started = time.time()
+    t0 = time.perf_counter()
+    result = fn(*args)
+    return started, int((time.perf_counter() - t0) * 1000), result
+
+
+def _pool() -> ProcessPoolExecutor:
+    global _POOL
+    with _POOL_LOCK:
+        if _POOL is None:
+            _POOL = ProcessPoolExecutor(max_workers=OCR_WORKERS, initializer=_init_worker)
+        return _POOL
+
+
+def shutdown_ocr_pool() -> None:
+    global _POOL
+    with _POOL_LOCK:
+        pool, _POOL = _POOL, None
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def ocr_queue_depth() -> int:
+    return _INFLIGHT
+
+
+def _admit(kind: str) -> None:
+    if _INFLIGHT >= OCR_WORKERS + OCR_QUEUE_LIMIT:
+        record_metric("ocr_queue_wait", ok=False, latency_ms=0, kind=kind, rejected=True, inflight=_INFLIGHT)
+        raise OcrBusyError(f"OCR queue full ({_INFLIGHT} jobs)")
+
+
+def _release(_fut=None) -> None:
+    global _INFLIGHT
+    with _INFLIGHT_LOCK:
+        _INFLIGHT -= 1
+
+
+async def _submit(kind: str, fn, *args, admitted: bool = False):
+    global _INFLIGHT
+    if not admitted:
+        _admit(kind)
+
+    with _INFLIGHT_LOCK:
+        _INFLIGHT += 1
+    submitted = time.time()
+    try:
+        job = _pool().submit(_timed, fn, *args)
+    except BaseException:
+        _release()
+        raise
+    # The slot is freed when the worker is done, not when the caller stops waiting:
+    # cancelling the awaiting task cannot stop a page that is already being recognised.
+    job.add_done_callback(_release)
+    try:
+        started, exec_ms, result = await asyncio.wrap_future(job)
+    except BrokenProcessPool:
+        # A crashed worker (e.g. tesseract OOM) poisons the pool - drop it so the next job gets a fresh one.
+        shutdown_ocr_pool()
+        raise
+
+    record_metric("ocr_queue_wait", ok=True, latency_ms=max(0, int((started - submitted) * 1000)), kind=kind)
+    record_metric("ocr_exec", ok=True, latency_ms=exec_ms, kind=kind)
+    return result
+
+
+async def _ocr_pdf_parallel(path: Path) -> tuple[str, str, bool]:
+    """One pool job per page; once the pages seen so far yield all four fields the rest are cancelled.
+
+    Returns (text, mode, complete); complete is False when pages were cancelled.
+    """
+    pages = await asyncio.to_thread(_pdf_page_count, path)
+    if pages <= 1:
+        text, mode = await _submit("pdf", _ocr_file, path, True)
+        return text, mode, True
+
+    # The document is admitted as a whole, so a busy queue never leaves it half-submitted.
+    _admit("pdf")
+    tasks = {asyncio.ensure_future(_submit("pdf_page", _ocr_pdf_page, path, i, admitted=True)): i for i in range(pages)}
+    done_pages: dict[int, tuple[str, str]] = {}
+    pending = set(tasks)
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                done_pages[tasks[task]] = task.result()
+            text = "\n\n".join(done_pages[i][0] for i in sorted(done_pages))
+            if pending and _fields_complete(text):
+                break
+    finally:
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+
+    record_metric("ocr_pdf_pages", ok=True, pages=pages, done=len(done_pages), cancelled=pages - len(done_pages))
+    return text, _merge_modes(mode for _, mode in done_pages.values()), len(done_pages) == pages
+
+
+async def ocr_file(path: Path, is_pdf: bool, file_hash: str = "") -> tuple[str, str]:
+    """OCR on the worker pool, so the event loop keeps serving other users meanwhile.
+
+    Returns (text, path) where path is "text" (PDF text layer), "raster" (tesseract),
+    "mixed" or "cache" (served from the OCR cache without touching the pool).
+    """
+    key = await aocr_cache_key(file_hash or ocr_cache.file_sha256(path), is_pdf)
+    text = ocr_cache.get(key, "text")
+    if text is not None:
+        return text, "cache"
+    complete = True
+    if is_pdf:
+        text, mode, complete = await _ocr_pdf_parallel(path)
+    else:
+        text, mode = await _submit("image", _ocr_file, path, False)
+    if complete:
+        # Early-exit text lacks the skipped pages; it must not be served later as the whole document.
+        ocr_cache.put(key, text=text, path=mode)
+    return text, mode
+
+
+async def check_image_quality(path: Path, file_hash: str = "") -> tuple[bool, str]:
+    """The same engine pass that checks orientation also recognises the text.
+
+    On success the text goes into the OCR cache, so the following ocr_file() is a cache hit.
+    """
+    ok, msg, text = await _submit("quality", _image_quality, path)
+    if ok and text is not None:
+        ocr_cache.put(await aocr_cache_key(file_hash or ocr_cache.file_sha256(path), False), text=text, path="raster")
+    return ok, msg
+
+def normalize_date(s: str) -> str:
+    m = _DATE_RE.fullmatch((s or "").strip())
+    if not m:
+        return ""
+    y, mo, d = m.group(1, 3, 4) if m.group(1) else m.group(8, 7, 5)
+    try:
+        return date(int(y), int(mo), int(d)).isoformat()
+    except ValueError:
+        return ""
+
+async def ai_refine_ocr(text: str, scope: str | None = None) -> dict | None:
     """
     Senior IT: RAG-Augmented Extraction.
     Uses context from the LangChain project to help AI understand the document.
     """
-    from config import env, ENV_OPENAI_API_KEY
+    import ai_service
     from domain.rag_bridge import get_smart_context_for_invoice
-    
-    api_key = env(ENV_OPENAI_API_KEY, "")
-    if not api_key: return None
-    
-    # 1. Retrieve Context using RAG Bridge (Now Async)
-    rag_context = await get_smart_context_for_invoice(text)
-    
-    try:
-        from openai import OpenAI
-        client = OpenAI(api_key=api_key)
-        
-        system_prompt = (
-            "You are a professional accounting assistant. "
-            "Extract invoice data from the OCR text into JSON. "
-            "Fields: date (YYYY-MM-DD), no (invoice number), company (seller name), gross (total amount as number). "
-        )
-        
-        user_content = f"OCR TEXT:\n{text[:2000]}"
-        if rag_context:
-            user_content = f"CONTEXT FROM KNOWLEDGE BASE:\n{rag_context}\n\n" + user_content
-            system_prompt += "Use the provided CONTEXT to fix any OCR errors (like misread company names or digits)."
-
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_content}
-            ],
-            response_format={"type": "json_object"}
-        )
-        import json
-        return json.loads(response.choices[0].message.content)
-    except:
+
+    if not ai_service.ai_available():
         return None
 
-async def extract_fields(text: str) -> dict:
+    # Re-sent or re-scanned documents normalise to the same text; reuse the earlier answer.
+    fp = hashlib.sha256(" ".join(re.sub(r"\W+", " ", text.casefold()).split()).encode("utf-8")).hexdigest()
+    llm_key = ocr_cache.make_key(fp, {"kind": "llm", "model": ai_service.CHAT_MODEL})
+    cached = ocr_cache.get(llm_key, "llm")
+    if cached is not None:
+        return dict(cached)
+
+    # 1. Retrieve Context using RAG Bridge (Now Async)
+    rag_context = await get_smart_context_for_invoice(text, scope=scope)
+
+    system_prompt = (
+        "You are a professional accounting assistant. "
+        "Extract invoice data from the OCR text into JSON. "
+        "Fields: date (YYYY-MM-DD), no (invoice number), company (seller name), gross (total amount as number). "
+    )
+
+    user_content = f"OCR TEXT:\n{text[:2000]}"
+    if rag_context:
+        user_content = f"CONTEXT FROM KNOWLEDGE BASE:\n{rag_context}\n\n" + user_content
+        system_prompt += "Use the provided CONTEXT to fix any OCR errors (like misread company names or digits)."
+
+    res = await ai_service.chat_json(system_prompt, user_content, op="ocr_refine")
+    if res:
+        ocr_cache.put(llm_key, llm=res)
+    return res
+
+async def extract_fields(text: str, cache_key: str = "", scope: str | None = None) -> dict:
+    cached = ocr_cache.get(cache_key, "fields") if cache_key else None
+    if cached is not None:
+        return dict(cached)
+
     t = text or ""
-    
-    # Try Standard Regex first
-    res = _extract_fields_regex(t)
+
+    # Anchored template values first, then regex, then the template's line-position guesses.
+    res, positional = apply_template(supplier_nip(t), t)
+    for k, v in _extract_fields_regex(t).items():
+        if not res.get(k):
+            res[k] = v
+    for k, v in positional.items():
+        if not res.get(k):
+            res[k] = v
     
     # Senior IT: If Regex missed gross or company, and AI is available, use it!
+    # With both present the AI round trip (and its RAG lookup) is skipped entirely.
+    cacheable = True
     if not res.get("gross") or not res.get("company"):
-        ai_res = await ai_refine_ocr(t)
+        ai_res = await ai_refine_ocr(t, scope=scope)
         if ai_res:
             # Merge: Keep what regex got, fill gaps with AI
             for k in ("date", "no", "company", "gross"):
                 if not res.get(k) and ai_res.get(k):
                     res[k] = str(ai_res[k])
+        else:
+            # AI down or no answer: the next upload of this file asks again instead of reusing the gaps.
+            cacheable = False
     
+    if cache_key and cacheable:
+        ocr_cache.put(cache_key, fields=res)
     return res
 
 def _extract_fields_regex(text: str) -> dict:
     t = text or ""
-    
-    # --- DATE ---
-    # Look for common date patterns YYYY-MM-DD or DD-MM-YYYY near keywords
-    m_date = re.search(r"(?:data|dnia|wystawienia|sprzedaży).*?(\d{4}[-./]\d{2}[-./]\d{2}|\d{2}[-./]\d{2}[-./]\d{4})", t, re.IGNORECASE | re.DOTALL)
-    if not m_date:
-         m_date = re.search(r"\b(\d{4}[-./]\d{2}[-./]\d{2})\b", t)
-    
-    inv_date = normalize_date(m_date.group(1)) if m_date else ""
+    found = text_scan.scan(t)
 
-    # --- INVOICE NO ---
-    # Look for 'Faktura nr', 'FV nr', etc.
-    m_no = re.search(r"(?:Faktura|FV|Nr)\s*(?:VAT|nr)?\s*[:.]?\s*([A-Z0-9/.-]{4,})", t, re.IGNORECASE)
-    inv_no = m_no.group(1).strip() if m_no else ""
+    inv_no = found["no"].strip()
     # Cleanup trailing dots/punctuation from invoice number
     inv_no = re.sub(r"[.,]$", "", inv_no)
 
-    # --- AMOUNT ---
-    # Heuristics: look for 'Razem', 'Do zapłaty', 'Suma', 'Total'
-    # We try to find the largest amount near these keywords.
-    candidates = []
-    
-    amount_patterns = [
-        r"(?:do\s+zapłaty|razem|suma|total|kwota\s+do\s+zapłaty)\s*:?\s*([0-9\s.,]+(?:PLN|zł|zlt)?)",
-        r"([0-9\s.,]+)\s*(?:PLN|zł|zlt)",  # Amount followed by currency
-    ]
-    
-    for pat in amount_patterns:
-        for match in re.finditer(pat, t, re.IGNORECASE):
-            val = parse_amount(match.group(1))
-            if val > 0 and val < 1000000: # Sanity check < 1M
-                candidates.append(val)
-    
-    # If candidates found, pick the largest (usually the Total Gross)
-    gross = max(candidates) if candidates else 0.0
+    # Keyword-anchored and currency-suffixed amounts; the largest is usually the total gross.
+    gross = max(found["amounts"]) if found["amounts"] else 0.0
 
-    # --- SELLER ---
-    # Look for 'Sprzedawca', 'Wystawca'
-    m_seller = re.search(r"(?:Sprzedawca|Wystawca|Dostawca)[:\s]*\n?(.+)", t, re.IGNORECASE)
-    seller = normalize_text(m_seller.group(1)[:80]) if m_seller else ""
+    seller = normalize_text(found["seller"][:80]) if found["seller"] else ""
 
     return {
-        "date": inv_date,
+        "date": text_scan.invoice_date(t),
         "no": inv_no,
         "company": seller,
         "gross": f"{gross:.2f}" if gross else ""
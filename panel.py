@@ -4,6 +4,7 @@ from datetime import datetime
 from flask import Flask, render_template_string
 
 from domain.metrics import summarize_24h
+from domain.resilience import saved_breaker_states
 from storage_router import retry_stats
 
 app = Flask(__name__)
@@ -28,6 +29,9 @@ body{font-family:Segoe UI,Arial,sans-serif;background:var(--bg);color:var(--ink)
   <div class="card"><div class="k">Retry Queue</div><div class="v {{'warn' if q.queue > 0 else 'ok'}}">{{q.queue}}</div></div>
   <div class="card"><div class="k">Dead Letter</div><div class="v {{'bad' if q.dlq > 0 else 'ok'}}">{{q.dlq}}</div></div>
   <div class="card"><div class="k">Events 24h</div><div class="v">{{m.events_24h}}</div></div>
+  {% for name, c in circuits.items() %}
+  <div class="card"><div class="k">Circuit {{name}}</div><div class="v {{'bad' if c.state == 'open' else ('warn' if c.state == 'half_open' else 'ok')}}">{{c.state}}</div><div class="k">failures {{c.failures}} &middot; trips {{c.trips}}{% if c.state == 'open' %} &middot; retry in {{c.retry_in_s}} s{% endif %}</div></div>
+  {% endfor %}
 </div>
 """
 
@@ -36,7 +40,7 @@ body{font-family:Segoe UI,Arial,sans-serif;background:var(--bg);color:var(--ink)
 def home():
     m = summarize_24h()
     q = retry_stats()
-    return render_template_string(HTML, m=m, q=q, ts=datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+    return render_template_string(HTML, m=m, q=q, circuits=saved_breaker_states(), ts=datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
 
 
 if __name__ == "__main__":
@@ -1,38 +1,62 @@
 ﻿# -*- coding: utf-8 -*-
 import json
 import logging
+import re
+import threading
 import time
+import zlib
 from pathlib import Path
 
 import gspread
+from gspread.utils import rowcol_to_a1
 from google.oauth2.service_account import Credentials
 from googleapiclient.discovery import build
 
-from config import DATA_DIR, ENV_DRIVE, ENV_SA, ENV_SHEET_ID, ENV_SHEET_NAME, SA_JSON_DEFAULT, env, must
+from config import (
+    COL_COMP,
+    COL_DATE,
+    COL_GROSS,
+    COL_STATUS,
+    DATA_DIR,
+    ENV_DRIVE,
+    ENV_SA,
+    ENV_SHEET_ID,
+    ENV_SHEET_NAME,
+    SA_JSON_DEFAULT,
+    SHEETS_DELTA_SYNC,
+    SHEETS_FULL_SYNC_SEC,
+    env,
+    must,
+)
+from domain import columns as col_proj
 from domain.metrics import record_metric
+from domain.resilience import retry_call
 
 _ws = None
 _drive = None
 log = logging.getLogger("danex.sheets")
 
+# "Arkusz1!A43:K43" / "'Faktury 2026'!$A$43:$K$43" -> 43
+_UPDATED_ROW_RE = re.compile(r"!\$?[A-Z]+\$?(\d+)")
 
-def _with_retry(fn, what: str, attempts: int = 3, base_delay: float = 0.6):
-    last_exc = None
-    for i in range(1, attempts + 1):
+
+def _with_retry(fn, what: str, attempts: int = 3, base_delay: float = 0.6, backend: str = "sheets"):
+    def _timed():
         t0 = time.perf_counter()
         try:
             out = fn()
-            record_metric("gsheets_call", ok=True, latency_ms=int((time.perf_counter() - t0) * 1000), operation=what)
-            return out
-        except Exception as exc:
+        except Exception:
             record_metric("gsheets_call", ok=False, latency_ms=int((time.perf_counter() - t0) * 1000), operation=what)
-            last_exc = exc
-            if i >= attempts:
-                break
-            delay = base_delay * (2 ** (i - 1))
-            log.warning("Retry %s failed (%s/%s): %s", what, i, attempts, exc)
-            time.sleep(delay)
-    raise last_exc
+            raise
+        record_metric("gsheets_call", ok=True, latency_ms=int((time.perf_counter() - t0) * 1000), operation=what)
+        return out
+
+    return retry_call(_timed, what, attempts=attempts, base_delay=base_delay, breaker_name=backend)
+
+
+def drive_call(fn, what: str):
+    """One Drive request behind the Drive breaker; callers retry the whole upload."""
+    return _with_retry(fn, what, attempts=1, backend="drive")
 
 
 def sa_path() -> str:
@@ -72,18 +96,152 @@ def drive():
         creds = Credentials.from_service_account_file(sa_path(), scopes=["https://www.googleapis.com/auth/drive"])
         return build("drive", "v3", credentials=creds, cache_discovery=False)
 
-    _drive = _with_retry(_init_drive, "drive_init")
+    _drive = _with_retry(_init_drive, "drive_init", backend="drive")
     return _drive
 
 
 def ensure_drive_root():
     folder_id = must(ENV_DRIVE)
-    _with_retry(lambda: drive().files().get(fileId=folder_id, fields="id,name").execute(), "drive_root_check")
+    _with_retry(lambda: drive().files().get(fileId=folder_id, fields="id,name").execute(), "drive_root_check", backend="drive")
     return folder_id
 
 
-def get_all_values():
+# --- Incremental reads ---
+#
+# The last full read is kept with one CRC per row. A refresh then costs:
+#   * nothing but a Drive ``version`` lookup when the spreadsheet did not change;
+#   * otherwise one values.batchGet of the header, the last _DELTA_WINDOW rows plus
+#     anything past the known tail, and the _WATCH_COLS of the older rows. Older rows
+#     whose watched cells differ are re-read in contiguous runs.
+# A changed header or a shorter sheet (rows deleted, columns moved) forces a full read,
+# and so does age: edits to unwatched cells of old rows surface within SHEETS_FULL_SYNC_SEC.
+# The Drive version is looked up before ``_delta_lock`` is taken, so readers never queue
+# behind that network call; a stale version only costs one extra delta read.
+
+_DELTA_WINDOW = 200
+_WATCH_COLS = (COL_DATE, COL_COMP, COL_GROSS, COL_STATUS)
+
+_delta_lock = threading.Lock()
+_delta = {"rows": None, "fps": [], "version": None, "full_at": 0.0}
+
+
+def _fp(row: list) -> int:
+    return zlib.crc32("\x1f".join(row).encode("utf-8"))
+
+
+def _col_letter(col: int) -> str:
+    return rowcol_to_a1(1, col)[:-1]
+
+
+def _drive_version():
+    """Drive bumps ``version`` on every edit of the file; None when Drive is unavailable."""
+    try:
+        meta = _with_retry(
+            lambda: drive().files().get(fileId=must(ENV_SHEET_ID), fields="version", supportsAllDrives=True).execute(),
+            "sheet_version",
+            attempts=1,
+            backend="drive",
+        )
+    except Exception as exc:
+        log.info("Drive version check skipped: %s", exc)
+        return None
+    return str(meta.get("version") or "") or None
+
+
+def _full_read(version) -> list[list]:
     rows = _with_retry(lambda: ws().get_all_values(), "get_all_values")
+    _delta.update(rows=rows, fps=[_fp(r) for r in rows], version=version, full_at=time.time())
+    record_metric("gsheets_sync", ok=True, mode="full", rows=len(rows), changed=len(rows))
+    return rows
+
+
+def _pad(row: list, width: int) -> list:
+    row = ["" if v is None else str(v) for v in row]
+    return row + [""] * (width - len(row))
+
+
+def _runs(row_nos: list[int]) -> list[tuple[int, int]]:
+    out: list[tuple[int, int]] = []
+    for n in sorted(row_nos):
+        if out and n == out[-1][1] + 1:
+            out[-1] = (out[-1][0], n)
+        else:
+            out.append((n, n))
+    return out
+
+
+def _delta_read(version) -> list[list]:
+    rows = _delta["rows"]
+    if rows is None or time.time() - _delta["full_at"] >= SHEETS_FULL_SYNC_SEC:
+        return _full_read(version)
+
+    if version is not None and version == _delta["version"]:
+        record_metric("gsheets_sync", ok=True, mode="unchanged", rows=len(rows), changed=0)
+        return rows
+
+    width = len(rows[0]) if rows else 0
+    if width == 0:
+        return _full_read(version)
+    last = _col_letter(width)
+    known = len(rows)
+    start = max(2, known - _DELTA_WINDOW + 1)
+    # "1:1" is the whole header row, so a column added past the known width shows up too.
+    ranges = ["1:1", f"A{start}:{last}"]
+    watched = [c for c in _WATCH_COLS if c <= width] if start > 2 else []
+    ranges += [f"{_col_letter(c)}2:{_col_letter(c)}{start - 1}" for c in watched]
+    got = _with_retry(lambda: ws().batch_get(ranges), "get_delta")
+
+    header = list(got[0][0]) if got[0] else []
+    window = [list(r) for r in got[1]]
+    if _pad(header, width) != rows[0] or len(header) > width or any(len(r) > width for r in window):
+        return _full_read(version)
+    if start + len(window) - 1 < known:
+        # Fewer rows than before: something was deleted, so row numbers moved.
+        return _full_read(version)
+
+    suspects: set[int] = set()
+    for col, values in zip(watched, got[2:]):
+        for i in range(start - 2):
+            cell = values[i][0] if i < len(values) and values[i] else ""
+            if str(cell) != rows[i + 1][col - 1]:
+                suspects.add(i + 2)
+    fresh: dict[int, list] = {}
+    if suspects:
+        spans = _runs(list(suspects))
+        blocks = _with_retry(lambda: ws().batch_get([f"A{a}:{last}{b}" for a, b in spans]), "get_delta_rows")
+        for (a, b), block in zip(spans, blocks):
+            for k in range(b - a + 1):
+                fresh[a + k] = list(block[k]) if k < len(block) else []
+    for j, r in enumerate(window):
+        fresh[start + j] = r
+
+    changed = 0
+    for row_no in sorted(fresh):
+        row = _pad(fresh[row_no], width)
+        fp = _fp(row)
+        if row_no <= len(rows):
+            if _delta["fps"][row_no - 1] == fp:
+                continue
+            rows[row_no - 1] = row
+            _delta["fps"][row_no - 1] = fp
+        else:
+            rows.append(row)
+            _delta["fps"].append(fp)
+        changed += 1
+    _delta["version"] = version
+    record_metric("gsheets_sync", ok=True, mode="delta", rows=len(rows), changed=changed, read_rows=len(fresh))
+    return rows
+
+
+def get_all_values(full: bool = False):
+    """The whole sheet; ``full=True`` skips the delta read for callers that must see every cell (mirror pulls)."""
+    if SHEETS_DELTA_SYNC:
+        version = _drive_version()
+        with _delta_lock:
+            # Callers patch what they get (snapshot cache); the delta baseline stays untouched.
+            rows = [list(r) for r in (_full_read(version) if full else _delta_read(version))]
+    else:
+        rows = _with_retry(lambda: ws().get_all_values(), "get_all_values")
     
     # Senior IT: Update stats cache
     from domain.state_cache import update_todo_count
@@ -100,6 +258,27 @@ def get_all_values():
     return rows
 
 
+def get_columns(cols, month: str | None = None) -> col_proj.Columns:
+    """Reads only the requested columns (one ``batchGet`` of ``X2:X`` ranges).
+
+    With ``month`` the date column is fetched too and used to drop other months.
+    An unchanged sheet (same Drive version as the delta baseline) costs no read.
+    """
+    cols = sorted({int(c) for c in cols})
+    if SHEETS_DELTA_SYNC and _delta["rows"] is not None:
+        version = _drive_version()
+        with _delta_lock:
+            rows = _delta["rows"]
+            if rows is not None and _delta["version"] is not None and version == _delta["version"]:
+                record_metric("gsheets_columns", ok=True, mode="baseline", cols=len(cols))
+                return col_proj.project(rows[1:], cols, month)
+    wanted = sorted(set(cols) | ({COL_DATE} if month else set()))
+    got = _with_retry(lambda: ws().batch_get([f"{_col_letter(c)}2:{_col_letter(c)}" for c in wanted]), "get_columns")
+    arrays = {c: [r[0] if r else "" for r in values] for c, values in zip(wanted, got)}
+    record_metric("gsheets_columns", ok=True, mode="ranges", cols=len(wanted))
+    return col_proj.from_arrays(arrays, cols, month)
+
+
 def get_row(row_no: int):
     return _with_retry(lambda: ws().row_values(row_no), "get_row")
 
@@ -108,8 +287,55 @@ def update_cell(row_no: int, col: int, value):
     return _with_retry(lambda: ws().update_cell(row_no, col, value), "update_cell")
 
 
-def append_row(values, value_input_option="USER_ENTERED"):
-    return _with_retry(lambda: ws().append_row(values, value_input_option=value_input_option), "append_row")
+def update_cells(row_no: int, cells: dict):
+    # One values.batchUpdate round trip for all cells of the row.
+    data = [
+        {"range": rowcol_to_a1(row_no, int(col)), "values": [["" if value is None else value]]}
+        for col, value in cells.items()
+    ]
+    if not data:
+        return None
+    return _with_retry(lambda: ws().batch_update(data, value_input_option="USER_ENTERED"), "update_cells")
+
+
+def read_ranges(ranges: list[str]) -> list[list[list]]:
+    """Reads many A1 ranges in one values.batchGet; trailing empty rows and cells come back trimmed."""
+    if not ranges:
+        return []
+    return _with_retry(lambda: ws().batch_get(ranges), "read_ranges")
+
+
+def write_ranges(data: list[dict]):
+    """Writes many ``{"range": "A5:K5", "values": [[...]]}`` blocks in one values.batchUpdate."""
+    if not data:
+        return None
+    return _with_retry(lambda: ws().batch_update(data, value_input_option="USER_ENTERED"), "write_ranges")
+
+
+def _row_from_append_response(resp) -> int | None:
+    if not isinstance(resp, dict):
+        return None
+    rng = str((resp.get("updates") or {}).get("updatedRange", "") or "")
+    m = _UPDATED_ROW_RE.search(rng)
+    return int(m.group(1)) if m else None
+
+
+def append_row(values, value_input_option="USER_ENTERED") -> int:
+    """Appends a row and returns its 1-based row number as confirmed by Sheets."""
+    resp = _with_retry(lambda: ws().append_row(values, value_input_option=value_input_option), "append_row")
+    row_no = _row_from_append_response(resp)
+    if row_no is None:
+        log.warning("append_row: no updatedRange in response, falling back to a full read")
+        row_no = len(get_all_values())
+    return row_no
+
+
+def append_rows(rows: list[list], value_input_option="USER_ENTERED") -> int | None:
+    """Appends rows after the sheet's table (values.append); returns the first row number, None when unknown."""
+    if not rows:
+        return None
+    resp = _with_retry(lambda: ws().append_rows(rows, value_input_option=value_input_option), "append_rows")
+    return _row_from_append_response(resp)
 
 
 def next_row():
@@ -1,7 +1,11 @@
 ﻿# -*- coding: utf-8 -*-
+import asyncio
 import json
+import logging
 import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from threading import Lock
 from typing import Any, Dict, List, Optional
 
 import httpx
@@ -23,13 +27,23 @@ from config import (
     STATUS_TODO,
     STATUS_OK,
     STATUS_SENT,
+    API_LIST_PAGE_SIZE,
+    API_FETCH_WORKERS,
+    API_INVOICE_CACHE_TTL_SEC,
     env,
 )
+from domain import columns as col_proj
 from domain.metrics import record_metric
+from domain.resilience import retry_async, retry_call
 
 _DATA_DIR = Path(__file__).resolve().parent / "data"
 _DATA_DIR.mkdir(exist_ok=True)
 
+log = logging.getLogger("danex.storage_api")
+
+# Upper bound on GET /invoices pages per bulk read; ids not seen by then are fetched one by one.
+_MAX_LIST_PAGES = 50
+
 
 def _map_path(user_id: int) -> Path:
     return _DATA_DIR / f"api_rowmap_{user_id}.json"
@@ -49,6 +63,21 @@ def _save_map(user_id: int, data: Dict[str, Any]) -> None:
     _map_path(user_id).write_text(json.dumps(data, ensure_ascii=False, indent=2), encoding="utf-8")
 
 
+_META_COLS = {
+    COL_DATE: "date",
+    COL_COMP: "company",
+    COL_TYPE: "type",
+    COL_VAT: "vat",
+    COL_NET: "net",
+    COL_CAT: "cat",
+    COL_USER: "user",
+    COL_FILE: "file",
+}
+
+# Everything _row_from_invoice reads from an invoice; column reads ask the API for just these.
+_INVOICE_FIELDS = "id,number,total_gross,status"
+
+
 def _bot_status_to_api_status(bot_status: str) -> str:
     s = (bot_status or "").strip().upper()
     if s == STATUS_SENT:
@@ -67,52 +96,265 @@ def _api_status_to_bot_status(api_status: str) -> str:
     return STATUS_TODO
 
 
+def _row_from_invoice(inv: Dict[str, Any], meta: Dict[str, Any]) -> List[str]:
+    r = [""] * COL_FILE
+    r[COL_DATE - 1] = meta.get("date", "")
+    r[COL_NO - 1] = inv.get("number", "")
+    r[COL_COMP - 1] = meta.get("company", "")
+    r[COL_GROSS - 1] = str(inv.get("total_gross", ""))
+    r[COL_TYPE - 1] = meta.get("type", "")
+    r[COL_VAT - 1] = meta.get("vat", "")
+    r[COL_NET - 1] = meta.get("net", "")
+    r[COL_CAT - 1] = meta.get("cat", "")
+    r[COL_USER - 1] = meta.get("user", "")
+    r[COL_STATUS - 1] = _api_status_to_bot_status(inv.get("status", ""))
+    r[COL_FILE - 1] = meta.get("file", "")
+    return r
+
+
+def _padded(values: List[Any]) -> List[Any]:
+    vals = list(values)
+    if len(vals) < COL_FILE:
+        vals += [""] * (COL_FILE - len(vals))
+    return vals
+
+
+def _new_invoice_request(vals: List[Any]) -> tuple[str, Dict[str, Any]]:
+    """Client name and POST /invoices body (minus client_id) for a bot row."""
+    no_s = str(vals[COL_NO - 1] or "").strip() or "BRAK_NUMERU"
+    comp_s = str(vals[COL_COMP - 1] or "").strip() or "Nieznany klient"
+    gross_s = str(vals[COL_GROSS - 1] or "").strip()
+    status_s = str(vals[COL_STATUS - 1] or "").strip() or STATUS_NEW
+
+    try:
+        gross = float(gross_s.replace(" ", "").replace(",", "."))
+    except Exception:
+        gross = 0.0
+
+    if gross <= 0:
+        gross_api = 0.01
+        status_s = STATUS_TODO
+    else:
+        gross_api = gross
+    return comp_s, {"number": no_s, "total_gross": gross_api, "status": _bot_status_to_api_status(status_s)}
+
+
+def _remember_appended(m: Dict[str, Any], row_no: int, inv_id: int, comp_s: str, vals: List[Any]) -> None:
+    m.setdefault("row_to_invoice", {})[str(row_no)] = inv_id
+    m.setdefault("meta_by_invoice", {})[str(inv_id)] = {
+        "company": comp_s,
+        "date": str(vals[COL_DATE - 1] or ""),
+        "type": str(vals[COL_TYPE - 1] or ""),
+        "vat": str(vals[COL_VAT - 1] or ""),
+        "net": str(vals[COL_NET - 1] or ""),
+        "cat": str(vals[COL_CAT - 1] or ""),
+        "user": str(vals[COL_USER - 1] or ""),
+        "file": str(vals[COL_FILE - 1] or ""),
+    }
+
+
+def _patch_body(vals: Dict[int, str]) -> Dict[str, Any]:
+    # All API-backed columns go out in a single PATCH.
+    body: Dict[str, Any] = {}
+    if COL_GROSS in vals:
+        try:
+            gross = float(vals[COL_GROSS].replace(" ", "").replace(",", "."))
+            if gross > 0:
+                body["total_gross"] = gross
+        except Exception:
+            pass
+    if COL_NO in vals and vals[COL_NO].strip():
+        body["number"] = vals[COL_NO].strip()
+    if COL_STATUS in vals:
+        body["status"] = _bot_status_to_api_status(vals[COL_STATUS])
+    return body
+
+
+def _apply_meta(m: Dict[str, Any], inv_id: int, vals: Dict[int, str]) -> None:
+    meta = m.setdefault("meta_by_invoice", {}).setdefault(str(inv_id), {})
+    for col, key in _META_COLS.items():
+        if col in vals:
+            meta[key] = vals[col]
+
+
+def _row_invoice(m: Dict[str, Any], row_no: int) -> Optional[int]:
+    inv_id = m.get("row_to_invoice", {}).get(str(int(row_no)))
+    return int(inv_id) if inv_id else None
+
+
+def _unmapped_row(row_no: int) -> List[str]:
+    return [""] * COL_FILE if int(row_no) == 1 else []
+
+
+def _meta_of(m: Dict[str, Any], inv_id: int) -> Dict[str, Any]:
+    return m.get("meta_by_invoice", {}).get(str(inv_id), {})
+
+
+def _cell_values(cells: Dict[int, Any]) -> Dict[int, str]:
+    return {int(col): ("" if value is None else str(value)) for col, value in cells.items()}
+
+
+def _mapped_rows(m: Dict[str, Any]) -> List[tuple]:
+    rowmap = m.get("row_to_invoice", {})
+    return [(row_no, int(rowmap[str(row_no)])) for row_no in sorted(int(k) for k in rowmap.keys())]
+
+
+def _rows_from_map(m: Dict[str, Any], row_ids: List[tuple], invoices: Dict[int, Dict[str, Any]]) -> List[List[str]]:
+    metas = m.get("meta_by_invoice", {})
+    out = [[""] * COL_FILE]
+    for _, inv_id in row_ids:
+        out.append(_row_from_invoice(invoices.get(inv_id) or {}, metas.get(str(inv_id), {})))
+    return out
+
+
+def _column_rows(m: Dict[str, Any], cols, month: Optional[str]) -> tuple[List[tuple], bool]:
+    """Mapped rows of ``month`` (filtered on the locally kept date) and whether invoices are needed."""
+    row_ids = _mapped_rows(m)
+    if month:
+        metas = m.get("meta_by_invoice", {})
+        row_ids = [(r, i) for r, i in row_ids if str(metas.get(str(i), {}).get("date", "")).startswith(month)]
+    return row_ids, any(int(c) not in _META_COLS for c in cols)
+
+
+def _columns_from_map(m: Dict[str, Any], row_ids: List[tuple], invoices: Dict[int, Dict[str, Any]], cols) -> col_proj.Columns:
+    rows = _rows_from_map(m, row_ids, invoices)[1:]
+    return [r for r, _ in row_ids], col_proj.project(rows, cols)[1]
+
+
+def _token_from_login(data: Dict[str, Any]) -> tuple[str, float]:
+    tok = data.get("access_token") or data.get("token")
+    if not tok:
+        raise RuntimeError(f"Brak access_token w odpowiedzi: {data}")
+    exp = data.get("expires_in")
+    return tok, time.time() + (int(exp) if exp else 25 * 60)
+
+
+def _login_form() -> Dict[str, str]:
+    email = env("BOT_API_EMAIL", "")
+    password = env("BOT_API_PASSWORD", "")
+    if not email or not password:
+        raise RuntimeError("Brak BOT_API_EMAIL/BOT_API_PASSWORD w .env/Secret Manager")
+    return {"username": email, "password": password}
+
+
+def _list_params(skip: int, limit: int, fields: Optional[str]) -> Dict[str, Any]:
+    params: Dict[str, Any] = {"skip": skip, "limit": limit}
+    if fields:
+        # Servers that do not know the field selector ignore it and send whole invoices.
+        params["fields"] = fields
+    return params
+
+
+class _InvoiceListing:
+    """Paging state of one GET /invoices scan; the sync and async clients only do the requests."""
+
+    def __init__(self, wanted: set, fields: Optional[str]) -> None:
+        self.wanted = wanted
+        self.fields = fields
+        self.limit = max(1, API_LIST_PAGE_SIZE)
+        self.skip = 0
+        self.pages = 0
+        self.seen: set = set()
+        self.found: Dict[int, Dict[str, Any]] = {}
+        self.supported = True
+
+    def params(self) -> Dict[str, Any]:
+        return _list_params(self.skip, self.limit, self.fields)
+
+    @property
+    def result(self) -> Optional[Dict[int, Dict[str, Any]]]:
+        return self.found if self.supported else None
+
+    def feed(self, page: Any) -> bool:
+        """Takes one page (None when the endpoint is missing); True when the next one is worth reading."""
+        self.supported = isinstance(page, list)
+        if not self.supported:
+            return False
+        self.pages += 1
+        new = 0
+        for inv in page:
+            try:
+                inv_id = int(inv.get("id"))
+            except Exception:
+                continue
+            if inv_id in self.seen:
+                continue
+            self.seen.add(inv_id)
+            new += 1
+            if inv_id in self.wanted:
+                self.found[inv_id] = inv
+        if len(page) < self.limit or len(self.found) >= len(self.wanted):
+            return False
+        if not new:
+            # The server ignores ``skip`` (or repeats itself): more pages would be the same page.
+            log.warning("GET /invoices page at skip=%s brought no new ids; stopping the scan", self.skip)
+            return False
+        if self.pages >= _MAX_LIST_PAGES:
+            # Typically a wanted invoice was deleted; the rest is fetched one by one.
+            return False
+        self.skip += self.limit
+        return True
+
+
+def _not_found(exc: httpx.HTTPStatusError) -> bool:
+    return exc.response is not None and exc.response.status_code == 404
+
+
+def _list_missing(exc: httpx.HTTPStatusError) -> bool:
+    """The server has no GET /invoices list (older API): fall back to per-invoice reads."""
+    return exc.response is not None and exc.response.status_code in (404, 405)
+
+
+def _record_bulk_read(t0: float, ids: List[int], missing: List[int], listed: Optional[Dict[int, Any]]) -> None:
+    mode = "cache" if not missing else ("list" if listed is not None else "fanout")
+    elapsed = int((time.perf_counter() - t0) * 1000)
+    record_metric("api_bulk_read", ok=True, latency_ms=elapsed, mode=mode, rows=len(ids), fetched=len(missing))
+
+
+def _base_url() -> str:
+    return env("API_BASE_URL", "http://127.0.0.1:8000").rstrip("/")
+
+
 class ApiStorage:
     def __init__(self) -> None:
         self._token: Optional[str] = None
         self._token_exp: float = 0.0
         self._http: Optional[httpx.Client] = None
         self._last_base_url: str = ""
+        # (user_id, invoice_id) -> (fetched_at, invoice)
+        self._inv_cache: Dict[tuple, tuple] = {}
+        self._inv_lock = Lock()
+        # None = not probed yet; False once the server rejected GET /invoices.
+        self._list_supported: Optional[bool] = None
 
     def _client(self) -> httpx.Client:
-        base_url = env("API_BASE_URL", "http://127.0.0.1:8000").rstrip("/")
+        base_url = _base_url()
         if self._http is None or self._last_base_url != base_url:
             self._http = httpx.Client(base_url=base_url, timeout=30.0)
             self._last_base_url = base_url
         return self._http
 
     def _request_with_retry(self, method: str, path: str, **kwargs):
-        last_exc = None
-        for attempt in range(1, 4):
+        def _once():
             t0 = time.perf_counter()
             try:
                 resp = self._client().request(method, path, **kwargs)
-                elapsed = int((time.perf_counter() - t0) * 1000)
-                record_metric("api_request", ok=resp.status_code < 500, latency_ms=elapsed, method=method, path=path)
-                return resp
-            except Exception as exc:
-                elapsed = int((time.perf_counter() - t0) * 1000)
-                record_metric("api_request", ok=False, latency_ms=elapsed, method=method, path=path)
-                last_exc = exc
-                if attempt >= 3:
-                    break
-                time.sleep(0.5 * attempt)
-        raise last_exc
+            except Exception:
+                record_metric("api_request", ok=False, latency_ms=int((time.perf_counter() - t0) * 1000), method=method, path=path)
+                raise
+            elapsed = int((time.perf_counter() - t0) * 1000)
+            record_metric("api_request", ok=resp.status_code < 500, latency_ms=elapsed, method=method, path=path)
+            if resp.status_code >= 500:
+                # Raised here so 5xx counts against the breaker; callers raise_for_status() anyway.
+                resp.raise_for_status()
+            return resp
+
+        return retry_call(_once, f"api {method} {path}", breaker_name="api")
 
     def _login(self) -> None:
-        email = env("BOT_API_EMAIL", "")
-        password = env("BOT_API_PASSWORD", "")
-        if not email or not password:
-            raise RuntimeError("Brak BOT_API_EMAIL/BOT_API_PASSWORD w .env/Secret Manager")
-        r = self._request_with_retry("POST", "/api/v1/auth/login", data={"username": email, "password": password})
+        r = self._request_with_retry("POST", "/api/v1/auth/login", data=_login_form())
         r.raise_for_status()
-        data = r.json()
-        tok = data.get("access_token") or data.get("token")
-        if not tok:
-            raise RuntimeError(f"Brak access_token w odpowiedzi: {data}")
-        self._token = tok
-        exp = data.get("expires_in")
-        self._token_exp = time.time() + (int(exp) if exp else 25 * 60)
+        self._token, self._token_exp = _token_from_login(r.json())
 
     def _ensure(self) -> None:
         if (not self._token) or (time.time() > (self._token_exp - 30)):
@@ -135,6 +377,92 @@ class ApiStorage:
         created = self._req("POST", "/api/v1/clients", json_body={"name": name})
         return int(created["id"])
 
+    def _cached_invoice(self, uid: int, inv_id: int) -> Optional[Dict[str, Any]]:
+        if API_INVOICE_CACHE_TTL_SEC <= 0:
+            return None
+        with self._inv_lock:
+            hit = self._inv_cache.get((uid, inv_id))
+        if not hit or (time.time() - hit[0]) >= API_INVOICE_CACHE_TTL_SEC:
+            return None
+        return hit[1]
+
+    def _remember_invoice(self, uid: int, inv: Any) -> None:
+        if API_INVOICE_CACHE_TTL_SEC <= 0 or not isinstance(inv, dict) or "id" not in inv:
+            return
+        with self._inv_lock:
+            self._inv_cache[(uid, int(inv["id"]))] = (time.time(), inv)
+
+    def _forget_invoice(self, uid: int, inv_id: int) -> None:
+        with self._inv_lock:
+            self._inv_cache.pop((uid, inv_id), None)
+
+    def _split_cached(self, uid: int, ids: List[int]) -> tuple[Dict[int, Dict[str, Any]], List[int]]:
+        """Invoices the cache still holds, and the ids that need a request."""
+        out: Dict[int, Dict[str, Any]] = {}
+        missing = []
+        for inv_id in ids:
+            inv = self._cached_invoice(uid, inv_id)
+            if inv is None:
+                missing.append(inv_id)
+            else:
+                out[inv_id] = inv
+        return out, missing
+
+    def _keep_fetched(self, uid: int, out: Dict[int, Dict[str, Any]], fetched: Dict[int, Dict[str, Any]]) -> None:
+        for inv in fetched.values():
+            self._remember_invoice(uid, inv)
+        out.update(fetched)
+
+    def _list_invoices(self, wanted: set, fields: Optional[str] = None) -> Optional[Dict[int, Dict[str, Any]]]:
+        """Pages through GET /invoices until every wanted id is seen (or paging stalls); None when unsupported."""
+        if self._list_supported is False:
+            return None
+        listing = _InvoiceListing(wanted, fields)
+        while True:
+            try:
+                page = self._req("GET", "/api/v1/invoices", params=listing.params())
+            except httpx.HTTPStatusError as exc:
+                if not _list_missing(exc):
+                    raise
+                page = None
+            more = listing.feed(page)
+            self._list_supported = listing.supported
+            if not more:
+                return listing.result
+
+    def _fetch_one(self, inv_id: int) -> Optional[Dict[str, Any]]:
+        try:
+            return self._req("GET", f"/api/v1/invoices/{inv_id}")
+        except httpx.HTTPStatusError as exc:
+            if _not_found(exc):
+                return None
+            raise
+
+    def _fetch_invoices(self, ids: List[int]) -> Dict[int, Dict[str, Any]]:
+        """Fallback: one GET per invoice, with bounded parallelism; deleted invoices are left out."""
+        if not ids:
+            return {}
+        self._ensure()
+        workers = max(1, min(API_FETCH_WORKERS, len(ids)))
+        if workers == 1:
+            got = [self._fetch_one(inv_id) for inv_id in ids]
+        else:
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                got = list(pool.map(self._fetch_one, ids))
+        return {inv_id: inv for inv_id, inv in zip(ids, got) if inv is not None}
+
+    def _load_invoices(self, uid: int, ids: List[int], fields: Optional[str] = None) -> Dict[int, Dict[str, Any]]:
+        t0 = time.perf_counter()
+        out, missing = self._split_cached(uid, ids)
+        listed = None
+        if missing:
+            listed = self._list_invoices(set(missing), fields)
+            fetched = dict(listed or {})
+            fetched.update(self._fetch_invoices([i for i in missing if i not in fetched]))
+            self._keep_fetched(uid, out, fetched)
+        _record_bulk_read(t0, ids, missing, listed)
+        return out
+
     def ws(self, update: Update):
         return self
 
@@ -148,118 +476,260 @@ class ApiStorage:
         row_no = int(m.get("next_row", 2))
         m["next_row"] = row_no + 1
 
-        vals = list(values)
-        if len(vals) < COL_FILE:
-            vals += [""] * (COL_FILE - len(vals))
-
-        no_s = str(vals[COL_NO - 1] or "").strip() or "BRAK_NUMERU"
-        comp_s = str(vals[COL_COMP - 1] or "").strip() or "Nieznany klient"
-        gross_s = str(vals[COL_GROSS - 1] or "").strip()
-        status_s = str(vals[COL_STATUS - 1] or "").strip() or STATUS_NEW
-
-        try:
-            gross = float(gross_s.replace(" ", "").replace(",", "."))
-        except Exception:
-            gross = 0.0
-
-        client_id = self._find_or_create_client(comp_s)
-        if gross <= 0:
-            gross_api = 0.01
-            status_s = STATUS_TODO
-        else:
-            gross_api = gross
-
-        inv = self._req(
-            "POST",
-            "/api/v1/invoices",
-            json_body={
-                "client_id": client_id,
-                "number": no_s,
-                "total_gross": gross_api,
-                "status": _bot_status_to_api_status(status_s),
-            },
-        )
+        vals = _padded(values)
+        comp_s, body = _new_invoice_request(vals)
+        body["client_id"] = self._find_or_create_client(comp_s)
+        inv = self._req("POST", "/api/v1/invoices", json_body=body)
         inv_id = int(inv["id"])
+        self._remember_invoice(uid, inv)
 
-        m.setdefault("row_to_invoice", {})[str(row_no)] = inv_id
-        m.setdefault("meta_by_invoice", {})[str(inv_id)] = {
-            "company": comp_s,
-            "date": str(vals[COL_DATE - 1] or ""),
-            "type": str(vals[COL_TYPE - 1] or ""),
-            "vat": str(vals[COL_VAT - 1] or ""),
-            "net": str(vals[COL_NET - 1] or ""),
-            "cat": str(vals[COL_CAT - 1] or ""),
-            "user": str(vals[COL_USER - 1] or ""),
-            "file": str(vals[COL_FILE - 1] or ""),
-        }
+        _remember_appended(m, row_no, inv_id, comp_s, vals)
         _save_map(uid, m)
         return row_no
 
     def update_cell(self, update: Update, row_no: int, col: int, value: Any):
+        return self.update_cells(update, row_no, {col: value})
+
+    def update_cells(self, update: Update, row_no: int, cells: Dict[int, Any]):
         uid = update.effective_user.id
         m = _load_map(uid)
-        inv_id = m.get("row_to_invoice", {}).get(str(int(row_no)))
-        if not inv_id:
+        inv_id = _row_invoice(m, row_no)
+        if inv_id is None:
             return
-        inv_id = int(inv_id)
-        v = "" if value is None else str(value)
+        vals = _cell_values(cells)
 
-        if col == COL_GROSS:
-            try:
-                gross = float(v.replace(" ", "").replace(",", "."))
-                if gross > 0:
-                    self._req("PATCH", f"/api/v1/invoices/{inv_id}", json_body={"total_gross": gross})
-            except Exception:
-                pass
-        elif col == COL_NO and v.strip():
-            self._req("PATCH", f"/api/v1/invoices/{inv_id}", json_body={"number": v.strip()})
-        elif col == COL_STATUS:
-            self._req("PATCH", f"/api/v1/invoices/{inv_id}", json_body={"status": _bot_status_to_api_status(v)})
-
-        meta = m.setdefault("meta_by_invoice", {}).setdefault(str(inv_id), {})
-        if col == COL_DATE:
-            meta["date"] = v
-        if col == COL_COMP:
-            meta["company"] = v
-        if col == COL_TYPE:
-            meta["type"] = v
-        if col == COL_VAT:
-            meta["vat"] = v
-        if col == COL_NET:
-            meta["net"] = v
-        if col == COL_CAT:
-            meta["cat"] = v
-        if col == COL_USER:
-            meta["user"] = v
-        if col == COL_FILE:
-            meta["file"] = v
+        body = _patch_body(vals)
+        if body:
+            self._forget_invoice(uid, inv_id)
+            self._remember_invoice(uid, self._req("PATCH", f"/api/v1/invoices/{inv_id}", json_body=body))
+
+        _apply_meta(m, inv_id, vals)
         _save_map(uid, m)
 
     def get_all_values(self, update: Update):
         uid = update.effective_user.id
         m = _load_map(uid)
-        out = [[""] * COL_FILE]
-        for row_no in sorted((int(k) for k in m.get("row_to_invoice", {}).keys())):
-            inv_id = int(m["row_to_invoice"][str(row_no)])
+        row_ids = _mapped_rows(m)
+        invoices = self._load_invoices(uid, [inv_id for _, inv_id in row_ids])
+        return _rows_from_map(m, row_ids, invoices)
+
+    def get_columns(self, update: Update, cols, month: Optional[str] = None) -> col_proj.Columns:
+        """Locally kept columns cost no request; invoice columns list only the needed fields."""
+        uid = update.effective_user.id
+        m = _load_map(uid)
+        row_ids, need_api = _column_rows(m, cols, month)
+        invoices = self._load_invoices(uid, [inv_id for _, inv_id in row_ids], _INVOICE_FIELDS) if need_api else {}
+        return _columns_from_map(m, row_ids, invoices, cols)
+
+    def get_row(self, update: Update, row_no: int):
+        uid = update.effective_user.id
+        m = _load_map(uid)
+        inv_id = _row_invoice(m, row_no)
+        if inv_id is None:
+            return _unmapped_row(row_no)
+        inv = self._cached_invoice(uid, inv_id)
+        if inv is None:
             inv = self._req("GET", f"/api/v1/invoices/{inv_id}")
-            meta = m.get("meta_by_invoice", {}).get(str(inv_id), {})
-            r = [""] * COL_FILE
-            r[COL_DATE - 1] = meta.get("date", "")
-            r[COL_NO - 1] = inv.get("number", "")
-            r[COL_COMP - 1] = meta.get("company", "")
-            r[COL_GROSS - 1] = str(inv.get("total_gross", ""))
-            r[COL_TYPE - 1] = meta.get("type", "")
-            r[COL_VAT - 1] = meta.get("vat", "")
-            r[COL_NET - 1] = meta.get("net", "")
-            r[COL_CAT - 1] = meta.get("cat", "")
-            r[COL_USER - 1] = meta.get("user", "")
-            r[COL_STATUS - 1] = _api_status_to_bot_status(inv.get("status", ""))
-            r[COL_FILE - 1] = meta.get("file", "")
-            out.append(r)
+            self._remember_invoice(uid, inv)
+        return _row_from_invoice(inv or {}, _meta_of(m, inv_id))
+
+
+class AsyncApiStorage:
+    """Native ``httpx.AsyncClient`` twin of ``ApiStorage``.
+
+    Shares the token, invoice cache and row maps with the sync client it wraps, so
+    scripts and the bot see the same state. The HTTP client is bound to the event loop
+    that created it and is rebuilt (the old one closed) if a different loop or base URL shows up.
+    """
+
+    def __init__(self, sync: ApiStorage) -> None:
+        self._sync = sync
+        self._http: Optional[httpx.AsyncClient] = None
+        self._http_key: tuple = ()
+        self._login_lock: Optional[asyncio.Lock] = None
+        self._closing: set = set()
+
+    def _retire(self, http: httpx.AsyncClient, loop: asyncio.AbstractEventLoop) -> None:
+        """Closes a client replaced by a new loop or base URL, on the loop it belongs to."""
+        if loop is asyncio.get_running_loop():
+            task = loop.create_task(http.aclose())
+            self._closing.add(task)
+            task.add_done_callback(self._closing.discard)
+        elif loop.is_running():
+            asyncio.run_coroutine_threadsafe(http.aclose(), loop)
+        else:
+            # Its loop has stopped, so the connections can no longer be closed cleanly.
+            log.warning("Dropping API AsyncClient of a stopped event loop without closing it")
+
+    def _client(self) -> httpx.AsyncClient:
+        loop = asyncio.get_running_loop()
+        key = (loop, _base_url())
+        if self._http is None or self._http_key != key:
+            if self._http is not None:
+                self._retire(self._http, self._http_key[0])
+            self._http = httpx.AsyncClient(base_url=key[1], timeout=30.0)
+            self._http_key = key
+            self._login_lock = asyncio.Lock()
+        return self._http
+
+    async def aclose(self) -> None:
+        http, self._http, self._http_key = self._http, None, ()
+        if http is not None:
+            await http.aclose()
+
+    async def _request_with_retry(self, method: str, path: str, **kwargs):
+        async def _once():
+            t0 = time.perf_counter()
+            try:
+                resp = await self._client().request(method, path, **kwargs)
+            except Exception:
+                record_metric("api_request", ok=False, latency_ms=int((time.perf_counter() - t0) * 1000), method=method, path=path)
+                raise
+            elapsed = int((time.perf_counter() - t0) * 1000)
+            record_metric("api_request", ok=resp.status_code < 500, latency_ms=elapsed, method=method, path=path)
+            if resp.status_code >= 500:
+                resp.raise_for_status()
+            return resp
+
+        return await retry_async(_once, f"api {method} {path}", breaker_name="api")
+
+    async def _ensure(self) -> None:
+        st = self._sync
+        if st._token and time.time() <= (st._token_exp - 30):
+            return
+        self._client()
+        async with self._login_lock:
+            # Another request may have logged in while this one waited.
+            if st._token and time.time() <= (st._token_exp - 30):
+                return
+            r = await self._request_with_retry("POST", "/api/v1/auth/login", data=_login_form())
+            r.raise_for_status()
+            st._token, st._token_exp = _token_from_login(r.json())
+
+    async def _req(self, method: str, path: str, json_body=None, params=None):
+        await self._ensure()
+        headers = {"Authorization": f"Bearer {self._sync._token}"}
+        r = await self._request_with_retry(method, path, json=json_body, params=params, headers=headers)
+        r.raise_for_status()
+        return r.json() if r.content else None
+
+    async def _find_or_create_client(self, name: str) -> int:
+        res = await self._req("GET", "/api/v1/clients", params={"q": name, "skip": 0, "limit": 20})
+        if isinstance(res, list):
+            for c in res:
+                if (c.get("name") or "").strip().lower() == name.lower():
+                    return int(c["id"])
+        created = await self._req("POST", "/api/v1/clients", json_body={"name": name})
+        return int(created["id"])
+
+    async def _list_invoices(self, wanted: set, fields: Optional[str] = None) -> Optional[Dict[int, Dict[str, Any]]]:
+        st = self._sync
+        if st._list_supported is False:
+            return None
+        listing = _InvoiceListing(wanted, fields)
+        while True:
+            try:
+                page = await self._req("GET", "/api/v1/invoices", params=listing.params())
+            except httpx.HTTPStatusError as exc:
+                if not _list_missing(exc):
+                    raise
+                page = None
+            more = listing.feed(page)
+            st._list_supported = listing.supported
+            if not more:
+                return listing.result
+
+    async def _fetch_invoices(self, ids: List[int]) -> Dict[int, Dict[str, Any]]:
+        if not ids:
+            return {}
+        await self._ensure()
+        sem = asyncio.Semaphore(max(1, API_FETCH_WORKERS))
+
+        async def _one(inv_id: int):
+            async with sem:
+                try:
+                    return await self._req("GET", f"/api/v1/invoices/{inv_id}")
+                except httpx.HTTPStatusError as exc:
+                    if _not_found(exc):
+                        return None
+                    raise
+
+        got = await asyncio.gather(*(_one(inv_id) for inv_id in ids))
+        return {inv_id: inv for inv_id, inv in zip(ids, got) if inv is not None}
+
+    async def _load_invoices(self, uid: int, ids: List[int], fields: Optional[str] = None) -> Dict[int, Dict[str, Any]]:
+        t0 = time.perf_counter()
+        out, missing = self._sync._split_cached(uid, ids)
+        listed = None
+        if missing:
+            listed = await self._list_invoices(set(missing), fields)
+            fetched = dict(listed or {})
+            fetched.update(await self._fetch_invoices([i for i in missing if i not in fetched]))
+            self._sync._keep_fetched(uid, out, fetched)
+        _record_bulk_read(t0, ids, missing, listed)
         return out
 
-    def get_row(self, update: Update, row_no: int):
-        allv = self.get_all_values(update)
-        if row_no < 1 or row_no > len(allv):
-            return []
-        return allv[row_no - 1]
+    async def next_row(self, update: Update) -> int:
+        return self._sync.next_row(update)
+
+    async def append_row(self, update: Update, values: List[Any], value_input_option: str = "USER_ENTERED") -> int:
+        uid = update.effective_user.id
+        vals = _padded(values)
+        comp_s, body = _new_invoice_request(vals)
+        body["client_id"] = await self._find_or_create_client(comp_s)
+        inv = await self._req("POST", "/api/v1/invoices", json_body=body)
+        inv_id = int(inv["id"])
+        self._sync._remember_invoice(uid, inv)
+
+        # The row number is claimed only after the invoice exists, with no await in between.
+        m = _load_map(uid)
+        row_no = int(m.get("next_row", 2))
+        m["next_row"] = row_no + 1
+        _remember_appended(m, row_no, inv_id, comp_s, vals)
+        _save_map(uid, m)
+        return row_no
+
+    async def update_cell(self, update: Update, row_no: int, col: int, value: Any):
+        return await self.update_cells(update, row_no, {col: value})
+
+    async def update_cells(self, update: Update, row_no: int, cells: Dict[int, Any]):
+        uid = update.effective_user.id
+        inv_id = _row_invoice(_load_map(uid), row_no)
+        if inv_id is None:
+            return
+        vals = _cell_values(cells)
+
+        body = _patch_body(vals)
+        if body:
+            self._sync._forget_invoice(uid, inv_id)
+            self._sync._remember_invoice(uid, await self._req("PATCH", f"/api/v1/invoices/{inv_id}", json_body=body))
+
+        m = _load_map(uid)
+        _apply_meta(m, inv_id, vals)
+        _save_map(uid, m)
+
+    async def get_all_values(self, update: Update):
+        uid = update.effective_user.id
+        m = _load_map(uid)
+        row_ids = _mapped_rows(m)
+        invoices = await self._load_invoices(uid, [inv_id for _, inv_id in row_ids])
+        return _rows_from_map(m, row_ids, invoices)
+
+    async def get_columns(self, update: Update, cols, month: Optional[str] = None) -> col_proj.Columns:
+        uid = update.effective_user.id
+        m = _load_map(uid)
+        row_ids, need_api = _column_rows(m, cols, month)
+        invoices = await self._load_invoices(uid, [inv_id for _, inv_id in row_ids], _INVOICE_FIELDS) if need_api else {}
+        return _columns_from_map(m, row_ids, invoices, cols)
+
+    async def get_row(self, update: Update, row_no: int):
+        uid = update.effective_user.id
+        m = _load_map(uid)
+        inv_id = _row_invoice(m, row_no)
+        if inv_id is None:
+            return _unmapped_row(row_no)
+        inv = self._sync._cached_invoice(uid, inv_id)
+        if inv is None:
+            inv = await self._req("GET", f"/api/v1/invoices/{inv_id}")
+            self._sync._remember_invoice(uid, inv)
+        return _row_from_invoice(inv or {}, _meta_of(m, inv_id))
@@ -1,16 +1,26 @@
 ﻿# -*- coding: utf-8 -*-
+import asyncio
+import threading
 from types import SimpleNamespace
 from typing import Any
 
 from telegram import Update
 
-from domain.metrics import record_metric
+from config import COL_STATUS, STATUS_TODO, STORAGE_BACKEND
+from domain import columns as col_proj, search_index, snapshot_cache
+from domain.metrics import count_metric, record_metric
+from domain.resilience import CircuitOpenError, breaker_states, is_open
 from domain.retry_queue import dead_letter_size, enqueue, process_queue, queue_size
-from storage_api import ApiStorage
-from storage_sheets import SheetsStorage
+from storage_api import ApiStorage, AsyncApiStorage
+from storage_sheets import AsyncSheetsStorage, SheetsStorage
+from storage_sqlite import SqliteStorage
 
 _sheets = SheetsStorage()
 _api = ApiStorage()
+_sqlite = SqliteStorage()
+_async_sheets = AsyncSheetsStorage(_sheets)
+_async_api = AsyncApiStorage(_api)
+_BACKLOG_LOCK = threading.Lock()
 
 
 def _beta_user_ids() -> set[int]:
@@ -30,6 +40,8 @@ def _beta_user_ids() -> set[int]:
 def _storage_by_name(name: str):
     if name == "ApiStorage":
         return _api
+    if name == "SqliteStorage":
+        return _sqlite
     return _sheets
 
 
@@ -37,6 +49,8 @@ def get_storage(update: Update):
     uid = update.effective_user.id if update and update.effective_user else None
     if uid and uid in _beta_user_ids():
         return _api
+    if STORAGE_BACKEND == "sqlite":
+        return _sqlite
     return _sheets
 
 
@@ -54,67 +68,350 @@ def _exec_retry(rec: dict) -> None:
     if op == "update_cell":
         st.update_cell(fake, int(payload.get("row_no", 0)), int(payload.get("col", 0)), payload.get("value"))
         return
+    if op == "update_cells":
+        cells = {int(col): value for col, value in (payload.get("cells") or {}).items()}
+        st.update_cells(fake, int(payload.get("row_no", 0)), cells)
+        return
     raise RuntimeError(f"Unknown queue operation: {op}")
 
 
 def process_retry_backlog(limit: int = 20) -> dict:
-    return process_queue(_exec_retry, limit=limit)
+    if is_open("sheets") or is_open("api"):
+        # Replaying now would only burn the records' attempts; the breaker says when to try again.
+        return {"processed": 0, "ok": 0, "failed": 0, "moved_to_dlq": 0, "skipped": "circuit_open"}
+    # Writes from several worker threads may trigger a replay at once; one at a time is enough.
+    if not _BACKLOG_LOCK.acquire(blocking=False):
+        return {"processed": 0, "ok": 0, "failed": 0, "moved_to_dlq": 0, "skipped": "busy"}
+    try:
+        res = process_queue(_exec_retry, limit=limit)
+    finally:
+        _BACKLOG_LOCK.release()
+    if res.get("ok"):
+        # Replayed writes bypass the snapshot patches.
+        snapshot_cache.invalidate()
+    return res
 
 
 def retry_stats() -> dict:
     return {"queue": queue_size(), "dlq": dead_letter_size()}
 
 
+def circuit_stats() -> dict[str, dict]:
+    return breaker_states()
+
+
+def _queue_delay(exc: Exception) -> int:
+    # While a circuit is open the write waits at least until the breaker lets a probe through.
+    if isinstance(exc, CircuitOpenError):
+        return max(30, int(exc.retry_in) + 1)
+    return 30
+
+
+def _cache_key(storage, update: Update) -> str:
+    # Sheets is one shared table; API rows are mapped per user.
+    name = type(storage).__name__
+    if name == "ApiStorage":
+        uid = update.effective_user.id if update and update.effective_user else 0
+        return f"{name}:{uid}"
+    return name
+
+
+def _sync_todo_count(key: str) -> None:
+    if key not in ("SheetsStorage", "SqliteStorage"):
+        return
+    cnt = snapshot_cache.count_where(key, COL_STATUS, STATUS_TODO)
+    if cnt is not None:
+        from domain.state_cache import update_todo_count
+
+        update_todo_count(cnt)
+
+
 def ws(update: Update):
     return get_storage(update).ws(update)
 
 
-def get_all_values(update: Update):
-    return get_storage(update).get_all_values(update)
+def get_all_values(update: Update, fresh: bool = False):
+    """All rows; ``fresh=True`` skips the snapshot and reads the backend (health probe)."""
+    storage = get_storage(update)
+    key = _cache_key(storage, update)
+    rows = None if fresh else snapshot_cache.get_rows(key)
+    if rows is not None:
+        count_metric("storage_cache", backend=type(storage).__name__, operation="get_all_values", hit=True)
+        return rows
+    rows = storage.get_all_values(update)
+    snapshot_cache.put_rows(key, rows)
+    record_metric("storage_cache", ok=True, backend=type(storage).__name__, operation="get_all_values", hit=False)
+    return rows
+
+
+def get_columns(update: Update, cols, month: str | None = None) -> col_proj.Columns:
+    """``(row_nos, {col: values})`` for a few columns, optionally only rows of ``month``.
+
+    A fresh snapshot answers without I/O; otherwise the backend reads just those
+    columns (Sheets column ranges, SQLite column select, API field selection).
+    """
+    storage = get_storage(update)
+    got = snapshot_cache.get_columns(_cache_key(storage, update), cols, month)
+    if got is not None:
+        count_metric("storage_cache", backend=type(storage).__name__, operation="get_columns", hit=True)
+        return got
+    record_metric("storage_cache", ok=True, backend=type(storage).__name__, operation="get_columns", hit=False)
+    if not hasattr(storage, "get_columns"):
+        return col_proj.project(get_all_values(update)[1:], cols, month)
+    return storage.get_columns(update, cols, month)
 
 
 def get_row(update: Update, row_no: int):
-    return get_storage(update).get_row(update, row_no)
+    storage = get_storage(update)
+    row = snapshot_cache.get_row(_cache_key(storage, update), row_no)
+    if row is not None:
+        return row
+    return storage.get_row(update, row_no)
+
+
+def refresh(update: Update):
+    """Drops the cached snapshot for this backend and reads it again (/odswiez)."""
+    storage = get_storage(update)
+    key = _cache_key(storage, update)
+    snapshot_cache.invalidate(key)
+    rows = get_all_values(update)
+    search_index.sync_rows(rows, scope=key)
+    return rows
+
+
+def search_scope(update: Update) -> str:
+    return _cache_key(get_storage(update), update)
+
+
+def search_invoices(update: Update, query: str, page: int = 1, page_size: int = 5) -> tuple[list[dict], int]:
+    """Ranked invoice search served from the in-memory index; the sheet is only read for a periodic resync."""
+    key = search_scope(update)
+    if search_index.needs_sync(key):
+        search_index.sync_rows(get_all_values(update), scope=key)
+    return search_index.search_page(query, page, page_size, scope=key)
+
+
+def snapshot_version(update: Update) -> int:
+    return snapshot_cache.version(_cache_key(get_storage(update), update))
+
+
+def _payload(storage, update: Update, **fields) -> dict:
+    return {
+        "backend": type(storage).__name__,
+        "user_id": update.effective_user.id if update and update.effective_user else None,
+        **fields,
+    }
+
+
+def _write_ok(storage, key: str, row_no: int, cells: dict[int, Any], operation: str) -> None:
+    snapshot_cache.patch_cells(key, row_no, cells)
+    search_index.update_cells(row_no, cells, scope=key)
+    if COL_STATUS in cells:
+        _sync_todo_count(key)
+    tags = {"cells": len(cells)} if operation == "update_cells" else {}
+    record_metric("storage_write", ok=True, backend=type(storage).__name__, operation=operation, **tags)
+
+
+def _append_ok(storage, key: str, out, values) -> None:
+    snapshot_cache.append_values(key, out if isinstance(out, int) else None, values)
+    if isinstance(out, int):
+        search_index.add_invoice(out, search_index.row_fields(list(values)), scope=key)
+    _sync_todo_count(key)
+    record_metric("storage_write", ok=True, backend=type(storage).__name__, operation="append_row")
+
+
+def _write_failed(storage, key: str, operation: str, payload: dict, exc: Exception, **tags) -> str:
+    snapshot_cache.invalidate(key)
+    qid = enqueue(operation, payload, error=str(exc), delay_sec=_queue_delay(exc))
+    record_metric("storage_write", ok=False, backend=type(storage).__name__, operation=operation, **tags)
+    return qid
 
 
 def update_cell(update: Update, row_no: int, col: int, value: Any):
     storage = get_storage(update)
+    key = _cache_key(storage, update)
     try:
         process_retry_backlog(limit=5)
         out = storage.update_cell(update, row_no, col, value)
-        record_metric("storage_write", ok=True, backend=type(storage).__name__, operation="update_cell")
-        return out
     except Exception as exc:
-        payload = {
-            "backend": type(storage).__name__,
-            "user_id": update.effective_user.id if update and update.effective_user else None,
-            "row_no": row_no,
-            "col": col,
-            "value": value,
-        }
-        enqueue("update_cell", payload, error=str(exc))
-        record_metric("storage_write", ok=False, backend=type(storage).__name__, operation="update_cell")
+        _write_failed(storage, key, "update_cell", _payload(storage, update, row_no=row_no, col=col, value=value), exc)
         raise
+    _write_ok(storage, key, row_no, {col: value}, "update_cell")
+    return out
+
+
+def _cells_payload(storage, update: Update, row_no: int, cells: dict[int, Any]) -> dict:
+    # JSON keys are strings; _exec_retry converts them back.
+    return _payload(storage, update, row_no=row_no, cells={str(col): value for col, value in cells.items()})
+
+
+def update_cells(update: Update, row_no: int, cells: dict[int, Any]):
+    """Writes several cells of one row in a single backend round trip."""
+    storage = get_storage(update)
+    key = _cache_key(storage, update)
+    try:
+        process_retry_backlog(limit=5)
+        out = storage.update_cells(update, row_no, cells)
+    except Exception as exc:
+        _write_failed(storage, key, "update_cells", _cells_payload(storage, update, row_no, cells), exc, cells=len(cells))
+        raise
+    _write_ok(storage, key, row_no, cells, "update_cells")
+    return out
 
 
 def append_row(update: Update, values, value_input_option: str = "USER_ENTERED"):
     storage = get_storage(update)
+    key = _cache_key(storage, update)
     try:
         process_retry_backlog(limit=5)
         out = storage.append_row(update, values, value_input_option=value_input_option)
-        record_metric("storage_write", ok=True, backend=type(storage).__name__, operation="append_row")
-        return out
     except Exception as exc:
-        payload = {
-            "backend": type(storage).__name__,
-            "user_id": update.effective_user.id if update and update.effective_user else None,
-            "values": list(values),
-            "value_input_option": value_input_option,
-        }
-        qid = enqueue("append_row", payload, error=str(exc))
-        record_metric("storage_write", ok=False, backend=type(storage).__name__, operation="append_row")
+        payload = _payload(storage, update, values=list(values), value_input_option=value_input_option)
+        qid = _write_failed(storage, key, "append_row", payload, exc)
         raise RuntimeError(f"append_row failed, queued as {qid}") from exc
+    _append_ok(storage, key, out, values)
+    return out
 
 
 def next_row(update: Update):
     return get_storage(update).next_row(update)
+
+
+def mirror_stats() -> dict | None:
+    return _sqlite.stats() if STORAGE_BACKEND == "sqlite" else None
+
+
+def sync_local_mirror() -> dict:
+    """Pull/push round for the SQLite mirror; blocking, meant for the background job."""
+    res = _sqlite.sync()
+    if res["pulled"]:
+        # Operator edits from the sheet: drop the stale snapshot and re-index the mirror.
+        snapshot_cache.invalidate("SqliteStorage")
+        search_index.sync_rows(_sqlite.get_all_values(None), scope="SqliteStorage")
+    if res["pushed"]:
+        record_metric("storage_write", ok=True, backend="SqliteStorage", operation="sync_push", rows=res["pushed"])
+    return res
+
+
+# --- Async interface: same routing, cache and retry-queue bookkeeping, awaited by the handlers ---
+
+
+def _async_twin(storage):
+    if storage is _sheets:
+        return _async_sheets
+    if storage is _api:
+        return _async_api
+    return None
+
+
+async def _acall(storage, method: str, update: Update, *args, **kwargs):
+    if storage is _sqlite and _sqlite.ready():
+        # Local queries take well under a millisecond; a thread hop would cost more.
+        return getattr(storage, method)(update, *args, **kwargs)
+    twin = _async_twin(storage)
+    if twin is not None:
+        return await getattr(twin, method)(update, *args, **kwargs)
+    # Backends without an async twin run in a worker thread.
+    return await asyncio.to_thread(getattr(storage, method), update, *args, **kwargs)
+
+
+async def aprocess_retry_backlog(limit: int = 20) -> dict:
+    return await asyncio.to_thread(process_retry_backlog, limit)
+
+
+async def aget_all_values(update: Update, fresh: bool = False):
+    storage = get_storage(update)
+    key = _cache_key(storage, update)
+    rows = None if fresh else snapshot_cache.get_rows(key)
+    if rows is not None:
+        count_metric("storage_cache", backend=type(storage).__name__, operation="get_all_values", hit=True)
+        return rows
+    rows = await _acall(storage, "get_all_values", update)
+    snapshot_cache.put_rows(key, rows)
+    record_metric("storage_cache", ok=True, backend=type(storage).__name__, operation="get_all_values", hit=False)
+    return rows
+
+
+async def aget_columns(update: Update, cols, month: str | None = None) -> col_proj.Columns:
+    storage = get_storage(update)
+    got = snapshot_cache.get_columns(_cache_key(storage, update), cols, month)
+    if got is not None:
+        count_metric("storage_cache", backend=type(storage).__name__, operation="get_columns", hit=True)
+        return got
+    record_metric("storage_cache", ok=True, backend=type(storage).__name__, operation="get_columns", hit=False)
+    if not hasattr(storage, "get_columns"):
+        return col_proj.project((await aget_all_values(update))[1:], cols, month)
+    return await _acall(storage, "get_columns", update, cols, month)
+
+
+async def aget_row(update: Update, row_no: int):
+    storage = get_storage(update)
+    row = snapshot_cache.get_row(_cache_key(storage, update), row_no)
+    if row is not None:
+        return row
+    return await _acall(storage, "get_row", update, row_no)
+
+
+async def arefresh(update: Update):
+    storage = get_storage(update)
+    key = _cache_key(storage, update)
+    snapshot_cache.invalidate(key)
+    rows = await aget_all_values(update)
+    search_index.sync_rows(rows, scope=key)
+    return rows
+
+
+async def asearch_invoices(update: Update, query: str, page: int = 1, page_size: int = 5) -> tuple[list[dict], int]:
+    key = search_scope(update)
+    if search_index.needs_sync(key):
+        search_index.sync_rows(await aget_all_values(update), scope=key)
+    return search_index.search_page(query, page, page_size, scope=key)
+
+
+async def aupdate_cell(update: Update, row_no: int, col: int, value: Any):
+    storage = get_storage(update)
+    key = _cache_key(storage, update)
+    try:
+        await aprocess_retry_backlog(limit=5)
+        out = await _acall(storage, "update_cell", update, row_no, col, value)
+    except Exception as exc:
+        _write_failed(storage, key, "update_cell", _payload(storage, update, row_no=row_no, col=col, value=value), exc)
+        raise
+    _write_ok(storage, key, row_no, {col: value}, "update_cell")
+    return out
+
+
+async def aupdate_cells(update: Update, row_no: int, cells: dict[int, Any]):
+    storage = get_storage(update)
+    key = _cache_key(storage, update)
+    try:
+        await aprocess_retry_backlog(limit=5)
+        out = await _acall(storage, "update_cells", update, row_no, cells)
+    except Exception as exc:
+        _write_failed(storage, key, "update_cells", _cells_payload(storage, update, row_no, cells), exc, cells=len(cells))
+        raise
+    _write_ok(storage, key, row_no, cells, "update_cells")
+    return out
+
+
+async def aappend_row(update: Update, values, value_input_option: str = "USER_ENTERED"):
+    storage = get_storage(update)
+    key = _cache_key(storage, update)
+    try:
+        await aprocess_retry_backlog(limit=5)
+        out = await _acall(storage, "append_row", update, values, value_input_option=value_input_option)
+    except Exception as exc:
+        payload = _payload(storage, update, values=list(values), value_input_option=value_input_option)
+        qid = _write_failed(storage, key, "append_row", payload, exc)
+        raise RuntimeError(f"append_row failed, queued as {qid}") from exc
+    _append_ok(storage, key, out, values)
+    return out
+
+
+async def anext_row(update: Update):
+    return await _acall(get_storage(update), "next_row", update)
+
+
+async def aclose() -> None:
+    await _async_api.aclose()
+    await _async_sheets.aclose()
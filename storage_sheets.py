@@ -1,12 +1,34 @@
 ﻿# -*- coding: utf-8 -*-
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 from typing import Any
 from telegram import Update
-from sheets_service import ws as _ws, get_all_values as _gav, get_row as _gr, update_cell as _uc, append_row as _ar, next_row as _nr
+from sheets_service import ws as _ws, get_all_values as _gav, get_row as _gr, update_cell as _uc, update_cells as _ucs, append_row as _ar, next_row as _nr, get_columns as _gcols
 
 class SheetsStorage:
     def ws(self, update: Update): return _ws()
     def get_all_values(self, update: Update): return _gav()
     def get_row(self, update: Update, row_no: int): return _gr(row_no)
+    def get_columns(self, update: Update, cols, month: str | None = None): return _gcols(cols, month)
     def update_cell(self, update: Update, row_no: int, col: int, value: Any): return _uc(row_no, col, value)
+    def update_cells(self, update: Update, row_no: int, cells: dict[int, Any]): return _ucs(row_no, cells)
     def append_row(self, update: Update, values, value_input_option: str = "USER_ENTERED"): return _ar(values, value_input_option=value_input_option)
     def next_row(self, update: Update): return _nr()
+
+
+# gspread/googleapiclient are blocking; a small dedicated pool keeps them off the event loop
+# and caps concurrent Sheets calls well under the per-minute quota.
+_POOL = ThreadPoolExecutor(max_workers=4, thread_name_prefix="sheets")
+
+
+class AsyncSheetsStorage:
+    def __init__(self, sync: SheetsStorage | None = None): self._sync = sync or SheetsStorage()
+    async def _run(self, fn, *args, **kwargs): return await asyncio.get_running_loop().run_in_executor(_POOL, lambda: fn(*args, **kwargs))
+    async def get_all_values(self, update: Update): return await self._run(self._sync.get_all_values, update)
+    async def get_row(self, update: Update, row_no: int): return await self._run(self._sync.get_row, update, row_no)
+    async def get_columns(self, update: Update, cols, month: str | None = None): return await self._run(self._sync.get_columns, update, cols, month)
+    async def update_cell(self, update: Update, row_no: int, col: int, value: Any): return await self._run(self._sync.update_cell, update, row_no, col, value)
+    async def update_cells(self, update: Update, row_no: int, cells: dict[int, Any]): return await self._run(self._sync.update_cells, update, row_no, cells)
+    async def append_row(self, update: Update, values, value_input_option: str = "USER_ENTERED"): return await self._run(self._sync.append_row, update, values, value_input_option=value_input_option)
+    async def next_row(self, update: Update): return await self._run(self._sync.next_row, update)
+    async def aclose(self): return None
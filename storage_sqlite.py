@@ -0,0 +1,498 @@
+# -*- coding: utf-8 -*-
+"""Local SQLite mirror of the invoice sheet.
+
+The bot reads and writes the ``rows`` table; ``sync()`` (run by a background job)
+first pulls the sheet and then pushes local changes in one values.batchUpdate.
+
+Sheet row numbers key the rows. For every row the table keeps ``base``, the values
+last seen in the sheet (NULL for a row appended locally and not pushed yet), and
+``dirty``, the columns edited locally since. A pull therefore tells an operator's
+edit (sheet differs from ``base``) from a pending bot edit (listed in ``dirty``) and
+merges the two cell by cell, local edits winning.
+
+A sort or an inserted row puts another invoice under the same row number. Such a
+row is recognised by its identity columns (number, file, date) no longer matching
+``base``; its pending edits then follow the invoice to its new row, or are dropped
+when it cannot be found. Rows deleted in the sheet are detected as a shrink and
+trigger a reload. Local appends go out through values.append, so they never
+overwrite a row the operator added after the last pull.
+"""
+import json
+import logging
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any
+
+from gspread.utils import rowcol_to_a1
+from telegram import Update
+
+import sheets_service
+from config import (
+    COL_CAT,
+    COL_COMP,
+    COL_DATE,
+    COL_FILE,
+    COL_GROSS,
+    COL_NET,
+    COL_NO,
+    COL_STATUS,
+    COL_TYPE,
+    COL_USER,
+    COL_VAT,
+    DATA_DIR,
+)
+from domain import columns as col_proj
+from domain.metrics import record_metric
+
+log = logging.getLogger("danex.sqlite")
+
+DB_FILE = DATA_DIR / "invoices.sqlite3"
+
+_FIELDS = {
+    COL_DATE: "date",
+    COL_NO: "no",
+    COL_COMP: "company",
+    COL_GROSS: "gross",
+    COL_TYPE: "type",
+    COL_VAT: "vat",
+    COL_NET: "net",
+    COL_CAT: "cat",
+    COL_USER: "user",
+    COL_STATUS: "status",
+    COL_FILE: "file",
+}
+_NAMES = [_FIELDS[c] for c in range(1, COL_FILE + 1)]
+_SELECT = ", ".join(f'"{n}"' for n in _NAMES)
+
+# Columns that tell one invoice from another; the row number alone does not survive a sort.
+_IDENTITY_COLS = (COL_NO, COL_FILE, COL_DATE)
+
+# Keeps one values.batchUpdate request well under the API payload limits.
+_PUSH_CHUNK = 500
+
+_SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS rows (
+    row_no INTEGER PRIMARY KEY,
+    {", ".join(f'"{n}" TEXT NOT NULL DEFAULT ' + "''" for n in _NAMES)},
+    extra TEXT NOT NULL DEFAULT '[]',
+    month TEXT NOT NULL DEFAULT '',
+    base TEXT,
+    dirty TEXT NOT NULL DEFAULT '[]'
+);
+CREATE INDEX IF NOT EXISTS ix_rows_month ON rows(month);
+CREATE INDEX IF NOT EXISTS ix_rows_status ON rows(status);
+CREATE INDEX IF NOT EXISTS ix_rows_company ON rows(company COLLATE NOCASE);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+"""
+
+
+def _cell(value: Any) -> str:
+    return "" if value is None else str(value)
+
+
+def _month(date: str) -> str:
+    date = (date or "").strip()
+    return date[:7] if len(date) >= 7 and date[4] == "-" else ""
+
+
+def _split(values: list) -> tuple[list[str], list[str]]:
+    vals = [_cell(v) for v in values]
+    core = (vals + [""] * COL_FILE)[:COL_FILE]
+    extra = vals[COL_FILE:]
+    while extra and not extra[-1]:
+        extra.pop()
+    return core, extra
+
+
+def _joined(core: list[str], extra: list[str]) -> list[str]:
+    return core + extra if extra else core
+
+
+def _identity(vals: list[str]) -> tuple[str, ...]:
+    return tuple((vals[c - 1] if c <= len(vals) else "").strip() for c in _IDENTITY_COLS)
+
+
+def _moved_since_pull(edits: dict[int, list[str]]) -> set[int]:
+    """Rows (by number) whose identity cells in the sheet no longer match ``base``: sorted or shifted since the pull."""
+    last = rowcol_to_a1(1, max(_IDENTITY_COLS))[:-1]
+    row_nos = sorted(edits)
+    got: list = []
+    for i in range(0, len(row_nos), _PUSH_CHUNK):
+        got += sheets_service.read_ranges([f"A{r}:{last}{r}" for r in row_nos[i:i + _PUSH_CHUNK]])
+    moved = set()
+    for row_no, block in zip(row_nos, got):
+        if _displaced(edits[row_no], [str(v) for v in block[0]] if block else []):
+            moved.add(row_no)
+    return moved
+
+
+def _displaced(base: list[str], sheet_vals: list[str]) -> bool:
+    """True when a different invoice now sits in the row (sorted or shifted sheet)."""
+    ident = _identity(base)
+    return any(ident) and _identity(sheet_vals) != ident
+
+
+class SqliteStorage:
+    def __init__(self, path: Path | None = None) -> None:
+        self._path = Path(path or DB_FILE)
+        self._db: sqlite3.Connection | None = None
+        self._lock = threading.RLock()
+
+    # --- connection and helpers ---
+
+    def _conn(self) -> sqlite3.Connection:
+        if self._db is None:
+            db = sqlite3.connect(self._path, check_same_thread=False)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            db.executescript(_SCHEMA)
+            self._db = db
+        return self._db
+
+    def _meta(self, key: str, default: str = "") -> str:
+        row = self._conn().execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else default
+
+    def _set_meta(self, key: str, value: Any) -> None:
+        self._conn().execute("INSERT OR REPLACE INTO meta(key, value) VALUES (?, ?)", (key, str(value)))
+
+    def _load(self, row_no: int):
+        row = self._conn().execute(
+            f"SELECT {_SELECT}, extra, base, dirty FROM rows WHERE row_no = ?", (row_no,)
+        ).fetchone()
+        if row is None:
+            return None
+        core = list(row[:COL_FILE])
+        extra, base, dirty = row[COL_FILE:]
+        return core, json.loads(extra), (json.loads(base) if base is not None else None), set(json.loads(dirty))
+
+    def _store(self, row_no: int, core: list[str], extra: list[str], base, dirty) -> None:
+        cols = ", ".join(f'"{n}"' for n in _NAMES)
+        marks = ", ".join("?" for _ in _NAMES)
+        self._conn().execute(
+            f"INSERT OR REPLACE INTO rows(row_no, {cols}, extra, month, base, dirty) VALUES (?, {marks}, ?, ?, ?, ?)",
+            (
+                row_no,
+                *core,
+                json.dumps(extra, ensure_ascii=False),
+                _month(core[COL_DATE - 1]),
+                json.dumps(base, ensure_ascii=False) if base is not None else None,
+                json.dumps(sorted(dirty)),
+            ),
+        )
+
+    def _max_row(self) -> int:
+        top = self._conn().execute("SELECT MAX(row_no) FROM rows").fetchone()[0] or 1
+        return max(int(top), int(self._meta("sheet_rows", "1")))
+
+    def ready(self) -> bool:
+        """False until the first pull filled the mirror."""
+        with self._lock:
+            return bool(self._meta("pulled_at"))
+
+    def _ensure_bootstrapped(self) -> None:
+        # The first read of a fresh mirror has nothing local yet; it has to come from the sheet.
+        if not self._meta("pulled_at"):
+            self.pull()
+
+    # --- storage interface (same methods as SheetsStorage) ---
+
+    def ws(self, update: Update):
+        return self
+
+    def get_all_values(self, update: Update):
+        with self._lock:
+            self._ensure_bootstrapped()
+            header = json.loads(self._meta("header", "[]"))
+            out = [header]
+            for row_no, *rest in self._conn().execute(f"SELECT row_no, {_SELECT}, extra FROM rows ORDER BY row_no"):
+                # get_all_values is positional (index = row number - 1); keep blank rows in the gaps.
+                while len(out) < row_no - 1:
+                    out.append([""] * COL_FILE)
+                out.append(_joined(list(rest[:COL_FILE]), json.loads(rest[COL_FILE])))
+            return out
+
+    def get_row(self, update: Update, row_no: int):
+        with self._lock:
+            self._ensure_bootstrapped()
+            if int(row_no) == 1:
+                return json.loads(self._meta("header", "[]"))
+            rec = self._load(int(row_no))
+            return _joined(rec[0], rec[1]) if rec else []
+
+    def update_cell(self, update: Update, row_no: int, col: int, value: Any):
+        return self.update_cells(update, row_no, {col: value})
+
+    def update_cells(self, update: Update, row_no: int, cells: dict[int, Any]):
+        with self._lock, self._conn():
+            self._edit(int(row_no), cells)
+        return None
+
+    def _edit(self, row_no: int, cells: dict[int, Any]) -> None:
+        rec = self._load(row_no)
+        if rec is None:
+            # A blank row inside the sheet: it exists there, just empty.
+            rec = ([""] * COL_FILE, [], [""] * COL_FILE, set())
+        core, extra, base, dirty = rec
+        for col, value in cells.items():
+            col = int(col)
+            if col <= COL_FILE:
+                core[col - 1] = _cell(value)
+            else:
+                extra += [""] * (col - COL_FILE - len(extra))
+                extra[col - COL_FILE - 1] = _cell(value)
+            dirty.add(col)
+        self._store(row_no, core, extra, base, dirty if base is not None else set())
+
+    def append_row(self, update: Update, values, value_input_option: str = "USER_ENTERED") -> int:
+        core, extra = _split(list(values))
+        with self._lock, self._conn():
+            row_no = self._max_row() + 1
+            self._store(row_no, core, extra, None, set())
+        return row_no
+
+    def next_row(self, update: Update) -> int:
+        with self._lock:
+            self._ensure_bootstrapped()
+            return self._max_row() + 1
+
+    # --- indexed queries ---
+
+    def select_rows(self, month: str | None = None, status: str | None = None, company: str | None = None) -> list[tuple[int, list[str]]]:
+        where, args = [], []
+        if month:
+            where.append("month = ?")
+            args.append(month)
+        if status is not None:
+            where.append("status = ?")
+            args.append(status)
+        if company is not None:
+            where.append("company = ? COLLATE NOCASE")
+            args.append(company)
+        sql = f"SELECT row_no, {_SELECT}, extra FROM rows"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        with self._lock:
+            self._ensure_bootstrapped()
+            return [
+                (row_no, _joined(list(rest[:COL_FILE]), json.loads(rest[COL_FILE])))
+                for row_no, *rest in self._conn().execute(sql + " ORDER BY row_no", args)
+            ]
+
+    def get_columns(self, update: Update, cols, month: str | None = None) -> col_proj.Columns:
+        """Selects only the requested columns; ``month`` goes through the month index."""
+        cols = [int(c) for c in cols]
+        if any(c > COL_FILE for c in cols):
+            picked = self.select_rows(month=month)
+            return [n for n, _ in picked], col_proj.project([r for _, r in picked], cols)[1]
+        names = ", ".join(f'"{_FIELDS[c]}"' for c in cols) or "row_no"
+        sql = f"SELECT row_no, {names} FROM rows"
+        args: list = []
+        if month:
+            sql += " WHERE month = ?"
+            args.append(month)
+        with self._lock:
+            self._ensure_bootstrapped()
+            got = self._conn().execute(sql + " ORDER BY row_no", args).fetchall()
+        return [r[0] for r in got], {c: [r[i] for r in got] for i, c in enumerate(cols, 1)}
+
+    def count_status(self, status: str) -> int:
+        with self._lock:
+            return int(self._conn().execute("SELECT COUNT(*) FROM rows WHERE status = ?", (status,)).fetchone()[0])
+
+    def pending_changes(self) -> int:
+        with self._lock:
+            return int(self._conn().execute("SELECT COUNT(*) FROM rows WHERE base IS NULL OR dirty != '[]'").fetchone()[0])
+
+    def stats(self) -> dict:
+        with self._lock:
+            pulled = float(self._meta("pulled_at", "0") or 0)
+            pushed = float(self._meta("pushed_at", "0") or 0)
+        now = time.time()
+        return {
+            "pending": self.pending_changes(),
+            "pulled_ago_s": int(now - pulled) if pulled else None,
+            "pushed_ago_s": int(now - pushed) if pushed else None,
+        }
+
+    # --- background sync ---
+
+    def pull(self, rows: list[list] | None = None) -> int:
+        """Applies the sheet to the mirror; returns how many local rows changed."""
+        t0 = time.perf_counter()
+        # A forced full read: the delta read only watches a few columns of older rows.
+        rows = sheets_service.get_all_values(full=True) if rows is None else rows
+        sheet_rows = max(1, len(rows))
+        changed = 0
+        with self._lock, self._conn():
+            known = int(self._meta("sheet_rows", "0"))
+            if sheet_rows < known or self._meta("reload") == "1":
+                changed = self._reload(rows)
+                self._set_meta("reload", 0)
+            else:
+                local = {
+                    row_no: (json.loads(base) if base is not None else None)
+                    for row_no, base in self._conn().execute("SELECT row_no, base FROM rows")
+                }
+                displaced = []
+                moved = []
+                for row_no, values in enumerate(rows[1:], 2):
+                    core, extra = _split(values)
+                    sheet_vals = _joined(core, extra)
+                    if row_no not in local:
+                        if any(sheet_vals):
+                            self._store(row_no, core, extra, sheet_vals, set())
+                            changed += 1
+                        continue
+                    base = local[row_no]
+                    if base is None:
+                        # An operator appended in the sheet where a local row is still waiting to be pushed.
+                        displaced.append(self._load(row_no))
+                        self._store(row_no, core, extra, sheet_vals, set())
+                        changed += 1
+                    elif sheet_vals != base and _displaced(base, sheet_vals):
+                        # Another invoice moved into this row: its pending edits must not land here.
+                        edits = self._dirty_cells(row_no)
+                        if edits:
+                            moved.append((_identity(base), edits))
+                        self._store(row_no, core, extra, sheet_vals, set())
+                        changed += 1
+                    elif sheet_vals != base:
+                        changed += self._merge(row_no, core, extra, sheet_vals)
+                self._relocate(moved, rows)
+                for rec in displaced:
+                    self._store(max(self._max_row(), sheet_rows) + 1, rec[0], rec[1], None, set())
+                    log.warning("Local row moved past the sheet tail: row taken by an edit in the sheet")
+            self._set_meta("header", json.dumps(rows[0] if rows else [], ensure_ascii=False))
+            self._set_meta("sheet_rows", sheet_rows)
+            self._set_meta("pulled_at", time.time())
+        record_metric("sqlite_pull", ok=True, latency_ms=int((time.perf_counter() - t0) * 1000), rows=sheet_rows, changed=changed)
+        return changed
+
+    def _merge(self, row_no: int, core: list[str], extra: list[str], sheet_vals: list[str]) -> int:
+        cur_core, cur_extra, _, dirty = self._load(row_no)
+        cur = _joined(cur_core, cur_extra)
+        merged = list(sheet_vals) + [""] * max(0, len(cur) - len(sheet_vals))
+        for col in dirty:
+            merged += [""] * (col - len(merged))
+            merged[col - 1] = cur[col - 1] if col <= len(cur) else ""
+        m_core, m_extra = _split(merged)
+        self._store(row_no, m_core, m_extra, sheet_vals, dirty)
+        return 1
+
+    def _dirty_cells(self, row_no: int) -> dict[int, str]:
+        core, extra, _, dirty = self._load(row_no)
+        cur = _joined(core, extra)
+        return {col: (cur[col - 1] if col <= len(cur) else "") for col in dirty}
+
+    def _relocate(self, moved: list[tuple[tuple, dict[int, str]]], rows: list[list]) -> None:
+        """Re-applies unpushed edits to the row their invoice sits in now, found by identity."""
+        if not moved:
+            return
+        where: dict[tuple, list[int]] = {}
+        for row_no, values in enumerate(rows[1:], 2):
+            where.setdefault(_identity(_split(values)[0]), []).append(row_no)
+        for ident, edits in moved:
+            hits = where.get(ident, [])
+            if len(hits) != 1:
+                log.warning("Invoice %s moved in the sheet and was not found again; dropping %s unpushed cells", ident, len(edits))
+                continue
+            log.info("Invoice %s moved in the sheet; unpushed edits follow it to row %s", ident, hits[0])
+            self._edit(hits[0], edits)
+
+    def _reload(self, rows: list[list]) -> int:
+        # Row numbers shifted (rows deleted, or our appends landed elsewhere). Rebuild from the
+        # sheet, re-append local rows that were never pushed and move unpushed edits by identity.
+        db = self._conn()
+        pending = [self._load(r) for (r,) in db.execute("SELECT row_no FROM rows WHERE base IS NULL ORDER BY row_no").fetchall()]
+        moved = [
+            (_identity(self._load(r)[2]), self._dirty_cells(r))
+            for (r,) in db.execute("SELECT row_no FROM rows WHERE base IS NOT NULL AND dirty != '[]'").fetchall()
+        ]
+        db.execute("DELETE FROM rows")
+        for row_no, values in enumerate(rows[1:], 2):
+            core, extra = _split(values)
+            self._store(row_no, core, extra, _joined(core, extra), set())
+        self._relocate(moved, rows)
+        tail = max(1, len(rows))
+        for i, rec in enumerate(pending, 1):
+            self._store(tail + i, rec[0], rec[1], None, set())
+        return max(1, len(rows) - 1)
+
+    def push(self) -> int:
+        """Sends pending appends (values.append) and edited cells (one batch); returns how many rows were written."""
+        t0 = time.perf_counter()
+        with self._lock:
+            todo = [
+                (row_no, self._load(row_no))
+                for (row_no,) in self._conn().execute(
+                    "SELECT row_no FROM rows WHERE base IS NULL OR dirty != '[]' ORDER BY row_no"
+                ).fetchall()
+            ]
+        if not todo:
+            return 0
+        # Row numbers come from the last pull; a sort since then would put our cells on another invoice.
+        moved = _moved_since_pull({row_no: rec[2] for row_no, rec in todo if rec[2] is not None})
+        if moved:
+            log.warning("Rows %s moved in the sheet since the last pull; their edits wait for the next pull", sorted(moved))
+        data = []
+        sent: dict[int, list[str]] = {}
+        appends: list[int] = []
+        for row_no, (core, extra, base, dirty) in todo:
+            if row_no in moved:
+                continue
+            vals = _joined(core, extra)
+            sent[row_no] = vals
+            if base is None:
+                appends.append(row_no)
+            else:
+                for col in sorted(dirty):
+                    data.append({"range": rowcol_to_a1(row_no, col), "values": [[vals[col - 1] if col <= len(vals) else ""]]})
+        if not sent:
+            return 0
+        first = sheets_service.append_rows([sent[r] for r in appends]) if appends else None
+        for i in range(0, len(data), _PUSH_CHUNK):
+            sheets_service.write_ranges(data[i:i + _PUSH_CHUNK])
+
+        with self._lock, self._conn():
+            target = {r: r for r in sent}
+            if appends and first != appends[0]:
+                # Rows were added or removed in the sheet since the last pull; Sheets put ours elsewhere.
+                log.warning("Appended rows landed at %s instead of %s; mirror reloads on next pull", first, appends[0])
+                self._set_meta("reload", 1)
+                if first is not None:
+                    recs = {r: self._load(r) for r in appends}
+                    self._conn().executemany("DELETE FROM rows WHERE row_no = ?", [(r,) for r in appends])
+                    for i, r in enumerate(appends):
+                        target[r] = first + i
+                        if recs[r] is not None:
+                            self._store(target[r], *recs[r])
+            for row_no, vals in sent.items():
+                rec = self._load(target[row_no])
+                if rec is None:
+                    continue
+                core, extra, base, dirty = rec
+                cur = _joined(core, extra)
+                new_base = list(base) if base is not None else []
+                new_base += [""] * (len(vals) - len(new_base))
+                for col in (range(1, len(vals) + 1) if base is None else dirty):
+                    if col <= len(vals):
+                        new_base[col - 1] = vals[col - 1]
+                # Cells edited again while the batch was in flight stay dirty for the next push.
+                width = max(len(cur), len(new_base))
+                cur += [""] * (width - len(cur))
+                new_base += [""] * (width - len(new_base))
+                still = {col for col in range(1, width + 1) if cur[col - 1] != new_base[col - 1]}
+                self._store(target[row_no], core, extra, new_base, still)
+            self._set_meta("sheet_rows", max(int(self._meta("sheet_rows", "1")), max(target.values())))
+            self._set_meta("pushed_at", time.time())
+        record_metric("sqlite_push", ok=True, latency_ms=int((time.perf_counter() - t0) * 1000), rows=len(sent), ranges=len(data))
+        return len(sent)
+
+    def sync(self) -> dict:
+        """One round: pull operator edits first (so appends land past the real tail), then push."""
+        pulled = self.pull()
+        pushed = self.push()
+        return {"pulled": pulled, "pushed": pushed, "pending": self.pending_changes()}
@@ -0,0 +1,32 @@
+import pytest
+
+from domain import audit, company_index, idempotency, metrics, resilience, search_index
+
+
+@pytest.fixture(autouse=True)
+def _isolated_indexes(tmp_path, monkeypatch):
+    # Handler tests write through to the search, company, soft-duplicate and image-hash indexes; keep them out of DATA_DIR.
+    monkeypatch.setattr(search_index, "INDEX_FILE", tmp_path / "search_index.jsonl")
+    monkeypatch.setattr(search_index, "_LOADED", False)
+    monkeypatch.setattr(search_index, "_INDEXES", {})
+    monkeypatch.setattr(search_index, "_SYNCED_AT", {})
+    monkeypatch.setattr(company_index, "INDEX_FILE", tmp_path / "company_index.json")
+    monkeypatch.setattr(company_index, "_LOADED", False)
+    for name, value in (("_COUNTS", company_index.Counter()), ("_ALIASES", {}), ("_NORM", {}), ("_BY_NORM", {}), ("_GRAMS", {}), ("_GRAM_COUNT", {})):
+        monkeypatch.setattr(company_index, name, value)
+    monkeypatch.setattr(company_index, "_DIRTY", False)
+    monkeypatch.setattr(company_index, "_SAVED_AT", 0.0)
+    monkeypatch.setattr(resilience, "BREAKERS_FILE", tmp_path / "breaker_states.json")
+    monkeypatch.setattr(idempotency, "_SOFT_INDEX_FILE", tmp_path / "soft_dup_index.json")
+    monkeypatch.setattr(idempotency, "_PHASH_INDEX_FILE", tmp_path / "phash_index.json")
+    # Metric and audit lines from the handlers under test stay out of data/ and logs/.
+    monkeypatch.setattr(metrics, "_EVENTS_FILE", tmp_path / "metrics_events.jsonl")
+    monkeypatch.setattr(metrics, "_counts", {})
+    monkeypatch.setattr(audit, "_AUDIT_FILE", tmp_path / "audit.jsonl")
+
+
+@pytest.fixture(autouse=True)
+def _closed_circuits():
+    for b in resilience._BREAKERS.values():
+        b.reset()
+    yield
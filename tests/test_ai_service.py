@@ -0,0 +1,83 @@
+import asyncio
+from types import SimpleNamespace
+
+import ai_service
+import ocr_service
+
+
+class _FakeCompletions:
+    def __init__(self):
+        self.active = 0
+        self.peak = 0
+
+    async def create(self, **kwargs):
+        self.active += 1
+        self.peak = max(self.peak, self.active)
+        await asyncio.sleep(0.05)
+        self.active -= 1
+        msg = SimpleNamespace(content='{"gross": "10.00"}')
+        return SimpleNamespace(choices=[SimpleNamespace(message=msg)])
+
+
+def test_chat_json_is_bounded_and_does_not_block_the_loop(monkeypatch):
+    completions = _FakeCompletions()
+    metrics = []
+    monkeypatch.setattr(ai_service, "ai_available", lambda: True)
+    monkeypatch.setattr(ai_service, "_client", lambda: SimpleNamespace(chat=SimpleNamespace(completions=completions)))
+    monkeypatch.setattr(ai_service, "AI_MAX_CONCURRENCY", 1)
+    monkeypatch.setattr(ai_service, "record_metric", lambda name, **kw: metrics.append((name, kw)))
+
+    async def scenario():
+        ticks = []
+
+        async def other_user():
+            for _ in range(5):
+                ticks.append(1)
+                await asyncio.sleep(0.01)
+
+        results = await asyncio.gather(
+            ai_service.chat_json("s", "u", op="t"),
+            ai_service.chat_json("s", "u", op="t"),
+            other_user(),
+        )
+        return results, ticks
+
+    (first, second, _), ticks = asyncio.run(scenario())
+    assert first == second == {"gross": "10.00"}
+    assert completions.peak == 1
+    assert len(ticks) == 5
+    calls = [kw for name, kw in metrics if name == "ai_call"]
+    assert len(calls) == 2 and all(kw["ok"] for kw in calls)
+    assert max(kw["wait_ms"] for kw in calls) >= 40
+
+
+def test_extract_fields_skips_ai_when_gross_and_company_found(monkeypatch):
+    async def boom(text):
+        raise AssertionError("AI called")
+
+    monkeypatch.setattr(ocr_service, "ai_refine_ocr", boom)
+    text = "Sprzedawca: Danex\nDo zaplaty: 99,00 PLN"
+    fields = asyncio.run(ocr_service.extract_fields(text))
+    assert fields["company"] == "Danex" and fields["gross"] == "99.00"
+
+
+def test_ai_refine_reuses_answer_for_same_normalised_text(tmp_path, monkeypatch):
+    from domain import ocr_cache, rag_bridge
+
+    calls = []
+
+    async def fake_chat(system, user, op):
+        calls.append(op)
+        return {"company": "Danex"}
+
+    async def no_context(text, scope=None):
+        return ""
+
+    monkeypatch.setattr(ocr_cache, "_CACHE_DIR", tmp_path)
+    monkeypatch.setattr(ocr_cache, "record_metric", lambda *a, **kw: None)
+    monkeypatch.setattr(ai_service, "ai_available", lambda: True)
+    monkeypatch.setattr(ai_service, "chat_json", fake_chat)
+    monkeypatch.setattr(rag_bridge, "get_smart_context_for_invoice", no_context)
+    assert asyncio.run(ocr_service.ai_refine_ocr("Faktura  DANEX\n")) == {"company": "Danex"}
+    assert asyncio.run(ocr_service.ai_refine_ocr("faktura danex")) == {"company": "Danex"}
+    assert calls == ["ocr_refine"]
@@ -0,0 +1,53 @@
+from domain import company_index
+from domain.smart_logic import fuzzy_match_company
+
+
+def _fresh(tmp_path, monkeypatch):
+    monkeypatch.setattr(company_index, "INDEX_FILE", tmp_path / "company_index.json")
+    monkeypatch.setattr(company_index, "_LOADED", False)
+    for name, value in (("_COUNTS", company_index.Counter()), ("_ALIASES", {}), ("_NORM", {}), ("_BY_NORM", {}), ("_GRAMS", {}), ("_GRAM_COUNT", {})):
+        monkeypatch.setattr(company_index, name, value)
+
+
+def test_fuzzy_match_uses_trigram_index(tmp_path, monkeypatch):
+    _fresh(tmp_path, monkeypatch)
+    rows = [["h"], ["", "", "Biedronka"], ["", "", "Biedronka"], ["", "", "Orlen S.A."], ["", "", "Castorama Polska Sp. z o.o."]]
+    company_index.seed_from_rows(rows, 3)
+
+    assert fuzzy_match_company("Biedronk") == "Biedronka"
+    assert fuzzy_match_company("ORLEN") == "Orlen S.A."
+    assert fuzzy_match_company("castorama polska") == "Castorama Polska Sp. z o.o."
+    assert fuzzy_match_company("Zupelnie inna firma") is None
+    assert company_index.top(2) == ["Biedronka", "Orlen S.A."]
+
+
+def test_operator_correction_becomes_alias_and_persists(tmp_path, monkeypatch):
+    _fresh(tmp_path, monkeypatch)
+    company_index.observe("Hurtownia Danex")
+    company_index.learn_alias("HURTVV0NIA DAMEX", "Hurtownia Danex")
+
+    _fresh(tmp_path, monkeypatch)
+    assert company_index.resolve("hurtvv0nia  damex") == "Hurtownia Danex"
+    assert company_index.resolve("Hurtownia Danex sp. z o.o.") == "Hurtownia Danex"
+
+
+def test_known_companies_are_matched_without_joining_the_index():
+    company_index.observe("Biedronka")
+
+    assert fuzzy_match_company("Castorma", known_companies=["Castorama", "Leroy Merlin"]) == "Castorama"
+    assert fuzzy_match_company("Biedronk", known_companies=["Leroy Merlin"]) is None
+    assert fuzzy_match_company("Castorma") is None
+    assert company_index.top(5) == ["Biedronka"]
+
+
+def test_observe_batches_writes_until_flush(monkeypatch):
+    company_index.observe("Orlen")
+    saved = company_index.INDEX_FILE.read_text(encoding="utf-8")
+    for _ in range(20):
+        company_index.observe("Orlen")
+    assert company_index.INDEX_FILE.read_text(encoding="utf-8") == saved
+
+    company_index.flush()
+    monkeypatch.setattr(company_index, "_LOADED", False)
+    monkeypatch.setattr(company_index, "_COUNTS", company_index.Counter())
+    assert company_index.top(1) == ["Orlen"] and company_index._COUNTS["Orlen"] == 21
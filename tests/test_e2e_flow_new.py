@@ -69,23 +69,23 @@ def test_e2e_upload_to_export_to_reminder():
         patch.object(files, "is_allowed", return_value=True),
         patch.object(files, "is_operator", return_value=True),
         patch.object(files, "setup_tesseract", return_value=None),
-        patch.object(files, "ocr_image", return_value="OCR"),
+        patch.object(files, "check_image_quality", AsyncMock(return_value=(True, ""))),
+        patch.object(files, "ocr_file", AsyncMock(return_value=("OCR", "raster"))),
         patch.object(files, "extract_fields", return_value={
             "date": "2026-02-17",
             "no": "FV/1/2026",
             "company": "Danex",
             "gross": "123,45",
         }),
-        patch.object(files, "sha256_file", return_value="hash-1"),
+        patch.object(files, "_download_hashed", AsyncMock(return_value="hash-1")),
         patch.object(files, "find_duplicate", return_value=None),
         patch.object(files, "find_duplicate_content", return_value=None),
         patch.object(files, "register_file_hash", return_value=None),
         patch.object(files, "register_content_hash", return_value=None),
         patch.object(files, "upload_to_drive", return_value="https://drive.example/fv"),
         patch.object(files, "_validate_saved_file", return_value=(True, "")),
-        patch.object(files, "next_row", return_value=42),
-        patch.object(files, "append_row", return_value=None),
-        patch.object(files, "get_all_values", return_value=[["h"], ["r"]]),
+        patch.object(files, "aappend_row", new_callable=AsyncMock, return_value=42),
+        patch.object(files, "aget_all_values", new_callable=AsyncMock, return_value=[["h"], ["r"]]),
         patch.object(files, "missing_fields", return_value=[]),
         patch.object(files, "user_label", return_value="tester"),
         patch.object(files, "INV_DIR", Path("C:/Users/syfsy/danex-faktury-bot/invoices")),
@@ -108,9 +108,9 @@ def test_e2e_upload_to_export_to_reminder():
     with (
         patch.object(callbacks, "is_allowed", return_value=True),
         patch.object(callbacks, "is_operator", return_value=True),
-        patch.object(callbacks, "get_row", return_value=row),
-        patch.object(callbacks, "update_cell", return_value=None),
-        patch.object(callbacks, "find_next_missing_price_in_month", return_value=None),
+        patch.object(callbacks, "aget_row", new_callable=AsyncMock, return_value=row),
+        patch.object(callbacks, "aupdate_cell", new_callable=AsyncMock, return_value=None),
+        patch.object(callbacks, "find_next_missing_price_in_month", new_callable=AsyncMock, return_value=None),
     ):
         run(callbacks.on_click(cb_update, SimpleNamespace()))
 
@@ -119,8 +119,8 @@ def test_e2e_upload_to_export_to_reminder():
     export_update = SimpleNamespace(effective_user=SimpleNamespace(id=uid), message=export_msg)
     with (
         patch.object(commands, "is_operator", return_value=True),
-        patch.object(commands, "build_month_zip", return_value=(b"zip", "exp.zip")),
-        patch.object(commands, "compute_month_stats", return_value={"gross": 1.0, "net": 1.0, "vat": 0.0, "todo": [], "todo_missing_price": []}),
+        patch.object(commands, "build_month_zip", new_callable=AsyncMock, return_value=(b"zip", "exp.zip")),
+        patch.object(commands, "compute_month_stats", new_callable=AsyncMock, return_value={"gross": 1.0, "net": 1.0, "vat": 0.0, "todo": [], "todo_missing_price": []}),
     ):
         run(commands.cmd_export(export_update, SimpleNamespace(args=["2026-02"])))
     assert export_msg.reply_document.await_count == 1
@@ -128,8 +128,8 @@ def test_e2e_upload_to_export_to_reminder():
     # reminder command flow
     with (
         patch.object(reminders, "admin_ids", return_value={uid}),
-        patch.object(reminders, "get_all_values", return_value=[["h"], ["r"]]),
-        patch.object(reminders, "compute_month_stats", return_value={"todo": [2], "todo_missing_price": [], "ok": 1, "sent": 0}),
+        patch.object(reminders, "aget_all_values", new_callable=AsyncMock, return_value=[["h"], ["r"]]),
+        patch.object(reminders, "compute_month_stats", new_callable=AsyncMock, return_value={"todo": [2], "todo_missing_price": [], "ok": 1, "sent": 0}),
         patch.object(reminders, "today_ym", return_value="2026-02"),
     ):
         run(reminders._send_todo_reminder(fake_context))
@@ -183,10 +183,10 @@ def test_mama_kwota_ok_sets_status_when_complete():
     with (
         patch.object(messages, "is_allowed", return_value=True),
         patch.object(messages, "is_mama", return_value=True),
-        patch.object(messages, "get_row", return_value=row),
-        patch.object(messages, "_find_next_after", return_value=None),
+        patch.object(messages, "aget_row", new_callable=AsyncMock, return_value=row),
+        patch.object(messages, "_find_next_after", new_callable=AsyncMock, return_value=None),
         patch.object(messages, "missing_fields", return_value=[]),
-        patch.object(messages, "update_cell", return_value=None) as upd,
+        patch.object(messages, "aupdate_cell", new_callable=AsyncMock, return_value=None) as upd,
     ):
         run(messages.on_text(update, SimpleNamespace()))
 
@@ -19,6 +19,10 @@ def test_calc_net_vat_from_type_no_vat():
 
 
 def test_compute_month_stats_and_next_missing_price():
+    import asyncio
+
+    from domain.columns import project
+
     update = SimpleNamespace(effective_user=SimpleNamespace(id=111))
     sheet = [
         ["data", "numer", "firma", "brutto", "typ", "vat", "netto", "kat", "user", "status", "plik"],
@@ -27,9 +31,12 @@ def test_compute_month_stats_and_next_missing_price():
         ["2026-01-31", "FV3", "C", "50,00", "BEZ VAT", "0,00", "50,00", "inne", "u", callbacks.STATUS_OK, "l3"],
     ]
 
-    with patch.object(callbacks, "get_all_values", return_value=sheet):
-        stats = callbacks.compute_month_stats(update, "2026-02")
-        nxt = callbacks.find_next_missing_price_in_month(update, "2026-02")
+    async def _columns(update, cols, month=None):
+        return project(sheet[1:], cols, month)
+
+    with patch.object(callbacks, "aget_columns", side_effect=_columns):
+        stats = asyncio.run(callbacks.compute_month_stats(update, "2026-02"))
+        nxt = asyncio.run(callbacks.find_next_missing_price_in_month(update, "2026-02"))
 
     assert round(stats["gross"], 2) == 123.00
     assert stats["ok"] == 1
@@ -57,9 +64,9 @@ def test_callback_sent_updates_status_with_correct_signature():
     with (
         patch.object(callbacks, "is_allowed", return_value=True),
         patch.object(callbacks, "is_operator", return_value=True),
-        patch.object(callbacks, "get_row", return_value=row),
-        patch.object(callbacks, "update_cell", return_value=None) as update_cell_mock,
-        patch.object(callbacks, "find_next_missing_price_in_month", return_value=None),
+        patch.object(callbacks, "aget_row", new_callable=AsyncMock, return_value=row),
+        patch.object(callbacks, "aupdate_cell", new_callable=AsyncMock, return_value=None) as update_cell_mock,
+        patch.object(callbacks, "find_next_missing_price_in_month", new_callable=AsyncMock, return_value=None),
     ):
         import asyncio
 
@@ -81,15 +88,54 @@ def test_health_alert_due_cooldown_behavior():
     assert commands._health_alert_due("degraded") is True
     assert commands._health_alert_due("degraded") is False
 
+
+def test_diag_runs_the_sheets_probe_off_the_event_loop():
+    import asyncio
+    import threading
+
+    threads = []
+
+    class FakeWorksheet:
+        title, row_count, col_count = "Arkusz1", 10, 27
+        cells = {"AA2": "x"}
+
+        def row_values(self, row):
+            threads.append(threading.current_thread())
+            return ["Data", "Nr"]
+
+        def acell(self, a1):
+            return SimpleNamespace(value=self.cells.get(a1))
+
+        def update_acell(self, a1, value):
+            self.cells[a1] = value
+
+    message = SimpleNamespace(reply_text=AsyncMock())
+    update = SimpleNamespace(effective_user=SimpleNamespace(id=1), message=message)
+    sheet = FakeWorksheet()
+    with (
+        patch.object(commands, "is_allowed", return_value=True),
+        patch.object(commands, "get_storage", return_value=type("SheetsStorage", (), {})()),
+        patch.object(commands, "aget_all_values", AsyncMock(return_value=[])),
+        patch.object(commands, "ws", return_value=sheet),
+    ):
+        asyncio.run(commands.cmd_diag(update, SimpleNamespace(args=["rw"])))
+
+    text = message.reply_text.await_args.args[0]
+    assert "sheets_conn: OK" in text and "rw_probe_cell: AA2" in text and "rw_write_ok: yes" in text
+    assert sheet.cells["AA2"] == "x"
+    assert threads and threads[0] is not threading.main_thread()
+
 def test_mama_human_todo_rows_are_readable():
+    import asyncio
+
     update = SimpleNamespace(effective_user=SimpleNamespace(id=111))
     sheet = [
         ["data", "numer", "firma", "brutto", "typ", "vat", "netto", "kat", "user", "status", "plik"],
         ["2026-02-17", "FV-1", "Biedronka", "", "VAT", "", "", "inne", "u", messages.STATUS_TODO, "l1"],
     ]
 
-    with patch.object(messages, "get_all_values", return_value=sheet):
-        items = messages._human_todo_rows(update, "2026-02")
+    with patch.object(messages, "aget_all_values", new_callable=AsyncMock, return_value=sheet):
+        items = asyncio.run(messages._human_todo_rows(update, "2026-02"))
 
     assert items
     assert items[0][0] == 2
@@ -115,13 +161,21 @@ def test_mama_undo_restores_last_action():
     )
 
     with (
-        patch.object(messages, "update_cell", return_value=None) as update_cell_mock,
-        patch.object(messages, "get_row", return_value=[""] * messages.COL_FILE),
+        patch.object(messages, "aupdate_cells", new_callable=AsyncMock, return_value=None) as update_cells_mock,
+        patch.object(messages, "aget_row", new_callable=AsyncMock, return_value=[""] * messages.COL_FILE),
     ):
         handled = asyncio.run(messages._handle_mama_text(update, SimpleNamespace(bot=SimpleNamespace(send_message=AsyncMock())), "cofnij"))
 
     assert handled is True
-    assert update_cell_mock.call_count == 4
+    assert update_cells_mock.call_count == 1
+    _, row_no, cells = update_cells_mock.call_args.args
+    assert row_no == 7
+    assert cells == {
+        messages.COL_GROSS: "10.00",
+        messages.COL_NET: "8.13",
+        messages.COL_VAT: "1.87",
+        messages.COL_STATUS: messages.STATUS_TODO,
+    }
     assert uid not in messages.MAMA_UNDO
 
 def test_parse_spoken_amount_polish_words():
@@ -149,3 +203,40 @@ def test_mama_on_voice_transcribes_and_routes():
         asyncio.run(messages.on_voice(update, ctx))
 
     assert handle_mock.await_count == 1
+
+
+def test_set_price_writes_all_cells_in_one_call():
+    import asyncio
+
+    uid = 4242
+    messages.STATE[uid] = {"mode": "set_price", "row": "5", "month": "2026-02"}
+    update = SimpleNamespace(
+        effective_user=SimpleNamespace(id=uid),
+        message=SimpleNamespace(text="123,00", reply_text=AsyncMock()),
+    )
+    row = [""] * messages.COL_FILE
+    row[messages.COL_DATE - 1] = "2026-02-17"
+    row[messages.COL_TYPE - 1] = "VAT"
+
+    with (
+        patch.object(messages, "is_allowed", return_value=True),
+        patch.object(messages, "is_operator", return_value=True),
+        patch.object(messages, "is_mama", return_value=False),
+        patch.object(messages, "_handle_mama_text", new=AsyncMock(return_value=False)),
+        patch.object(messages, "aget_row", new_callable=AsyncMock, return_value=row),
+        patch.object(messages, "aupdate_cell", new_callable=AsyncMock) as update_cell_mock,
+        patch.object(messages, "aupdate_cells", new_callable=AsyncMock, return_value=None) as update_cells_mock,
+    ):
+        asyncio.run(messages.on_text(update, SimpleNamespace()))
+
+    assert update_cell_mock.call_count == 0
+    update_cells_mock.assert_called_once_with(
+        update,
+        5,
+        {
+            messages.COL_GROSS: "123.00",
+            messages.COL_NET: "100.00",
+            messages.COL_VAT: "23.00",
+            messages.COL_STATUS: messages.STATUS_OK,
+        },
+    )
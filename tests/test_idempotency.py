@@ -0,0 +1,86 @@
+from domain import idempotency
+from domain.smart_logic import is_soft_duplicate
+
+
+def test_soft_duplicate_index_reports_real_row_and_honours_tolerance(monkeypatch):
+    idempotency.register_soft_duplicate("2026-02-17", "1 234,56", "Hurtownia Danex Sp. z o.o.", row_no=42)
+
+    assert idempotency.find_soft_duplicate("2026-02-17", "1234.56", "HURTOWNIA DANEX")["row_no"] == 42
+    assert idempotency.find_soft_duplicate("2026-02-17", "1234.56", "Orlen") is None
+    assert idempotency.find_soft_duplicate("2026-02-18", "1234.56", "Hurtownia Danex") is None
+
+    monkeypatch.setattr(idempotency, "SOFT_DUP_DATE_TOLERANCE_DAYS", 1)
+    monkeypatch.setattr(idempotency, "SOFT_DUP_AMOUNT_TOLERANCE", 0.05)
+    assert idempotency.find_soft_duplicate("2026-02-18", "1234.60", "Hurtownia Danex")["row_no"] == 42
+    assert idempotency.find_soft_duplicate("2026-02-19", "1234.56", "Hurtownia Danex") is None
+
+
+def test_soft_index_is_seeded_from_sheet_rows_once():
+    rows = [["data", "nr", "firma", "brutto"], ["2026-02-01", "FV/1", "Orlen", "100.00"], ["2026-02-02", "FV/2", "Lidl", "55,10"]]
+    calls = []
+
+    def load():
+        calls.append(1)
+        return rows
+
+    idempotency.seed_soft_index(load, 1, 4, 3)
+    idempotency.seed_soft_index(load, 1, 4, 3)
+    assert calls == [1]
+    assert idempotency.find_soft_duplicate("2026-02-02", "55.10", "Lidl")["row_no"] == 3
+
+    found, msg = is_soft_duplicate({"date": "2026-02-02", "gross": "55.10", "company": "Lidl"}, rows)
+    assert found and "wiersz 3" in msg
+
+
+def test_second_photo_of_same_invoice_is_a_near_duplicate(tmp_path):
+    import random
+
+    from PIL import Image, ImageDraw, ImageEnhance
+
+    import ocr_service
+
+    rng = random.Random(3)
+    page = Image.new("L", (900, 1200), 235)
+    draw = ImageDraw.Draw(page)
+    for _ in range(60):
+        x, y = rng.randrange(0, 800), rng.randrange(0, 1150)
+        draw.rectangle((x, y, x + rng.randrange(30, 100), y + 12), fill=rng.randrange(0, 120))
+    page.save(tmp_path / "first.jpg", quality=90)
+    # Re-shot: slightly brighter, a few pixels off and recompressed.
+    ImageEnhance.Brightness(page.crop((6, 4, 900, 1200)).resize((900, 1200))).enhance(1.08).save(tmp_path / "second.jpg", quality=70)
+
+    first = ocr_service.image_dhash(tmp_path / "first.jpg")
+    idempotency.register_image_hash(first, row_no=17)
+
+    near = idempotency.find_near_duplicate_image(ocr_service.image_dhash(tmp_path / "second.jpg"))
+    assert near["row_no"] == 17 and near["distance"] <= idempotency.PHASH_MAX_DISTANCE
+    assert idempotency.find_near_duplicate_image(first ^ 0xFFFF_0000_0000_0000) is None
+    assert idempotency.find_near_duplicate_image(None) is None
+
+
+def test_bk_tree_matches_brute_force():
+    import random
+
+    rng = random.Random(11)
+    hashes = [rng.getrandbits(64) for _ in range(2000)]
+    tree = idempotency._BKTree()
+    for h in hashes:
+        tree.add(h)
+    for _ in range(50):
+        q = rng.choice(hashes) ^ (1 << rng.randrange(64)) ^ (1 << rng.randrange(64))
+        brute = min((h ^ q).bit_count() for h in hashes)
+        hit = tree.nearest(q, 6)
+        assert hit is not None and hit[1] == brute
+
+
+def test_soft_hit_is_checked_against_the_row_it_points_to():
+    idempotency.register_soft_duplicate("2026-02-17", "100.00", "Orlen", row_no=5)
+    idempotency.register_soft_duplicate("2026-02-17", "100.00", "Orlen Paliwa", row_no=9)
+    orlen = ["2026-02-17", "FV/1", "Orlen", "100.00"]
+    assert idempotency.soft_row_matches(orlen, "2026-02-17", "100", "ORLEN", 1, 4, 3)
+    # The sheet was sorted: row 5 now holds another invoice.
+    assert not idempotency.soft_row_matches(["2026-01-03", "FV/9", "Lidl", "12.00"], "2026-02-17", "100", "Orlen", 1, 4, 3)
+
+    stale = idempotency.find_soft_duplicate("2026-02-17", "100", "Orlen")
+    idempotency.forget_soft_duplicate(stale)
+    assert idempotency.find_soft_duplicate("2026-02-17", "100", "Orlen")["row_no"] != stale["row_no"]
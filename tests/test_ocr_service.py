@@ -0,0 +1,280 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import ocr_service
+
+
+def _slow(value):
+    time.sleep(0.2)
+    return value
+
+
+def test_ocr_submit_rejects_jobs_beyond_queue_limit(monkeypatch):
+    pool = ThreadPoolExecutor(max_workers=1)
+    metrics = []
+    monkeypatch.setattr(ocr_service, "_pool", lambda: pool)
+    monkeypatch.setattr(ocr_service, "OCR_WORKERS", 1)
+    monkeypatch.setattr(ocr_service, "OCR_QUEUE_LIMIT", 1)
+    monkeypatch.setattr(ocr_service, "record_metric", lambda name, **kw: metrics.append((name, kw)))
+
+    async def scenario():
+        jobs = [asyncio.create_task(ocr_service._submit("image", _slow, i)) for i in range(3)]
+        return await asyncio.gather(*jobs, return_exceptions=True)
+
+    try:
+        first, second, third = asyncio.run(scenario())
+    finally:
+        pool.shutdown(wait=True)
+
+    assert (first, second) == (0, 1)
+    assert isinstance(third, ocr_service.OcrBusyError)
+    assert ocr_service.ocr_queue_depth() == 0
+    waits = [kw["latency_ms"] for name, kw in metrics if name == "ocr_queue_wait" and kw["ok"]]
+    assert len(waits) == 2 and max(waits) >= 150
+    assert sum(1 for name, _ in metrics if name == "ocr_exec") == 2
+
+
+def test_ocr_pdf_uses_text_layer_without_tesseract(tmp_path, monkeypatch):
+    import fitz
+
+    pdf = tmp_path / "fv.pdf"
+    doc = fitz.open()
+    page = doc.new_page()
+    page.insert_text((72, 100), "Faktura VAT nr FV/12/2026 z dnia 2026-02-17")
+    page.insert_text((72, 130), "Sprzedawca: Hurtownia Danex Sp. z o.o.")
+    page.insert_text((72, 160), "Do zaplaty:")
+    page.insert_text((300, 160), "123,45 PLN")
+    doc.save(pdf)
+    doc.close()
+
+    monkeypatch.setattr(ocr_service, "ocr_image", lambda path: (_ for _ in ()).throw(AssertionError("raster")))
+    text, path = ocr_service._ocr_file(pdf, True)
+    assert path == "text"
+    assert "Do zaplaty: 123,45 PLN" in text
+
+
+def test_scanned_pdf_page_is_rendered_in_memory(tmp_path, monkeypatch):
+    import fitz
+
+    pdf = tmp_path / "scan.pdf"
+    doc = fitz.open()
+    doc.new_page(width=595, height=842)
+    doc.save(pdf)
+    doc.close()
+
+    seen = []
+    monkeypatch.setattr(ocr_service, "_ocr_pil", lambda img: seen.append(img.size) or "OCR")
+    text, path = ocr_service._ocr_file(pdf, True)
+    assert (text, path) == ("OCR", "raster")
+    assert max(seen[0]) in range(2900, 3100)
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["scan.pdf"]
+
+
+def test_ocr_file_second_run_is_served_from_cache(tmp_path, monkeypatch):
+    from domain import ocr_cache
+
+    monkeypatch.setattr(ocr_cache, "_CACHE_DIR", tmp_path / "cache")
+    monkeypatch.setattr(ocr_cache, "OCR_CACHE_MAX_MB", 50)
+    monkeypatch.setattr(ocr_cache, "record_metric", lambda *a, **kw: None)
+    img = tmp_path / "photo.jpg"
+    img.write_bytes(b"jpeg-bytes")
+    runs = []
+
+    async def fake_submit(kind, fn, path, is_pdf):
+        runs.append(kind)
+        return "Sprzedawca: Danex", "raster"
+
+    monkeypatch.setattr(ocr_service, "_submit", fake_submit)
+    first = asyncio.run(ocr_service.ocr_file(img, False))
+    second = asyncio.run(ocr_service.ocr_file(img, False))
+    assert first == ("Sprzedawca: Danex", "raster")
+    assert second == ("Sprzedawca: Danex", "cache")
+    assert runs == ["image"]
+
+    key = ocr_service.ocr_cache_key(ocr_cache.file_sha256(img), False)
+    assert key != ocr_service.ocr_cache_key(ocr_cache.file_sha256(img), True)
+    ocr_cache.put(key, fields={"company": "Danex"})
+    assert asyncio.run(ocr_service.extract_fields("ignored", cache_key=key)) == {"company": "Danex"}
+
+
+def test_ocr_cache_evicts_least_recently_used(tmp_path, monkeypatch):
+    import os
+
+    from domain import ocr_cache
+
+    monkeypatch.setattr(ocr_cache, "_CACHE_DIR", tmp_path)
+    monkeypatch.setattr(ocr_cache, "OCR_CACHE_MAX_MB", 2500 / (1024 * 1024))
+    monkeypatch.setattr(ocr_cache, "record_metric", lambda *a, **kw: None)
+    for i, key in enumerate(("a", "b")):
+        ocr_cache.put(key, text="x" * 1000)
+        os.utime(tmp_path / f"{key}.json", (1000 + i, 1000 + i))
+    assert ocr_cache.get("a", "text")  # touch: "b" becomes the oldest
+    ocr_cache.put("c", text="x" * 1000)
+    assert sorted(p.stem for p in tmp_path.glob("*.json")) == ["a", "c"]
+
+    # Below the limit a put only adds to the running total; the directory is not scanned.
+    monkeypatch.setattr(ocr_cache, "OCR_CACHE_MAX_MB", 50)
+    scans = []
+    monkeypatch.setattr(ocr_cache, "_evict", lambda: scans.append(1))
+    for key in "defg":
+        ocr_cache.put(key, text="x" * 1000)
+    assert scans == []
+
+
+def test_fields_are_not_cached_when_the_ai_fallback_failed(tmp_path, monkeypatch):
+    from domain import ocr_cache
+
+    monkeypatch.setattr(ocr_cache, "_CACHE_DIR", tmp_path)
+    monkeypatch.setattr(ocr_cache, "OCR_CACHE_MAX_MB", 50)
+    monkeypatch.setattr(ocr_cache, "record_metric", lambda *a, **kw: None)
+    answers = [None, {"company": "Danex"}]
+
+    async def refine(text, scope=None):
+        return answers.pop(0)
+
+    monkeypatch.setattr(ocr_service, "ai_refine_ocr", refine)
+    text = "Do zaplaty: 99,00 PLN"
+    assert not asyncio.run(ocr_service.extract_fields(text, cache_key="k")).get("company")
+    assert ocr_cache.get("k", "fields") is None
+    assert asyncio.run(ocr_service.extract_fields(text, cache_key="k"))["company"] == "Danex"
+    assert ocr_cache.get("k", "fields")["company"] == "Danex"
+
+
+def test_quality_check_and_recognition_share_one_engine_pass(tmp_path, monkeypatch):
+    from PIL import Image
+
+    img_path = tmp_path / "photo.png"
+    img = Image.new("L", (64, 64), 255)
+    for x in range(0, 64, 4):
+        for y in range(64):
+            img.putpixel((x, y), 0)
+    img.save(img_path)
+
+    calls = []
+
+    class FakeEngine:
+        def __init__(self, angle):
+            self.angle = angle
+
+        def recognize(self, img):
+            raise AssertionError("separate recognition pass")
+
+        def recognize_with_osd(self, img):
+            calls.append(img.size)
+            return "Do zaplaty 10,00", self.angle
+
+    monkeypatch.setattr(ocr_service, "_engine", lambda: FakeEngine(0))
+    assert ocr_service._image_quality(img_path) == (True, "", "Do zaplaty 10,00")
+
+    monkeypatch.setattr(ocr_service, "_engine", lambda: FakeEngine(180))
+    ok, msg, text = ocr_service._image_quality(img_path)
+    assert not ok and "krzywe" in msg and text is None
+    assert len(calls) == 2
+
+
+def test_pdf_pages_run_in_parallel_and_stop_once_fields_are_found(monkeypatch):
+    full_page = "Faktura nr FV/7/2026\nData wystawienia 2026-02-17\nSprzedawca: Danex\nDo zaplaty: 99,00 PLN"
+    delays = {0: 0.05, 1: 0.05, 2: 5.0}
+    finished = []
+
+    async def fake_submit(kind, fn, path, index, admitted=False):
+        await asyncio.sleep(delays[index])
+        finished.append(index)
+        return (full_page if index == 1 else f"strona {index}"), "raster"
+
+    monkeypatch.setattr(ocr_service, "_pdf_page_count", lambda path: 3)
+    monkeypatch.setattr(ocr_service, "_submit", fake_submit)
+    monkeypatch.setattr(ocr_service, "record_metric", lambda *a, **kw: None)
+
+    t0 = time.perf_counter()
+    text, mode, complete = asyncio.run(ocr_service._ocr_pdf_parallel("fv.pdf"))
+    assert time.perf_counter() - t0 < 1.0
+    assert sorted(finished) == [0, 1]
+    assert "Do zaplaty: 99,00 PLN" in text and mode == "raster"
+    assert not complete
+
+
+def test_early_exit_text_is_not_cached_as_the_whole_document(tmp_path, monkeypatch):
+    from domain import ocr_cache
+
+    monkeypatch.setattr(ocr_cache, "_CACHE_DIR", tmp_path / "cache")
+    monkeypatch.setattr(ocr_cache, "record_metric", lambda *a, **kw: None)
+    results = iter([("strona 1", "text", False), ("strona 1\n\nstrona 2", "text", True)])
+
+    async def fake_parallel(path):
+        return next(results)
+
+    monkeypatch.setattr(ocr_service, "_ocr_pdf_parallel", fake_parallel)
+    assert asyncio.run(ocr_service.ocr_file("fv.pdf", True, file_hash="abc")) == ("strona 1", "text")
+    assert asyncio.run(ocr_service.ocr_file("fv.pdf", True, file_hash="abc"))[1] == "text"
+    assert asyncio.run(ocr_service.ocr_file("fv.pdf", True, file_hash="abc")) == ("strona 1\n\nstrona 2", "cache")
+
+
+def test_cancelled_job_keeps_its_slot_until_the_worker_finishes(monkeypatch):
+    pool = ThreadPoolExecutor(max_workers=1)
+    monkeypatch.setattr(ocr_service, "_pool", lambda: pool)
+    monkeypatch.setattr(ocr_service, "record_metric", lambda *a, **kw: None)
+
+    async def scenario():
+        job = asyncio.ensure_future(ocr_service._submit("pdf_page", _slow, 1))
+        await asyncio.sleep(0.05)
+        job.cancel()
+        await asyncio.gather(job, return_exceptions=True)
+        busy = ocr_service.ocr_queue_depth()
+        await asyncio.sleep(0.3)
+        return busy, ocr_service.ocr_queue_depth()
+
+    try:
+        assert asyncio.run(scenario()) == (1, 0)
+    finally:
+        pool.shutdown(wait=True)
+
+
+def test_tesserocr_engine_stays_warm_and_reads_orientation_from_one_pass(monkeypatch):
+    import sys
+    from types import SimpleNamespace
+
+    created = []
+
+    class FakeApi:
+        def __init__(self, psm=None, lang=None):
+            created.append(lang)
+            self.images = []
+
+        def SetImage(self, img):
+            self.images.append(img)
+
+        def GetUTF8Text(self):
+            return f"tekst {len(self.images)}"
+
+        def AnalyseLayout(self):
+            return SimpleNamespace(Orientation=lambda: (2, 0, 0, 0.0))
+
+    fake = SimpleNamespace(PyTessBaseAPI=FakeApi, PSM=SimpleNamespace(AUTO_OSD=1), get_languages=lambda: ("/tessdata", ["eng", "pol"]))
+    monkeypatch.setitem(sys.modules, "tesserocr", fake)
+    monkeypatch.setattr(ocr_service, "_ENGINE", None)
+    monkeypatch.setattr(ocr_service, "_LANG", None)
+
+    engine = ocr_service._engine()
+    assert engine.name == "tesserocr" and ocr_service._engine() is engine
+    assert ocr_service._ocr_pil("img") == "tekst 1"
+    assert engine.recognize_with_osd("img") == ("tekst 2", 180)
+    assert created == ["pol"]
+
+
+def test_failed_language_probe_is_retried(monkeypatch):
+    answers = iter([RuntimeError("tesseract not found"), {"eng"}])
+
+    def probe():
+        got = next(answers)
+        if isinstance(got, Exception):
+            raise got
+        return got
+
+    monkeypatch.setattr(ocr_service, "_LANG", None)
+    monkeypatch.setattr(ocr_service, "_installed_langs", probe)
+    monkeypatch.setattr(ocr_service, "log_event", lambda *a, **kw: None)
+    assert ocr_service.ocr_lang() == ""
+    assert asyncio.run(ocr_service.aocr_lang()) == "eng"
+    assert ocr_service.ocr_lang() == "eng"
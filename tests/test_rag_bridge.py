@@ -0,0 +1,119 @@
+import asyncio
+import sys
+
+from domain import rag_bridge
+
+_FAKE_DEMO = '''
+import sys
+import time
+from pathlib import Path
+
+# Counts how often the "index" is loaded.
+_LOADS = Path(__file__).with_name("loads.txt")
+_LOADS.write_text(_LOADS.read_text() + "x" if _LOADS.exists() else "x")
+
+
+def main():
+    q = sys.argv[sys.argv.index("-q") + 1]
+    if q == "slow":
+        time.sleep(1.5)
+    if q.startswith("len:"):
+        # Only a correctly decoded query has the right length.
+        q = str(len(q))
+    print("loading...")
+    print("---RAG-START---")
+    print("Q: " + q)
+    print("A: echo " + q)
+    print("---RAG-END---")
+'''
+
+
+def _fake_project(tmp_path, monkeypatch):
+    (tmp_path / "rag_demo.py").write_text(_FAKE_DEMO, encoding="utf-8")
+    monkeypatch.setattr(rag_bridge, "RAG_PROJECT_DIR", tmp_path)
+    monkeypatch.setattr(rag_bridge, "RAG_PYTHON_EXE", __import__("pathlib").Path(sys.executable))
+    monkeypatch.setattr(rag_bridge, "RAG_SCRIPT", tmp_path / "rag_demo.py")
+    monkeypatch.setattr(rag_bridge, "LOGS_DIR", tmp_path)
+    monkeypatch.setattr(rag_bridge, "record_metric", lambda *a, **kw: None)
+    monkeypatch.setattr(rag_bridge, "log_event", lambda *a, **kw: None)
+    monkeypatch.setattr(rag_bridge, "_WORKER", rag_bridge._RagWorker())
+
+
+def test_worker_is_loaded_once_and_multiplexes_queries(tmp_path, monkeypatch):
+    _fake_project(tmp_path, monkeypatch)
+
+    async def scenario():
+        try:
+            answers = await asyncio.gather(*(rag_bridge.get_rag_context(f"q{i}") for i in range(5)))
+            health = await rag_bridge.rag_health()
+            return answers, health
+        finally:
+            await rag_bridge.shutdown_rag_worker()
+
+    answers, health = asyncio.run(scenario())
+    assert answers == [f"echo q{i}" for i in range(5)]
+    assert health["ok"] and health["state"] == "up"
+    assert (tmp_path / "loads.txt").read_text() == "x"
+
+
+def test_dead_worker_falls_back_then_restarts(tmp_path, monkeypatch):
+    _fake_project(tmp_path, monkeypatch)
+    monkeypatch.setattr(rag_bridge, "_RESTART_BACKOFF_SEC", 0)
+
+    async def scenario():
+        try:
+            first = await rag_bridge.get_rag_context("a")
+            rag_bridge._WORKER.proc.kill()
+            await rag_bridge._WORKER._reader
+            down = await rag_bridge.rag_health()
+            second = await rag_bridge.get_rag_context("b")
+            return first, down, second, rag_bridge._WORKER.restarts
+        finally:
+            await rag_bridge.shutdown_rag_worker()
+
+    first, down, second, restarts = asyncio.run(scenario())
+    assert first == "echo a" and second == "echo b"
+    assert down["ok"] is False and down["state"] == "down"
+    assert restarts == 1
+
+
+def test_health_check_does_not_kill_a_busy_worker(tmp_path, monkeypatch):
+    _fake_project(tmp_path, monkeypatch)
+    # What a Windows console gives the child by default; the protocol must stay UTF-8 anyway.
+    monkeypatch.setenv("PYTHONIOENCODING", "cp1252")
+
+    async def scenario():
+        try:
+            await rag_bridge.get_rag_context("warm")
+            pid = rag_bridge._WORKER.proc.pid
+            slow = asyncio.ensure_future(rag_bridge.get_rag_context("slow"))
+            await asyncio.sleep(0.1)
+            health = await rag_bridge.rag_health(timeout=0.3)
+            polish = await rag_bridge.get_rag_context("len:zażółć gęślą jaźń")
+            return await slow, health, polish, pid == rag_bridge._WORKER.proc.pid
+        finally:
+            await rag_bridge.shutdown_rag_worker()
+
+    slow, health, polish, same_worker = asyncio.run(scenario())
+    assert slow == "echo slow"
+    assert health["ok"] and health["state"] == "busy"
+    assert polish == "echo 21"
+    assert same_worker
+
+
+def test_missing_project_falls_back_to_builtin_index(tmp_path, monkeypatch):
+    monkeypatch.setattr(rag_bridge, "RAG_SCRIPT", tmp_path / "missing.py")
+    scopes = []
+
+    def context_for(q, scope):
+        scopes.append(scope)
+        return "[#7] Orlen" if q == "orlen" else ""
+
+    monkeypatch.setattr(rag_bridge.search_index, "context_for", context_for)
+    monkeypatch.setattr(rag_bridge.search_index, "STORAGE_BACKEND", "sheets")
+    assert asyncio.run(rag_bridge.get_rag_context("orlen")) == "[#7] Orlen"
+    assert asyncio.run(rag_bridge.get_rag_context("long prompt", local_query="nothing")) == ""
+    assert asyncio.run(rag_bridge.get_smart_context_for_invoice("Orlen", scope="ApiStorage:7")) == ""
+    monkeypatch.setattr(rag_bridge.search_index, "STORAGE_BACKEND", "sqlite")
+    assert asyncio.run(rag_bridge.get_rag_context("orlen")) == "[#7] Orlen"
+    assert scopes == ["SheetsStorage", "SheetsStorage", "ApiStorage:7", "SqliteStorage"]
@@ -0,0 +1,152 @@
+import asyncio
+from unittest.mock import AsyncMock, patch
+
+import pytest
+
+from domain import resilience
+
+
+class _HttpError(Exception):
+    def __init__(self, status):
+        super().__init__(f"HTTP {status}")
+        self.response = type("R", (), {"status_code": status})()
+
+
+def _failing(exc, calls):
+    def fn():
+        calls.append(1)
+        raise exc
+
+    return fn
+
+
+def test_breaker_opens_then_lets_one_probe_through(monkeypatch):
+    clock = [100.0]
+    monkeypatch.setattr(resilience.time, "monotonic", lambda: clock[0])
+    b = resilience.CircuitBreaker("t", failures=2, reset_sec=30)
+    b.record_failure()
+    b.before_call()
+    b.record_failure()
+    with pytest.raises(resilience.CircuitOpenError):
+        b.before_call()
+
+    clock[0] += 31
+    b.before_call()  # the probe
+    with pytest.raises(resilience.CircuitOpenError):
+        b.before_call()
+    b.record_success()
+    assert b.snapshot()["state"] == "closed"
+
+
+def test_retry_call_backs_off_off_the_loop_and_skips_client_errors(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(resilience.time, "sleep", sleeps.append)
+
+    calls = []
+    with pytest.raises(ConnectionError):
+        resilience.retry_call(_failing(ConnectionError("reset"), calls), "x", attempts=3, base_delay=0.5, breaker_name="sheets")
+    assert len(calls) == 3 and len(sleeps) == 2
+    assert all(0 <= d <= 1.0 for d in sleeps)
+    assert resilience.breaker("sheets").snapshot()["failures"] == 3
+
+    calls.clear()
+    with pytest.raises(_HttpError):
+        resilience.retry_call(_failing(_HttpError(400), calls), "x", attempts=3, breaker_name="sheets")
+    assert len(calls) == 1
+    assert resilience.breaker("sheets").snapshot()["failures"] == 0
+
+
+def test_retry_call_never_sleeps_on_the_event_loop(monkeypatch):
+    monkeypatch.setattr(resilience.time, "sleep", lambda d: pytest.fail("blocking sleep on the event loop"))
+    calls = []
+
+    async def handler():
+        resilience.retry_call(_failing(_HttpError(503), calls), "x", attempts=3)
+
+    with pytest.raises(_HttpError):
+        asyncio.run(handler())
+    assert len(calls) == 1
+
+
+def test_retry_async_uses_asyncio_sleep_and_fails_fast_when_open():
+    calls = []
+
+    async def flaky():
+        calls.append(1)
+        if len(calls) < 3:
+            raise TimeoutError()
+        return "ok"
+
+    with patch.object(resilience.asyncio, "sleep", AsyncMock()) as sleep:
+        assert asyncio.run(resilience.retry_async(flaky, "x", attempts=3, breaker_name="drive")) == "ok"
+    assert sleep.await_count == 2
+
+    for _ in range(resilience.breaker("drive").max_failures):
+        resilience.breaker("drive").record_failure()
+    calls.clear()
+    with pytest.raises(resilience.CircuitOpenError):
+        asyncio.run(resilience.retry_async(flaky, "x", breaker_name="drive"))
+    assert calls == []
+
+
+def test_cancelled_probe_hands_the_slot_back(monkeypatch):
+    b = resilience.breaker("api")
+    monkeypatch.setattr(b, "reset_sec", 0.0)
+    for _ in range(b.max_failures):
+        b.record_failure()
+
+    async def hang():
+        await asyncio.sleep(10)
+
+    async def scenario():
+        probe = asyncio.create_task(resilience.retry_async(hang, "x", breaker_name="api"))
+        await asyncio.sleep(0.01)
+        probe.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await probe
+
+        async def ok():
+            return "ok"
+
+        return await resilience.retry_async(ok, "x", breaker_name="api")
+
+    assert asyncio.run(scenario()) == "ok"
+    assert b.snapshot()["state"] == "closed"
+
+
+def test_bugs_are_not_retried_and_do_not_trip_the_breaker():
+    import httpx
+
+    assert resilience.is_transient(ConnectionError("reset"))
+    assert resilience.is_transient(TimeoutError())
+    assert resilience.is_transient(httpx.ConnectTimeout("slow"))
+    assert not resilience.is_transient(KeyError("gross"))
+    assert not resilience.is_transient(TypeError("bad arg"))
+
+    calls = []
+    b = resilience.breaker("sheets")
+    for _ in range(b.max_failures + 1):
+        with pytest.raises(KeyError):
+            resilience.retry_call(_failing(KeyError("gross"), calls), "x", breaker_name="sheets")
+    assert len(calls) == b.max_failures + 1
+    assert b.snapshot()["state"] == "closed" and b.snapshot()["failures"] == 0
+
+
+def test_breaker_state_is_saved_for_the_panel_process():
+    import json
+
+    b = resilience.breaker("api")
+    for _ in range(b.max_failures):
+        b.record_failure()
+    saved = resilience.saved_breaker_states()
+    assert saved["api"]["state"] == "open" and saved["api"]["trips"] >= 1
+    assert saved["sheets"]["state"] == "closed"
+
+    # Read later by the panel: the reset time has passed, so a probe would be let through.
+    data = json.loads(resilience.BREAKERS_FILE.read_text(encoding="utf-8"))
+    data["saved_at"] -= b.reset_sec + 1
+    resilience.BREAKERS_FILE.write_text(json.dumps(data), encoding="utf-8")
+    assert resilience.saved_breaker_states()["api"]["state"] == "half_open"
+
+    b.record_success()
+    assert resilience.saved_breaker_states()["api"]["state"] == "closed"
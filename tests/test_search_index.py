@@ -0,0 +1,82 @@
+from domain import search_index
+
+
+def _fresh(tmp_path, monkeypatch):
+    monkeypatch.setattr(search_index, "INDEX_FILE", tmp_path / "search_index.jsonl")
+    monkeypatch.setattr(search_index, "_LOADED", False)
+    monkeypatch.setattr(search_index, "_INDEXES", {})
+    monkeypatch.setattr(search_index, "_SYNCED_AT", {})
+
+
+def test_bm25_ranks_by_fields_and_ocr_text(tmp_path, monkeypatch):
+    _fresh(tmp_path, monkeypatch)
+    search_index.add_invoice(2, {"date": "2026-02-01", "company": "Orlen S.A.", "gross": "250.00"}, "Paliwo ON 40 l")
+    search_index.add_invoice(3, {"date": "2026-02-03", "company": "Żabka Polska", "gross": "12.99"}, "woda mineralna")
+    search_index.add_invoice(4, {"date": "2026-02-05", "company": "Orlen S.A.", "gross": "180.00"}, "myjnia")
+
+    assert [h["row_no"] for h in search_index.search("orlen")] == [4, 2]
+    assert search_index.search("ZABKA")[0]["row_no"] == 3
+    assert search_index.search("paliwo orlen")[0]["row_no"] == 2
+    assert search_index.search("12,99")[0]["company"] == "Żabka Polska"
+    assert "[#3]" in search_index.context_for("woda")
+
+
+def test_index_is_append_only_and_survives_reload(tmp_path, monkeypatch):
+    _fresh(tmp_path, monkeypatch)
+    search_index.add_invoice(2, {"company": "Danex"}, "dostawa plytek")
+    rows = [["h"], ["2026-02-01", "FV/1", "Danex Sp. z o.o.", "99.00"], ["2026-02-02", "FV/2", "Castorama", "10.00"]]
+    assert search_index.sync_rows(rows) == 2
+    assert search_index.sync_rows(rows) == 0
+    assert len((tmp_path / "search_index.jsonl").read_text(encoding="utf-8").splitlines()) == 3
+
+    _fresh(tmp_path, monkeypatch)
+    # Field updates from the sheet keep the OCR text indexed at upload time.
+    assert search_index.search("plytek")[0]["company"] == "Danex Sp. z o.o."
+    assert search_index.search("castorama")[0]["row_no"] == 3
+    assert search_index.text_for(2) == "dostawa plytek"
+    assert search_index.text_for(3) == "" and search_index.text_for(2, scope="other") == ""
+
+
+def test_ocr_text_follows_its_invoice_when_rows_move(tmp_path, monkeypatch):
+    _fresh(tmp_path, monkeypatch)
+    pge = ["2026-02-01", "E/1", "PGE", "310.00"]
+    orange = ["2026-02-03", "55/26", "Orange", "89.99"]
+    search_index.sync_rows([["h"], pge, orange])
+    search_index.attach_text(2, "pge prad")
+    search_index.attach_text(3, "orange abonament")
+
+    # Sorted newest first, then a row inserted on top.
+    fresh = ["2026-02-05", "FV/9", "Lidl", "12.00"]
+    search_index.sync_rows([["h"], fresh, orange, pge])
+    assert search_index.text_for(2) == ""
+    assert search_index.text_for(3) == "orange abonament"
+    assert search_index.text_for(4) == "pge prad"
+    assert search_index.search("abonament")[0]["row_no"] == 3
+
+    # Read before the next sync: the row's own values must match the indexed invoice.
+    assert search_index.text_for(4, row=orange) == ""
+    assert search_index.text_for(4, row=pge) == "pge prad"
+
+    # Correcting the number in place keeps the text.
+    search_index.sync_rows([["h"], fresh, orange, ["2026-02-01", "E/1/2026", "PGE", "310.00"]])
+    assert search_index.text_for(4) == "pge prad"
+
+
+def test_prefix_fuzzy_pagination_and_scopes(tmp_path, monkeypatch):
+    _fresh(tmp_path, monkeypatch)
+    for row_no in range(2, 14):
+        search_index.add_invoice(row_no, {"company": "Orlen S.A.", "gross": f"{row_no}0.00", "category": "paliwo"})
+    search_index.add_invoice(14, {"company": "Castorama", "category": "remont"})
+    search_index.add_invoice(2, {"company": "Tajne"}, scope="ApiStorage:7")
+
+    hits, total = search_index.search_page("orl", page=3, page_size=5)
+    assert total == 12 and [h["row_no"] for h in hits] == [3, 2]
+    assert search_index.search("castrama")[0]["row_no"] == 14  # one edit away
+    assert search_index.search("REMONT")[0]["company"] == "Castorama"
+    assert search_index.search("tajne") == []
+    assert search_index.search("tajne", scope="ApiStorage:7")[0]["row_no"] == 2
+
+    # Confirmed cell writes are mirrored without a resync.
+    search_index.update_cells(14, {search_index.COL_COMP: "Leroy Merlin"})
+    assert search_index.search("castorama") == []
+    assert search_index.search("merlin")[0]["row_no"] == 14
@@ -0,0 +1,132 @@
+import re
+
+import pytest
+
+import sheets_service
+
+HEADER = ["data", "numer", "firma", "brutto", "typ", "vat", "netto", "kat", "user", "status", "plik"]
+_RANGE_RE = re.compile(r"([A-Z]*)(\d+):([A-Z]*)(\d*)")
+
+
+def _col(letters: str) -> int:
+    n = 0
+    for ch in letters:
+        n = n * 26 + ord(ch) - 64
+    return n
+
+
+class FakeWs:
+    """Serves A1 ranges the way the Sheets API does: trailing empty rows and cells are dropped."""
+
+    def __init__(self, rows):
+        self.rows = [list(r) for r in rows]
+        self.full_reads = 0
+        self.cells_read = 0
+
+    def get_all_values(self):
+        self.full_reads += 1
+        self.cells_read += sum(len(r) for r in self.rows)
+        width = max(len(r) for r in self.rows)
+        return [list(r) + [""] * (width - len(r)) for r in self.rows]
+
+    def batch_get(self, ranges):
+        out = []
+        for rng in ranges:
+            c1, r1, c2, r2 = _RANGE_RE.fullmatch(rng).groups()
+            first, last = (_col(c1) - 1, _col(c2)) if c1 else (0, None)
+            block = [r[first:last] for r in self.rows[int(r1) - 1:int(r2) if r2 else None]]
+            block = [r[: max([i + 1 for i, v in enumerate(r) if v] or [0])] for r in block]
+            while block and not block[-1]:
+                block.pop()
+            self.cells_read += sum(len(r) for r in block)
+            out.append(block)
+        return out
+
+
+def _rows(n):
+    return [HEADER] + [[f"2026-02-{i % 28 + 1:02d}", f"FV{i}", f"Firma {i}", "10,00", "VAT", "", "", "inne", "u", "Nowa", ""] for i in range(n)]
+
+
+@pytest.fixture()
+def sheet(monkeypatch):
+    ws = FakeWs(_rows(50))
+    version = {"v": "1"}
+    monkeypatch.setattr(sheets_service, "ws", lambda: ws)
+    monkeypatch.setattr(sheets_service, "_drive_version", lambda: version["v"])
+    monkeypatch.setattr(sheets_service, "_delta", {"rows": None, "fps": [], "version": None, "full_at": 0.0})
+    monkeypatch.setattr(sheets_service, "_DELTA_WINDOW", 5)
+    monkeypatch.setattr(sheets_service, "SHEETS_DELTA_SYNC", True)
+    ws.version = version
+    return ws
+
+
+def test_unchanged_sheet_costs_no_reads(sheet):
+    assert sheets_service.get_all_values() == sheet.rows
+    cells = sheet.cells_read
+    assert sheets_service.get_all_values() == sheet.rows
+    assert sheet.cells_read == cells and sheet.full_reads == 1
+
+
+def test_delta_picks_up_appends_recent_and_watched_edits(sheet):
+    sheets_service.get_all_values()
+    full_cost = sheet.cells_read
+
+    sheet.rows.append(["2026-02-20", "FV-NEW", "Lidl", "5,00", "VAT", "", "", "inne", "u", "Nowa", ""])
+    sheet.rows[49][7] = "paliwo"  # inside the window
+    sheet.rows[3][9] = "Sprawdzona"  # old row, watched column
+    sheet.version["v"] = "2"
+    before = sheet.cells_read
+
+    assert sheets_service.get_all_values() == sheet.rows
+    assert sheet.full_reads == 1
+    assert sheet.cells_read - before < full_cost / 2
+
+
+def test_header_change_or_deleted_rows_force_full_read(sheet):
+    sheets_service.get_all_values()
+    del sheet.rows[10]
+    sheet.version["v"] = "2"
+    assert sheets_service.get_all_values() == sheet.rows
+    assert sheet.full_reads == 2
+
+    sheet.rows[0] = HEADER + ["notatka"]
+    sheet.version["v"] = "3"
+    assert sheets_service.get_all_values() == [r + [""] * (len(sheet.rows[0]) - len(r)) for r in sheet.rows]
+    assert sheet.full_reads == 3
+
+
+def test_get_columns_reads_only_requested_ranges(sheet):
+    row_nos, cols = sheets_service.get_columns([4, 10], month="2026-02-03")
+    assert row_nos == [i + 2 for i in range(50) if i % 28 + 1 == 3]
+    assert cols[4] == ["10,00"] * len(row_nos) and cols[10] == ["Nowa"] * len(row_nos)
+    assert sheet.full_reads == 0 and sheet.cells_read == 50 * 3
+
+    sheets_service.get_all_values()
+    cells = sheet.cells_read
+    assert sheets_service.get_columns([3])[1][3][0] == "Firma 0"
+    assert sheet.cells_read == cells
+
+
+def test_drive_version_is_fetched_outside_the_lock_and_old_rows_resync_in_minutes(sheet, monkeypatch):
+    def version():
+        assert not sheets_service._delta_lock.locked()
+        return sheet.version["v"]
+
+    monkeypatch.setattr(sheets_service, "_drive_version", version)
+    sheets_service.get_all_values()
+    sheet.rows[3][1] = "FV2/KOREKTA"  # old row, unwatched column
+    sheet.version["v"] = "2"
+    assert sheets_service.get_all_values()[3][1] == "FV2"
+
+    assert sheets_service.SHEETS_FULL_SYNC_SEC <= 600
+    sheets_service._delta["full_at"] -= sheets_service.SHEETS_FULL_SYNC_SEC
+    assert sheets_service.get_all_values()[3][1] == "FV2/KOREKTA"
+    assert sheets_service.get_columns([2])[1][2][2] == "FV2/KOREKTA"
+
+
+def test_forced_full_read_sees_unwatched_edits_at_once(sheet):
+    sheets_service.get_all_values()
+    sheet.rows[3][1] = "FV2/KOREKTA"
+    sheet.version["v"] = "2"
+    assert sheets_service.get_all_values(full=True)[3][1] == "FV2/KOREKTA"
+    assert sheet.full_reads == 2
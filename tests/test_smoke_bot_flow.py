@@ -36,7 +36,7 @@ def test_diag_command_sheets_smoke():
         patch.object(commands, "user_role", return_value="operator"),
         patch.object(commands, "get_storage", return_value=fake_storage),
         patch.object(commands, "ws", return_value=fake_ws),
-        patch.object(commands, "get_all_values", return_value=[["h"], ["1"]]),
+        patch.object(commands, "aget_all_values", new_callable=AsyncMock, return_value=[["h"], ["1"]]),
         patch.object(commands, "env", side_effect=lambda k, d="": "x" if k == commands.ENV_SHEET_ID else "Arkusz1"),
         patch.object(commands, "sa_path", return_value="C:/tmp/sa.json"),
         patch.object(commands.Path, "exists", return_value=True),
@@ -54,7 +54,7 @@ def test_health_command_admin_smoke():
     with (
         patch.object(commands, "is_admin", return_value=True),
         patch.object(commands, "get_storage", return_value=fake_storage),
-        patch.object(commands, "get_all_values", return_value=[["h1"], ["r1"]]),
+        patch.object(commands, "aget_all_values", new_callable=AsyncMock, return_value=[["h1"], ["r1"]]),
         patch.object(commands, "get_last_error", return_value={"at": None, "message": ""}),
         patch.object(commands, "error_count_last_24h", return_value=0),
     ):
@@ -105,23 +105,23 @@ def test_handle_file_add_invoice_smoke():
         patch.object(files, "is_allowed", return_value=True),
         patch.object(files, "is_operator", return_value=True),
         patch.object(files, "setup_tesseract", return_value=None),
-        patch.object(files, "ocr_image", return_value="OCR"),
+        patch.object(files, "check_image_quality", AsyncMock(return_value=(True, ""))),
+        patch.object(files, "ocr_file", AsyncMock(return_value=("OCR", "raster"))),
         patch.object(files, "extract_fields", return_value={
             "date": "2026-02-17",
             "no": "FV/1/2026",
             "company": "Danex",
             "gross": "123,45",
         }),
-        patch.object(files, "sha256_file", return_value="hash-1"),
+        patch.object(files, "_download_hashed", AsyncMock(return_value="hash-1")),
         patch.object(files, "find_duplicate", return_value=None),
         patch.object(files, "find_duplicate_content", return_value=None),
         patch.object(files, "register_file_hash", return_value=None),
         patch.object(files, "register_content_hash", return_value=None),
         patch.object(files, "upload_to_drive", return_value="https://drive.example/fv"),
         patch.object(files, "_validate_saved_file", return_value=(True, "")),
-        patch.object(files, "next_row", return_value=42),
-        patch.object(files, "append_row", return_value=None) as append_row_mock,
-        patch.object(files, "get_all_values", return_value=[["h"], ["r"]]),
+        patch.object(files, "aappend_row", new_callable=AsyncMock, return_value=42) as append_row_mock,
+        patch.object(files, "aget_all_values", new_callable=AsyncMock, return_value=[["h"], ["r"]]),
         patch.object(files, "missing_fields", return_value=[]),
         patch.object(files, "user_label", return_value="tester"),
         patch.object(files, "INV_DIR", Path("C:/Users/syfsy/danex-faktury-bot/invoices")),
@@ -130,3 +130,29 @@ def test_handle_file_add_invoice_smoke():
 
     assert append_row_mock.call_count == 1
 
+
+
+def test_handle_file_rejects_known_upload_before_download():
+    uid = 123457
+    files.STATE[uid] = {"mode": "add_wait_file", "inv_type": files.TYPE_VAT}
+
+    fake_bot = SimpleNamespace(get_file=AsyncMock())
+    fake_message = SimpleNamespace(
+        document=None,
+        photo=[SimpleNamespace(file_id="photo-file-id", file_unique_id="uniq-1")],
+        reply_text=AsyncMock(),
+    )
+    update = SimpleNamespace(effective_user=SimpleNamespace(id=uid), message=fake_message)
+
+    with (
+        patch.object(files, "is_allowed", return_value=True),
+        patch.object(files, "is_operator", return_value=True),
+        patch.object(files, "setup_tesseract", return_value=None),
+        patch.object(files, "find_duplicate_upload", return_value={"row_no": 42}),
+        patch.object(files, "ocr_file", AsyncMock()) as ocr_mock,
+    ):
+        run(files.handle_file(update, SimpleNamespace(bot=fake_bot)))
+
+    assert fake_bot.get_file.await_count == 0
+    assert ocr_mock.await_count == 0
+    assert "wiersz 42" in fake_message.reply_text.await_args.args[0]
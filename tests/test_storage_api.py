@@ -0,0 +1,194 @@
+from types import SimpleNamespace
+
+import httpx
+
+import storage_api
+
+
+def _update(uid=7):
+    return SimpleNamespace(effective_user=SimpleNamespace(id=uid))
+
+
+def _rowmap(n):
+    return {
+        "next_row": n + 2,
+        "row_to_invoice": {str(i + 2): 100 + i for i in range(n)},
+        "meta_by_invoice": {str(100 + i): {"company": f"Firma {i}"} for i in range(n)},
+    }
+
+
+def _invoice(inv_id):
+    return {"id": inv_id, "number": f"FV{inv_id}", "total_gross": 12.3, "status": "draft"}
+
+
+def test_get_all_values_reads_pages_not_rows(monkeypatch):
+    monkeypatch.setattr(storage_api, "_load_map", lambda uid: _rowmap(5))
+    monkeypatch.setattr(storage_api, "API_LIST_PAGE_SIZE", 2)
+    calls = []
+
+    def fake_req(method, path, json_body=None, params=None):
+        calls.append((path, params))
+        if path == "/api/v1/invoices":
+            ids = range(100 + params["skip"], min(105, 100 + params["skip"] + params["limit"]))
+            return [_invoice(i) for i in ids]
+        raise AssertionError(path)
+
+    st = storage_api.ApiStorage()
+    monkeypatch.setattr(st, "_req", fake_req)
+    rows = st.get_all_values(_update())
+    assert len(rows) == 6
+    assert rows[1][storage_api.COL_NO - 1] == "FV100"
+    assert rows[5][storage_api.COL_COMP - 1] == "Firma 4"
+    assert len(calls) == 3
+
+    # Served from the short-lived invoice cache, including a direct get_row.
+    st.get_all_values(_update())
+    assert st.get_row(_update(), 4)[storage_api.COL_NO - 1] == "FV102"
+    assert len(calls) == 3
+
+
+def test_get_all_values_falls_back_to_per_invoice_fetch(monkeypatch):
+    monkeypatch.setattr(storage_api, "_load_map", lambda uid: _rowmap(3))
+    monkeypatch.setattr(storage_api, "API_INVOICE_CACHE_TTL_SEC", 0)
+    fetched = []
+
+    def fake_req(method, path, json_body=None, params=None):
+        if path == "/api/v1/invoices":
+            resp = httpx.Response(405, request=httpx.Request("GET", "http://x" + path))
+            raise httpx.HTTPStatusError("nope", request=resp.request, response=resp)
+        inv_id = int(path.rsplit("/", 1)[1])
+        fetched.append(inv_id)
+        return _invoice(inv_id)
+
+    st = storage_api.ApiStorage()
+    monkeypatch.setattr(st, "_ensure", lambda: None)
+    monkeypatch.setattr(st, "_req", fake_req)
+    rows = st.get_all_values(_update())
+    assert [r[storage_api.COL_NO - 1] for r in rows[1:]] == ["FV100", "FV101", "FV102"]
+    assert sorted(fetched) == [100, 101, 102]
+    assert st._list_supported is False
+
+
+def test_list_scan_stops_when_paging_stalls_or_runs_long(monkeypatch):
+    monkeypatch.setattr(storage_api, "_load_map", lambda uid: _rowmap(3))
+    monkeypatch.setattr(storage_api, "API_LIST_PAGE_SIZE", 2)
+    monkeypatch.setattr(storage_api, "API_INVOICE_CACHE_TTL_SEC", 0)
+    monkeypatch.setattr(storage_api, "_MAX_LIST_PAGES", 4)
+    calls = []
+
+    def ignores_skip(method, path, json_body=None, params=None):
+        calls.append(path)
+        if path == "/api/v1/invoices":
+            return [_invoice(100), _invoice(101)]
+        inv_id = int(path.rsplit("/", 1)[1])
+        if inv_id == 102:
+            resp = httpx.Response(404, request=httpx.Request("GET", "http://x" + path))
+            raise httpx.HTTPStatusError("gone", request=resp.request, response=resp)
+        return _invoice(inv_id)
+
+    st = storage_api.ApiStorage()
+    monkeypatch.setattr(st, "_ensure", lambda: None)
+    monkeypatch.setattr(st, "_req", ignores_skip)
+    rows = st.get_all_values(_update())
+    # Second page repeats the first: stop there; the missing (deleted) invoice becomes an empty row.
+    assert calls == ["/api/v1/invoices", "/api/v1/invoices", "/api/v1/invoices/102"]
+    assert [r[storage_api.COL_NO - 1] for r in rows[1:]] == ["FV100", "FV101", ""]
+
+    calls.clear()
+
+    def endless(method, path, json_body=None, params=None):
+        calls.append(path)
+        if path == "/api/v1/invoices":
+            return [_invoice(1000 + params["skip"] + i) for i in range(params["limit"])]
+        return _invoice(int(path.rsplit("/", 1)[1]))
+
+    monkeypatch.setattr(st, "_req", endless)
+    st.get_all_values(_update())
+    assert calls.count("/api/v1/invoices") == 4
+    assert len(calls) == 4 + 3
+
+
+def test_async_storage_logs_in_once_and_pages_over_asyncclient(monkeypatch):
+    import asyncio
+
+    monkeypatch.setattr(storage_api, "_load_map", lambda uid: _rowmap(3))
+    monkeypatch.setattr(storage_api, "API_LIST_PAGE_SIZE", 2)
+    monkeypatch.setattr(storage_api, "env", lambda k, d="": {"BOT_API_EMAIL": "bot@x", "BOT_API_PASSWORD": "pw"}.get(k, d))
+    seen = []
+
+    def handler(request: httpx.Request):
+        seen.append(request.url.path)
+        if request.url.path == "/api/v1/auth/login":
+            return httpx.Response(200, json={"access_token": "t", "expires_in": 600})
+        assert request.headers["Authorization"] == "Bearer t"
+        if request.url.path.startswith("/api/v1/invoices/"):
+            return httpx.Response(200, json=_invoice(int(request.url.path.rsplit("/", 1)[1])))
+        skip, limit = int(request.url.params["skip"]), int(request.url.params["limit"])
+        return httpx.Response(200, json=[_invoice(i) for i in range(100 + skip, min(103, 100 + skip + limit))])
+
+    sync = storage_api.ApiStorage()
+    st = storage_api.AsyncApiStorage(sync)
+    real_client = httpx.AsyncClient
+
+    def client(**kw):
+        return real_client(transport=httpx.MockTransport(handler), **kw)
+
+    async def scenario():
+        with monkeypatch.context() as m:
+            m.setattr(storage_api.httpx, "AsyncClient", client)
+            first, second = await asyncio.gather(st.get_all_values(_update()), st.get_row(_update(), 3))
+            await st.aclose()
+        return first, second
+
+    rows, row = asyncio.run(scenario())
+    assert [r[storage_api.COL_NO - 1] for r in rows[1:]] == ["FV100", "FV101", "FV102"]
+    assert row[storage_api.COL_NO - 1] == "FV101"
+    assert seen.count("/api/v1/auth/login") == 1
+    # The sync client reuses the token and the invoice cache the async one filled.
+    assert sync._token == "t"
+    assert sync.get_row(_update(), 4)[storage_api.COL_NO - 1] == "FV102"
+
+
+def test_get_columns_keeps_meta_local_and_selects_invoice_fields(monkeypatch):
+    m = _rowmap(4)
+    m["meta_by_invoice"]["101"]["date"] = "2026-03-02"
+    m["meta_by_invoice"]["103"]["date"] = "2026-03-09"
+    monkeypatch.setattr(storage_api, "_load_map", lambda uid: m)
+    calls = []
+
+    def fake_req(method, path, json_body=None, params=None):
+        calls.append(params)
+        return [_invoice(i) for i in range(100, 104)]
+
+    st = storage_api.ApiStorage()
+    monkeypatch.setattr(st, "_req", fake_req)
+    assert st.get_columns(_update(), [storage_api.COL_COMP]) == ([2, 3, 4, 5], {storage_api.COL_COMP: ["Firma 0", "Firma 1", "Firma 2", "Firma 3"]})
+    assert calls == []
+
+    row_nos, cols = st.get_columns(_update(), [storage_api.COL_GROSS], month="2026-03")
+    assert row_nos == [3, 5] and cols[storage_api.COL_GROSS] == ["12.3", "12.3"]
+    assert calls[0]["fields"] == storage_api._INVOICE_FIELDS
+
+
+def test_async_client_replaced_on_new_base_url_or_loop_is_not_leaked(monkeypatch, caplog):
+    import asyncio
+
+    base = {"url": "http://a"}
+    monkeypatch.setattr(storage_api, "_base_url", lambda: base["url"])
+    st = storage_api.AsyncApiStorage(storage_api.ApiStorage())
+
+    async def switch_url():
+        old = st._client()
+        base["url"] = "http://b"
+        assert st._client() is not old
+        await asyncio.sleep(0)
+        return old
+
+    async def next_loop():
+        return st._client()
+
+    assert asyncio.run(switch_url()).is_closed
+    stale = st._http
+    with caplog.at_level("WARNING", logger="danex.storage_api"):
+        assert asyncio.run(next_loop()) is not stale
+    assert "stopped event loop" in caplog.text
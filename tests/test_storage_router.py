@@ -0,0 +1,192 @@
+from types import SimpleNamespace
+from unittest.mock import patch
+
+import storage_router
+from domain import snapshot_cache
+
+
+class FakeSheets:
+    def __init__(self, rows):
+        self.rows = [list(r) for r in rows]
+        self.reads = 0
+
+    def get_all_values(self, update):
+        self.reads += 1
+        return [list(r) for r in self.rows]
+
+    def get_row(self, update, row_no):
+        self.reads += 1
+        return list(self.rows[row_no - 1]) if row_no <= len(self.rows) else []
+
+    def update_cell(self, update, row_no, col, value):
+        self.rows[row_no - 1][col - 1] = value
+
+    def update_cells(self, update, row_no, cells):
+        for col, value in cells.items():
+            self.rows[row_no - 1][col - 1] = value
+
+    def append_row(self, update, values, value_input_option="USER_ENTERED"):
+        self.rows.append(list(values))
+        return len(self.rows)
+
+
+def _update(uid=1):
+    return SimpleNamespace(effective_user=SimpleNamespace(id=uid))
+
+
+def _fake():
+    return FakeSheets([["data", "numer", "firma"], ["2026-02-01", "FV1", "A"]])
+
+
+def test_snapshot_cache_serves_repeated_reads(monkeypatch):
+    monkeypatch.setattr(snapshot_cache, "STORAGE_CACHE_TTL_SEC", 60)
+    fake = _fake()
+    snapshot_cache.invalidate()
+    with (
+        patch.object(storage_router, "get_storage", return_value=fake),
+        patch.object(storage_router, "_cache_key", return_value="FakeSheets"),
+        patch.object(storage_router, "process_retry_backlog", return_value={}),
+    ):
+        storage_router.get_all_values(_update())
+        storage_router.get_all_values(_update())
+        assert storage_router.get_row(_update(), 2)[2] == "A"
+        assert fake.reads == 1
+
+        v0 = snapshot_cache.version("FakeSheets")
+        storage_router.update_cell(_update(), 2, 3, "B")
+        row_no = storage_router.append_row(_update(), ["2026-02-02", "FV2", "C"])
+        rows = storage_router.get_all_values(_update())
+        assert fake.reads == 1
+        assert rows[1][2] == "B"
+        assert row_no == 3 and rows[2][2] == "C"
+        assert snapshot_cache.version("FakeSheets") == v0 + 2
+
+        storage_router.refresh(_update())
+        assert fake.reads == 2
+
+
+def test_snapshot_cache_disabled_with_zero_ttl(monkeypatch):
+    monkeypatch.setattr(snapshot_cache, "STORAGE_CACHE_TTL_SEC", 0)
+    fake = _fake()
+    with (
+        patch.object(storage_router, "get_storage", return_value=fake),
+        patch.object(storage_router, "_cache_key", return_value="FakeSheets"),
+    ):
+        storage_router.get_all_values(_update())
+        storage_router.get_all_values(_update())
+    assert fake.reads == 2
+
+
+def test_cache_hits_are_counted_in_memory_and_fresh_reads_skip_the_snapshot(monkeypatch):
+    import time
+
+    from domain import metrics
+
+    monkeypatch.setattr(snapshot_cache, "STORAGE_CACHE_TTL_SEC", 60)
+    written = []
+    monkeypatch.setattr(metrics, "_append", written.append)
+    monkeypatch.setattr(metrics, "_counts", {})
+    monkeypatch.setattr(metrics, "_counts_flushed_at", [time.monotonic()])
+    fake = _fake()
+    snapshot_cache.invalidate()
+    with (
+        patch.object(storage_router, "get_storage", return_value=fake),
+        patch.object(storage_router, "_cache_key", return_value="FakeSheets"),
+    ):
+        for _ in range(5):
+            storage_router.get_all_values(_update())
+        assert fake.reads == 1 and not [r for r in written if r.get("hit")]
+        storage_router.get_all_values(_update(), fresh=True)
+        assert fake.reads == 2
+    metrics.flush_counts()
+    assert [r["count"] for r in written if r.get("hit")] == [4]
+
+
+def test_update_cells_failure_is_queued_as_one_entry(monkeypatch):
+    class Broken(FakeSheets):
+        def update_cells(self, update, row_no, cells):
+            raise RuntimeError("quota")
+
+    queued = []
+    monkeypatch.setattr(storage_router, "enqueue", lambda op, payload, error, **kw: queued.append((op, payload)) or "q1")
+    with (
+        patch.object(storage_router, "get_storage", return_value=Broken([["h"]])),
+        patch.object(storage_router, "process_retry_backlog", return_value={}),
+    ):
+        try:
+            storage_router.update_cells(_update(), 2, {4: "10.00", 10: "Sprawdzona"})
+        except RuntimeError:
+            pass
+
+    assert len(queued) == 1
+    op, payload = queued[0]
+    assert op == "update_cells"
+    assert payload["cells"] == {"4": "10.00", "10": "Sprawdzona"}
+
+
+def test_sheets_append_row_reads_row_from_updated_range(monkeypatch):
+    import sheets_service
+
+    sheet = SimpleNamespace(append_row=lambda values, value_input_option: {"updates": {"updatedRange": "'Faktury 2026'!A43:K43"}})
+    monkeypatch.setattr(sheets_service, "ws", lambda: sheet)
+    monkeypatch.setattr(sheets_service, "get_all_values", lambda: (_ for _ in ()).throw(AssertionError("full read")))
+    assert sheets_service.append_row(["2026-02-02"]) == 43
+
+
+def test_open_sheets_circuit_queues_write_without_calling_backend(monkeypatch):
+    from domain import resilience
+
+    class Counting(FakeSheets):
+        calls = 0
+
+        def update_cell(self, update, row_no, col, value):
+            Counting.calls += 1
+            return resilience.retry_call(lambda: (_ for _ in ()).throw(ConnectionError("down")), "update_cell", breaker_name="sheets")
+
+    queued = []
+    monkeypatch.setattr(storage_router, "enqueue", lambda op, payload, error, delay_sec=30: queued.append(delay_sec) or "q1")
+    monkeypatch.setattr(storage_router, "process_queue", lambda *a, **kw: (_ for _ in ()).throw(AssertionError("replayed")))
+    for _ in range(resilience.breaker("sheets").max_failures):
+        resilience.breaker("sheets").record_failure()
+
+    with patch.object(storage_router, "get_storage", return_value=Counting([["h"], ["a"]])):
+        try:
+            storage_router.update_cell(_update(), 2, 1, "x")
+        except resilience.CircuitOpenError:
+            pass
+
+    assert queued and queued[0] >= 30
+    assert storage_router.circuit_stats()["sheets"]["state"] == "open"
+
+
+def test_async_writes_run_off_the_loop_and_patch_the_snapshot(monkeypatch):
+    import asyncio
+    import threading
+
+    fake = _fake()
+    loop_thread = threading.get_ident()
+    writer_threads = []
+    original = fake.update_cells
+
+    def update_cells(update, row_no, cells):
+        writer_threads.append(threading.get_ident())
+        return original(update, row_no, cells)
+
+    fake.update_cells = update_cells
+    monkeypatch.setattr(snapshot_cache, "STORAGE_CACHE_TTL_SEC", 60)
+    snapshot_cache.invalidate()
+
+    async def scenario():
+        await storage_router.aget_all_values(_update())
+        await storage_router.aupdate_cells(_update(), 2, {3: "B"})
+        return await storage_router.aget_all_values(_update())
+
+    with (
+        patch.object(storage_router, "get_storage", return_value=fake),
+        patch.object(storage_router, "process_retry_backlog", return_value={}),
+    ):
+        rows = asyncio.run(scenario())
+
+    assert rows[1][2] == "B"
+    assert fake.reads == 1
+    assert writer_threads and writer_threads[0] != loop_thread
@@ -0,0 +1,170 @@
+import storage_sqlite
+from storage_sqlite import SqliteStorage
+
+HEADER = ["data", "numer", "firma", "brutto", "typ", "vat", "netto", "kat", "user", "status", "plik"]
+
+
+def _row(date, no, comp, gross="", status="Do sprawdzenia"):
+    return [date, no, comp, gross, "VAT", "", "", "inne", "u", status, ""]
+
+
+class FakeSheet:
+    def __init__(self, rows):
+        self.rows = [list(r) for r in rows]
+        self.batches = []
+        self.appends = []
+
+    def get_all_values(self, full=False):
+        return [list(r) for r in self.rows]
+
+    def read_ranges(self, ranges):
+        from gspread.utils import a1_to_rowcol
+
+        out = []
+        for rng in ranges:
+            start, end = (a1_to_rowcol(a) for a in rng.split(":"))
+            row = self.rows[start[0] - 1] if start[0] <= len(self.rows) else []
+            out.append([row[start[1] - 1:end[1]]] if any(row) else [])
+        return out
+
+    def write_ranges(self, data):
+        from gspread.utils import a1_to_rowcol
+
+        self.batches.append(data)
+        for block in data:
+            start = block["range"].split(":")[0]
+            row_no, col = a1_to_rowcol(start)
+            while len(self.rows) < row_no:
+                self.rows.append([""] * len(HEADER))
+            for i, value in enumerate(block["values"][0]):
+                self.rows[row_no - 1][col - 1 + i] = value
+
+    def append_rows(self, rows):
+        # values.append: lands after the last row of the table, whatever is there now.
+        self.appends.append(rows)
+        first = len(self.rows) + 1
+        self.rows.extend(list(r) for r in rows)
+        return first
+
+
+def _mirror(tmp_path, monkeypatch, rows):
+    sheet = FakeSheet([HEADER, *rows])
+    monkeypatch.setattr(storage_sqlite.sheets_service, "get_all_values", sheet.get_all_values)
+    monkeypatch.setattr(storage_sqlite.sheets_service, "read_ranges", sheet.read_ranges)
+    monkeypatch.setattr(storage_sqlite.sheets_service, "write_ranges", sheet.write_ranges)
+    monkeypatch.setattr(storage_sqlite.sheets_service, "append_rows", sheet.append_rows)
+    return SqliteStorage(tmp_path / "mirror.sqlite3"), sheet
+
+
+def test_bootstrap_reads_locally_and_pushes_only_changes(tmp_path, monkeypatch):
+    st, sheet = _mirror(tmp_path, monkeypatch, [_row("2026-02-01", "FV1", "Orlen"), _row("2026-03-02", "FV2", "Lidl")])
+
+    assert st.get_all_values(None) == sheet.get_all_values()
+    assert [r for r, _ in st.select_rows(month="2026-03")] == [3]
+    assert [r for r, _ in st.select_rows(company="orlen")] == [2]
+
+    st.update_cell(None, 2, 4, "10.00")
+    row_no = st.append_row(None, _row("2026-03-05", "FV3", "Aldi", "5.00"))
+    assert row_no == 4
+    assert st.get_row(None, 4)[2] == "Aldi"
+    assert sheet.rows[1][3] == "" and len(sheet.rows) == 3
+    assert st.pending_changes() == 2
+
+    res = st.sync()
+    assert res == {"pulled": 0, "pushed": 2, "pending": 0}
+    assert len(sheet.batches) == 1 and len(sheet.appends) == 1
+    assert [b["range"] for b in sheet.batches[0]] == ["D2"]
+    assert sheet.rows[1][3] == "10.00" and sheet.rows[3][2] == "Aldi"
+
+    assert st.sync() == {"pulled": 0, "pushed": 0, "pending": 0}
+
+
+def test_operator_edit_merges_with_unpushed_local_edit(tmp_path, monkeypatch):
+    st, sheet = _mirror(tmp_path, monkeypatch, [_row("2026-02-01", "FV1", "Orlen")])
+    st.get_all_values(None)
+
+    st.update_cell(None, 2, 10, "Sprawdzona")
+    sheet.rows[1][2] = "ORLEN S.A."  # fixed by hand in the sheet
+    sheet.rows[1][9] = "Nowa"
+
+    assert st.pull() == 1
+    merged = st.get_row(None, 2)
+    assert merged[2] == "ORLEN S.A."
+    assert merged[9] == "Sprawdzona"
+
+    st.push()
+    assert sheet.rows[1][9] == "Sprawdzona"
+    assert st.pending_changes() == 0
+
+
+def test_sheet_append_displaces_pending_local_row(tmp_path, monkeypatch):
+    st, sheet = _mirror(tmp_path, monkeypatch, [_row("2026-02-01", "FV1", "Orlen")])
+    st.get_all_values(None)
+    assert st.append_row(None, _row("2026-02-03", "FV-BOT", "Aldi")) == 3
+    sheet.rows.append(_row("2026-02-02", "FV-HAND", "Lidl"))
+
+    st.sync()
+    assert [r[1] for r in sheet.rows[1:]] == ["FV1", "FV-HAND", "FV-BOT"]
+    assert st.get_all_values(None) == sheet.get_all_values()
+
+
+def test_sorted_sheet_moves_pending_edit_with_its_invoice(tmp_path, monkeypatch):
+    st, sheet = _mirror(tmp_path, monkeypatch, [_row("2026-02-01", "FV1", "A"), _row("2026-02-02", "FV2", "B"), _row("2026-02-03", "FV3", "C")])
+    st.get_all_values(None)
+    st.update_cell(None, 2, 4, "11.00")  # FV1
+    st.update_cell(None, 3, 4, "22.00")  # FV2
+    sheet.rows[1:] = sheet.rows[1:][::-1]  # operator sorts newest first
+    sheet.rows[2][1] = "FV2-poprawiona"  # ...and fixes FV2's number by hand
+
+    st.sync()
+    by_no = {r[1]: r for r in sheet.rows[1:]}
+    assert by_no["FV1"][3] == "11.00"
+    assert by_no["FV3"][3] == "" and by_no["FV2-poprawiona"][3] == ""
+    assert st.get_all_values(None) == sheet.get_all_values()
+
+
+def test_push_holds_edits_for_rows_sorted_after_the_pull(tmp_path, monkeypatch):
+    st, sheet = _mirror(tmp_path, monkeypatch, [_row("2026-02-01", "FV1", "A"), _row("2026-02-02", "FV2", "B")])
+    st.get_all_values(None)
+    st.update_cell(None, 2, 4, "11.00")  # FV1
+    st.pull()
+    sheet.rows[1:] = sheet.rows[1:][::-1]  # sorted after the pull, before the push
+
+    assert st.push() == 0
+    assert sheet.batches == [] and st.pending_changes() == 1
+    st.sync()
+    by_no = {r[1]: r for r in sheet.rows[1:]}
+    assert by_no["FV1"][3] == "11.00" and by_no["FV2"][3] == ""
+    assert st.pending_changes() == 0
+
+
+def test_push_does_not_overwrite_row_appended_in_sheet_meanwhile(tmp_path, monkeypatch):
+    st, sheet = _mirror(tmp_path, monkeypatch, [_row("2026-02-01", "FV1", "A")])
+    st.get_all_values(None)
+    assert st.append_row(None, _row("2026-02-03", "FV-BOT", "Bot")) == 3
+    st.pull()
+    sheet.rows.append(_row("2026-02-02", "FV-HAND", "Lidl"))  # after the pull, before the push
+
+    assert st.push() == 1
+    assert [r[1] for r in sheet.rows[1:]] == ["FV1", "FV-HAND", "FV-BOT"]
+    assert st.get_row(None, 4)[1] == "FV-BOT"
+    st.pull()
+    assert st.get_all_values(None) == sheet.get_all_values()
+    assert st.pending_changes() == 0
+
+
+def test_deleted_sheet_rows_trigger_reload(tmp_path, monkeypatch):
+    st, sheet = _mirror(tmp_path, monkeypatch, [_row("2026-02-01", "FV1", "A"), _row("2026-02-02", "FV2", "B"), _row("2026-02-03", "FV3", "C")])
+    st.get_all_values(None)
+    st.append_row(None, _row("2026-02-04", "FV4", "D"))
+    del sheet.rows[1]
+
+    st.sync()
+    assert [r[1] for r in st.get_all_values(None)[1:]] == ["FV2", "FV3", "FV4"]
+    assert st.get_all_values(None) == sheet.get_all_values()
+
+
+def test_get_columns_selects_month_through_index(tmp_path, monkeypatch):
+    st, _ = _mirror(tmp_path, monkeypatch, [_row("2026-02-01", "FV1", "Orlen", "1"), _row("2026-03-02", "FV2", "Lidl", "2"), _row("2026-03-04", "FV3", "Aldi")])
+    assert st.get_columns(None, [3, 4], month="2026-03") == ([3, 4], {3: ["Lidl", "Aldi"], 4: ["2", ""]})
+    assert st.get_columns(None, [2])[1][2] == ["FV1", "FV2", "FV3"]
@@ -0,0 +1,70 @@
+import asyncio
+
+import pytest
+
+import ocr_service
+from config import COL_COMP, COL_DATE, COL_GROSS, COL_NO
+from domain import supplier_intel
+
+_BUYER = "Nabywca: Danex Sp. z o.o.\nNIP: 999-888-77-66\n"
+
+
+@pytest.fixture
+def templates(tmp_path, monkeypatch):
+    async def boom(text, scope=None):
+        raise AssertionError("AI called")
+
+    monkeypatch.setattr(supplier_intel, "TEMPLATES_FILE", tmp_path / "templates.json")
+    monkeypatch.setattr(ocr_service, "ai_refine_ocr", boom)
+
+
+def _row(date, no, gross, company):
+    row = [""] * 12
+    row[COL_DATE - 1], row[COL_NO - 1], row[COL_GROSS - 1], row[COL_COMP - 1] = date, no, gross, company
+    return row
+
+
+def test_supplier_template_replaces_ai_for_known_layout(templates):
+    first = "FAKTURA VAT Nr FV/12/2026\nData wystawienia: 17.02.2026\nNIP: 123-456-78-90\nRazem do zapłaty\n1 234,56\n"
+    supplier_intel.learn_template(
+        "1234567890", first, {"date": "2026-02-17", "no": "FV/12/2026", "gross": "1234.56", "company": "Danex"}
+    )
+
+    second = first.replace("17.02.2026", "03.03.2026").replace("FV/12/2026", "FV/44/2026").replace("1 234,56", "987,00")
+    fields = asyncio.run(ocr_service.extract_fields(second))
+    assert fields == {"company": "Danex", "date": "2026-03-03", "no": "FV/44/2026", "gross": "987.00"}
+
+
+def test_template_learned_on_acceptance_loses_line_guesses_to_regex(templates):
+    first = "FAKTURA VAT Nr FV/12/2026\nData wystawienia: 17.02.2026\nNIP: 123-456-78-90\nRazem do zapłaty\n1 234,56\n"
+    supplier_intel.learn_accepted(first, _row("2026-02-17", "FV/12/2026", "1234.56", "Danex"))
+
+    # The gross label moved, so the template can only guess by line number; the regex reading wins.
+    second = "FAKTURA VAT Nr FV/44/2026\nData wystawienia: 03.03.2026\nNIP: 123-456-78-90\nDo zapłaty: 987,00 PLN\n5,00\n"
+    anchored, positional = supplier_intel.apply_template("1234567890", second)
+    assert "gross" not in anchored and positional["gross"] == "5.00"
+    fields = asyncio.run(ocr_service.extract_fields(second))
+    assert fields == {"company": "Danex", "date": "2026-03-03", "no": "FV/44/2026", "gross": "987.00"}
+
+
+def test_suppliers_sharing_the_buyer_nip_keep_separate_templates(templates):
+    pge = _BUYER + "Sprzedawca: PGE Obrot SA\nNIP: 111-111-11-11\nFaktura nr E/1/2026\nDo zapłaty: 310,00 PLN\n"
+    supplier_intel.learn_accepted(pge, _row("", "E/1/2026", "310.00", "PGE Obrot SA"))
+
+    orange = _BUYER + "Sprzedawca: Orange Polska S.A.\nNIP: 222-222-22-22\nRachunek 55/2026\nRazem: 89,99 PLN\n"
+    assert supplier_intel.supplier_nip(pge) == "1111111111"
+    assert supplier_intel.supplier_nip(orange) == "2222222222"
+    assert supplier_intel.apply_template(supplier_intel.supplier_nip(orange), orange) == ({}, {})
+    assert "1111111111" in supplier_intel._load_templates() and "9998887766" not in supplier_intel._load_templates()
+
+
+def test_own_nip_is_never_the_supplier_and_company_needs_an_anchor(templates, monkeypatch):
+    monkeypatch.setattr(supplier_intel, "OWN_NIPS", frozenset({"9998887766"}))
+    # No seller keyword: the buyer's NIP comes first and must be skipped.
+    pge = "NIP: 999-888-77-66\nPGE Obrot SA NIP: 111-111-11-11\nFaktura nr E/1/2026\nDo zapłaty: 310,00 PLN\n"
+    assert supplier_intel.supplier_nip(pge) == "1111111111"
+    supplier_intel.learn_accepted(pge, _row("", "E/1/2026", "310.00", "PGE Obrot SA"))
+
+    unrelated = "NIP: 111-111-11-11\nzupelnie inny uklad\n"
+    anchored, _ = supplier_intel.apply_template("1111111111", unrelated)
+    assert "company" not in anchored
@@ -0,0 +1,47 @@
+from domain import text_scan
+from domain.payments import extract_iban
+from domain.premium_ocr import extract_currency, extract_nip
+from ocr_service import _extract_fields_regex, normalize_date
+
+_INVOICE = """FAKTURA VAT Nr FV/12/2026
+Data wystawienia: 17.02.2026
+Sprzedawca:
+Hurtownia Danex Sp. z o.o.
+NIP: 123-456-78-90
+Konto: PL 61 1090 1014 0000 0712 1981 2874
+1 Towar 3 szt 100,00 zł
+Razem: 1 234,56
+Do zapłaty 1 234,56 PLN
+"""
+
+
+def test_scan_extracts_all_fields_in_one_pass():
+    text_scan.scan.cache_clear()
+    assert _extract_fields_regex(_INVOICE) == {
+        "date": "2026-02-17",
+        "no": "FV/12/2026",
+        "company": "Hurtownia Danex Sp. z o.o.",
+        "gross": "1234.56",
+    }
+    assert extract_nip(_INVOICE) == "1234567890"
+    assert extract_iban(_INVOICE) == "PL61109010140000071219812874"
+    assert extract_currency(_INVOICE) == "PLN"
+    assert text_scan.scan.cache_info().misses == 1
+
+
+def test_spaced_digit_runs_are_not_an_account_number():
+    assert extract_iban("Lp 1 2 3 4 5 6 7 8 9 10 11 12 13 14 15 16 17 18\n17 02 2026 12-345 600 700 800") == ""
+    assert extract_iban("rachunek 61109010140000071219812874") == "PL61109010140000071219812874"
+    assert extract_iban("PL61-1090-1014-0000-0712-1981-2874") == "PL61109010140000071219812874"
+    assert extract_iban("PL61 1090 1014 0000 0712 1981 2874") == "PL61109010140000071219812874"
+
+
+def test_quantity_column_is_not_glued_onto_price():
+    assert _extract_fields_regex("12 pozycja 4 999,00 zł\nsuma 5 000,00")["gross"] == "5000.00"
+
+
+def test_date_fallbacks():
+    assert text_scan.invoice_date("wystawiono 2026/03/01, termin 2026-03-15") == "2026-03-01"
+    assert text_scan.invoice_date("Data: 31.02.2026 albo 01.03.2026") == "2026-03-01"
+    assert normalize_date("17.02.2026") == "2026-02-17"
+    assert normalize_date("2026-02.17") == ""